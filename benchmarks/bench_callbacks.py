@@ -0,0 +1,138 @@
+"""Latency of service executions dispatched to another node and completed through its batched callbacks (user-016)
+
+Starts two nodes, each a webserver with a daemon, on scratch datastores. Node A runs workflows whose
+service task is provided by node B, B pushes the results back to A when they end.
+
+    python benchmarks/bench_callbacks.py --executions 1 20 200
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from common import INT_DATATYPE, STATE_ENDED, TASK_SCRIPT, TASK_SERVICE, catalog, chain, datastore, execution, running, task
+
+UNIFORM_SERVICE_ID = 77
+
+
+def freePort(kind=socket.SOCK_STREAM):
+    sock = socket.socket(socket.AF_INET, kind)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def serveNode(path, port, wakeupPort, registryCache, reconcileInterval):
+    """Runs the webserver of a node with its daemon on a thread, until the process is terminated"""
+    import logging
+    # importing the webserver sets it up in the working directory
+    os.chdir(os.path.dirname(path))
+    import daemon
+    import wakeup
+    import webserver
+    sys.stdout = open(os.devnull, "w")
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    address = ("127.0.0.1", wakeupPort)
+    webserver.db_name = path
+    webserver.registry_cache = registryCache
+    webserver.setup()
+    webserver.notify = lambda: wakeup.notify(address, 1)
+
+    def work():
+        jallad = daemon.Jallad(db_name=path, registry_cache=registryCache, callback_address="http://127.0.0.1:"+str(port),
+                               reconcile_interval=reconcileInterval)
+        jallad.start(0.5, wakeup_address=address, metrics_interval=0)
+    threading.Thread(target=work, name="node-daemon", daemon=True).start()
+    webserver.app.run(port=port, threaded=True)
+
+
+def waitForPort(port, timeout=30):
+    deadline = time.time()+timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), 1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("node on port "+str(port)+" didn't start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--executions", type=int, nargs="+", default=[1, 20, 200],
+                        help="workflow executions started at once on node A, one round per count")
+    parser.add_argument("--reconcile-interval", type=float, default=60,
+                        help="seconds before node A polls B for an execution whose callback didn't arrive")
+    parser.add_argument("--timeout", type=float, default=120,
+                        help="seconds a round may take")
+    options = parser.parse_args()
+    import wakeup
+    with tempfile.TemporaryDirectory() as directory:
+        registryCache = catalog(directory, [INT_DATATYPE])
+        portA, portB = freePort(), freePort()
+        wakeupA, wakeupB = freePort(socket.SOCK_DGRAM), freePort(
+            socket.SOCK_DGRAM)
+        pathA, pathB = os.path.join(
+            directory, "a.db"), os.path.join(directory, "b.db")
+        db = datastore(pathB)
+        cur = db.cursor()
+        workflowB = chain(cur, 1, 1, [task(
+            cur, "increment", TASK_SCRIPT, 1, 1, code="output = input + 1")])
+        cur.execute("INSERT INTO Service (Title,NodeId,WorkflowId,UniformServiceId) VALUES ('increment',0,?,?);", [
+            workflowB, UNIFORM_SERVICE_ID])
+        serviceB = cur.lastrowid
+        db.commit()
+        db.close()
+        db = datastore(pathA)
+        cur = db.cursor()
+        cur.execute(
+            "INSERT INTO Node (Title,IpAddress) VALUES ('b',?);", ["127.0.0.1:"+str(portB)])
+        cur.execute("INSERT INTO Service (Title,NodeId,NodeServiceId,UniformServiceId) VALUES ('increment',?,?,?);", [
+            cur.lastrowid, serviceB, UNIFORM_SERVICE_ID])
+        serviceTask = task(cur, "remote increment", TASK_SERVICE,
+                           1, 1, uniformServiceId=UNIFORM_SERVICE_ID)
+        workflowA = chain(cur, 1, 1, [serviceTask])
+        db.commit()
+        context = multiprocessing.get_context("spawn")
+        nodes = [context.Process(target=serveNode, args=(path, port, wakeupPort, registryCache, options.reconcile_interval))
+                 for path, port, wakeupPort in [(pathA, portA, wakeupA), (pathB, portB, wakeupB)]]
+        for node in nodes:
+            node.start()
+        try:
+            waitForPort(portA)
+            waitForPort(portB)
+            for executions in options.executions:
+                first = execution(cur, workflowA, 1, [0])
+                for i in range(executions-1):
+                    execution(cur, workflowA, 1, [i+1])
+                db.commit()
+                start = time.perf_counter()
+                wakeup.notify(("127.0.0.1", wakeupA), 1)
+                while running(pathA) > 0 and time.perf_counter()-start < options.timeout:
+                    time.sleep(0.005)
+                elapsed = time.perf_counter()-start
+                latencies = sorted([row[0] for row in cur.execute("SELECT TaskInstanceExecution.EndTime-TaskInstanceExecution.StartTime FROM TaskInstanceExecution JOIN TaskInstance ON TaskInstance.Id=TaskInstanceExecution.TaskInstanceId WHERE TaskInstance.TaskId=? AND TaskInstanceExecution.WorkflowExecutionId>=? AND TaskInstanceExecution.ExecutionState IN (?,4);", [
+                    serviceTask, first, STATE_ENDED])])
+                print("%4d executions: all ended in %.2f s, %d service executions ended, accepted to callback median %.1f ms, p90 %.1f ms, max %.1f ms" % (
+                    executions, elapsed, len(latencies), 1000*statistics.median(latencies), 1000*latencies[int(len(latencies)*0.9)], 1000*latencies[-1]))
+            time.sleep(1)
+            nodeB = sqlite3.connect(pathB)
+            print("callbacks left in B's outbox: %d" % nodeB.execute(
+                "SELECT COUNT(*) FROM CallbackOutbox;").fetchone()[0])
+            nodeB.close()
+        finally:
+            db.close()
+            for node in nodes:
+                node.terminate()
+                node.join()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
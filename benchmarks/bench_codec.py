@@ -0,0 +1,78 @@
+"""System task input and output through the compiled codec on multi-megabyte structures (user-014)
+
+An int array and a long text are sent through cat and parsed back, as text tokens and as packed blobs.
+
+    python benchmarks/bench_codec.py --elements 1000000
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+
+import common  # noqa: F401, puts the repo on the path
+
+from codec import encodeText
+from daemon import Jallad
+
+INT, ARRAY, TEXT = 1, 2, 3
+
+
+def timedRun(jallad, task, inputData, traceMemory):
+    """Runs a system task, timed and, as tracing slows it down, in a second run traced
+
+    :return: the output, seconds and peak traced bytes, None if not traced
+    """
+    start = time.perf_counter()
+    output = jallad.runSystem(task, inputData)
+    elapsed = time.perf_counter()-start
+    if not traceMemory:
+        return output, elapsed, None
+    tracemalloc.start()
+    jallad.runSystem(task, inputData)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return output, elapsed, peak
+
+
+def report(encoding, elapsed, peak):
+    print("  %-6s through cat: %.2f s%s" % (encoding, elapsed,
+          "" if peak is None else ", peak traced memory %.1f MB" % (peak/1e6)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--elements", type=int, default=1000000,
+                        help="ints in the array, the text is about as many characters")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="also report the peak memory traced while running each task")
+    options = parser.parse_args()
+    types = {
+        INT: {'id': INT, 'base': 0, 'length': 0, 'subDataTypes': []},
+        ARRAY: {'id': ARRAY, 'base': 3, 'length': options.elements, 'subDataTypes': [{'subDataTypeId': INT}]},
+        TEXT: {'id': TEXT, 'base': 2, 'length': 0, 'subDataTypes': []},
+    }
+    jallad = Jallad.__new__(Jallad)
+    jallad.layouts = {}
+    jallad.programs = {}
+    jallad.dataType = types.get
+    ints = {'dataTypeId': ARRAY, 'values': list(range(options.elements))}
+    text = {'dataTypeId': TEXT, 'values': [
+        "héllo wörld "*(options.elements//12)]}
+    size = len(encodeText(jallad.dataProgram(ARRAY), ints['values']))
+    print("int array of %d elements, %.1f MB of text" %
+          (options.elements, size/1e6))
+    for encoding in ["text", "binary"]:
+        output, elapsed, peak = timedRun(
+            jallad, {'command': "cat", 'outputDataTypeId': ARRAY, 'encoding': encoding}, ints, options.trace_memory)
+        assert output == ints['values'], encoding+" int array changed on its way through cat"
+        report(encoding, elapsed, peak)
+    print("text of %d characters" % len(text['values'][0]))
+    for encoding in ["text", "binary"]:
+        output, elapsed, peak = timedRun(
+            jallad, {'command': "cat", 'outputDataTypeId': TEXT, 'encoding': encoding}, text, options.trace_memory)
+        assert output == text['values'], encoding+" text changed on its way through cat"
+        report(encoding, elapsed, peak)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
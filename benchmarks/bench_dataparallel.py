@@ -0,0 +1,86 @@
+"""Map, filter and reduce tasks over a large array with an increasing number of element workers (user-011)
+
+    python benchmarks/bench_dataparallel.py --elements 100000 --work 200 --workers 1 2 4
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+
+from common import INT_DATATYPE, TASK_FILTER, TASK_MAP, TASK_REDUCE, TASK_SCRIPT, catalog, chain, datastore, execution, runDaemon, task
+
+ARRAY = 2
+
+
+def expected(name, elements):
+    values = list(range(elements))
+    if name == "map":
+        return [value*2 for value in values]
+    if name == "filter":
+        return [value for value in values if value % 2 == 0]
+    return [sum(values)]
+
+
+def run(directory, elements, work, workers, chunkSize):
+    """Runs one map, one filter and one reduce workflow at once
+
+    :return: seconds until all three ended, and the workflows whose output was wrong
+    """
+    path = os.path.join(directory, "dataparallel.db")
+    db = datastore(path)
+    cur = db.cursor()
+    # every element script spins a little before its actual work, so that the elements cost something
+    spin = "total = 0\nfor k in range("+str(work)+"):\n    total += k\n"
+    chunk = {} if chunkSize is None else {'chunkSize': chunkSize}
+    double = task(cur, "double", TASK_SCRIPT, 1, 1,
+                  code=spin+"output = input * 2")
+    even = task(cur, "even", TASK_SCRIPT, 1, 1,
+                code=spin+"output = input % 2 == 0")
+    add = task(cur, "add", TASK_SCRIPT, 1, 1,
+               code=spin+"output = accumulator + input")
+    workflows = {
+        'map': chain(cur, ARRAY, ARRAY, [task(cur, "map", TASK_MAP, ARRAY, ARRAY, subTaskId=double, **chunk)]),
+        'filter': chain(cur, ARRAY, ARRAY, [task(cur, "filter", TASK_FILTER, ARRAY, ARRAY, subTaskId=even, **chunk)]),
+        'reduce': chain(cur, ARRAY, 1, [task(cur, "reduce", TASK_REDUCE, ARRAY, 1, subTaskId=add, initial=0, **chunk)]),
+    }
+    for workflowId in workflows.values():
+        execution(cur, workflowId, ARRAY, range(elements))
+    db.commit()
+    db.close()
+    arrayDataType = {'id': ARRAY, 'base': 3, 'length': elements,
+                     'subDataTypes': [{'subDataTypeId': 1, 'title': 'value'}], 'title': 'values'}
+    elapsed = runDaemon(path, catalog(directory, [INT_DATATYPE, arrayDataType]),
+                        map_workers=workers)
+    db = sqlite3.connect(path)
+    wrong = []
+    for name, workflowId in workflows.items():
+        outputs = [int(float(row[0])) for row in db.execute("SELECT UnitData.Value FROM WorkflowExecution JOIN UnitData ON UnitData.DataId=WorkflowExecution.OutputDataId WHERE WorkflowExecution.WorkflowId=? ORDER BY UnitData.Id;", [workflowId])]
+        if outputs != expected(name, elements):
+            wrong.append(name)
+    db.close()
+    return elapsed, wrong
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--elements", type=int, default=100000)
+    parser.add_argument("--work", type=int, default=200,
+                        help="loop iterations every element script spins")
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted(set([1, os.cpu_count() or 1])))
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="elements per chunk, by default every worker gets a few chunks")
+    options = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        baseline = None
+        for workers in options.workers:
+            elapsed, wrong = run(directory, options.elements,
+                                 options.work, workers, options.chunk_size)
+            baseline = baseline or elapsed
+            print("%2d workers: map, filter and reduce over %d elements in %.2f s, speedup %.2f%s" % (
+                workers, options.elements, elapsed, baseline/elapsed, ", wrong output of "+", ".join(wrong) if wrong else ""))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,46 @@
+"""Web tasks of many queued workflow executions sent through the pooled HTTP engine to a slow stub server (user-004)
+
+    python benchmarks/bench_http.py --executions 200 --latency 0.05
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+from aiohttp import web
+
+from common import INT_DATATYPE, TASK_WEB, catalog, chain, datastore, durations, execution, runDaemon, stubServers, summary, task
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--executions", type=int, default=200,
+                        help="workflow executions queued at once, each running one web task")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="seconds the stub server takes to answer")
+    options = parser.parse_args()
+
+    async def increment(request):
+        await asyncio.sleep(options.latency)
+        return web.json_response(await request.json()+1)
+    url = stubServers(1, lambda index: [("POST", "/increment", increment)])[0]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "http.db")
+        db = datastore(path)
+        cur = db.cursor()
+        taskId = task(cur, "increment", TASK_WEB, 1, 1,
+                      method="POST", url=url+"/increment", sendBody=1)
+        workflowId = chain(cur, 1, 1, [taskId])
+        for run in range(options.executions):
+            execution(cur, workflowId, 1, [run])
+        db.commit()
+        db.close()
+        elapsed = runDaemon(path, catalog(directory, [INT_DATATYPE]))
+        seconds = durations(path)
+    print("%d web-task executions at %.0f ms latency: total %.2f s (%.2f s if sent one at a time), per execution %s, %d ended" % (
+        options.executions, 1000*options.latency, elapsed, options.executions*options.latency, summary(seconds), len(seconds)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
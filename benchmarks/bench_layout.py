@@ -0,0 +1,77 @@
+"""Data index extraction and partial index merging on a structure with thousands of leaves (user-005)
+
+    python benchmarks/bench_layout.py --elements 1000 --edges 20
+"""
+import argparse
+import sys
+import time
+
+import common  # noqa: F401, puts the repo on the path
+
+from daemon import Jallad
+from layout import compileLayout
+
+INT, PAIR, ELEMENT, ARRAY = 1, 2, 3, 4
+
+
+def dataTypes(elements):
+    """An array of elements holding a pair of (int, int) and an int, 5 leaves each"""
+    return {
+        INT: {'id': INT, 'base': 0, 'length': 0, 'subDataTypes': []},
+        PAIR: {'id': PAIR, 'base': 3, 'length': 2, 'subDataTypes': [{'subDataTypeId': INT}, {'subDataTypeId': INT}]},
+        ELEMENT: {'id': ELEMENT, 'base': 3, 'length': 1, 'subDataTypes': [{'subDataTypeId': PAIR}, {'subDataTypeId': INT}]},
+        ARRAY: {'id': ARRAY, 'base': 3, 'length': elements, 'subDataTypes': [{'subDataTypeId': ELEMENT}]},
+    }
+
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        result = function()
+    return (time.perf_counter()-start)/repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--elements", type=int, default=1000)
+    parser.add_argument("--edges", type=int, default=20,
+                        help="edges merged into the array, each carrying one element")
+    parser.add_argument("--repeat", type=int, default=1000)
+    options = parser.parse_args()
+    types = dataTypes(options.elements)
+    jallad = Jallad.__new__(Jallad)
+    jallad.layouts = {}
+    jallad.dataType = types.get
+    data = {'dataTypeId': ARRAY, 'values': list(
+        range(5*options.elements))}
+    # edges carry every few elements in reverse order, the merge puts them back in layout order
+    step = max(1, options.elements//options.edges)
+    edges = [{'dataIndex2': [element+1, 1], 'data1': jallad.dataUsingDataIndex(data, [element+1, 1])}
+             for element in reversed(range(0, options.elements, step))][:options.edges]
+    jallad.layouts = {}
+
+    def extractAndMerge():
+        jallad.dataUsingDataIndex(data, [options.elements//2, 1, 1, 1])
+        return jallad.mergePartialIndexing(ARRAY, edges)
+
+    def uncached():
+        jallad.layouts = {}
+        return extractAndMerge()
+    compiled, layout = timed(lambda: compileLayout(
+        types.get, ARRAY), max(1, options.repeat//100))
+    first, merged = timed(uncached, max(1, options.repeat//100))
+    cached, merged = timed(extractAndMerge, options.repeat)
+    extraction, extracted = timed(lambda: jallad.dataUsingDataIndex(
+        data, [options.elements//2, 1, 1, 1]), options.repeat)
+    assert merged == sorted(merged) and len(merged) == 5*len(edges)
+    assert extracted == list(
+        range(5*(options.elements//2-1), 5*(options.elements//2-1)+4))
+    print("%d leaves, %d layout paths: compile %.2f ms" % (
+        layout['leafCount'], len(layout['order']), 1000*compiled))
+    print("one extraction plus a %d-edge merge: %.2f ms with compilation, %.1f us cached" % (
+        len(edges), 1000*first, 1e6*cached))
+    print("one extraction, cached: %.1f us" % (1e6*extraction))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
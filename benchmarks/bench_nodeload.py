@@ -0,0 +1,85 @@
+"""Service dispatch to many stub nodes in bursts, picking nodes from the cached node loads (user-015)
+
+Every stub node answers after a set latency and counts a started execution in its queue for a while.
+
+    python benchmarks/bench_nodeload.py --nodes 50 --dispatches 1000 --burst 50
+"""
+import argparse
+import asyncio
+import collections
+import statistics
+import sys
+import time
+
+from aiohttp import web
+
+from common import stubServers
+
+from daemon import Jallad
+from httpengine import HttpEngine
+from nodeload import POLICY_LEAST_LOADED, POLICY_TWO_CHOICES, NodeLoad
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--nodes", type=int, default=50)
+    parser.add_argument("--dispatches", type=int, default=1000)
+    parser.add_argument("--burst", type=int, default=50,
+                        help="dispatches sent at once")
+    parser.add_argument("--latency", type=float, default=0.005,
+                        help="seconds a stub node takes to answer a request")
+    parser.add_argument("--service-time", type=float, default=0.5,
+                        help="seconds a started execution stays in a stub node's queue")
+    options = parser.parse_args()
+    queued = collections.Counter()
+    started = collections.Counter()
+
+    def routes(index):
+        async def queueCount(request):
+            await asyncio.sleep(options.latency)
+            return web.json_response({'count': queued[index]})
+
+        async def start(request):
+            await asyncio.sleep(options.latency)
+            queued[index] += 1
+            started[index] += 1
+            asyncio.get_running_loop().call_later(
+                options.service_time, queued.subtract, [index])
+            return web.json_response({'workflowExecutionId': started[index]})
+        return [("GET", "/service/queueCount", queueCount), ("POST", "/service/{id}/start", start)]
+    urls = stubServers(options.nodes, routes)
+    nodes = [{'id': index+1, 'ipAddress': url, 'workflowId': 0, 'nodeServiceId': 1}
+             for index, url in enumerate(urls)]
+    for policy in [POLICY_TWO_CHOICES, POLICY_LEAST_LOADED]:
+        started.clear()
+        jallad = Jallad.__new__(Jallad)
+        jallad.callback_address = None
+        jallad.http = HttpEngine(limit_per_host=64)
+        jallad.node_load = NodeLoad(jallad.http, policy=policy)
+        latencies = []
+
+        async def dispatch(taskInstanceExecutionId):
+            start = time.perf_counter()
+            await jallad.dispatchService({'uniformServiceId': 1, 'taskInstanceExecutionId': taskInstanceExecutionId}, {'values': [1]}, nodes)
+            latencies.append(time.perf_counter()-start)
+
+        async def bursts():
+            for first in range(0, options.dispatches, options.burst):
+                await asyncio.gather(*[dispatch(taskInstanceExecutionId)
+                                       for taskInstanceExecutionId in range(first, min(first+options.burst, options.dispatches))])
+            # the daemon refreshes the loads for as long as it runs, the benchmark stops once it dispatched
+            jallad.node_load.refresher.cancel()
+        start = time.perf_counter()
+        jallad.http.submit(bursts()).result()
+        elapsed = time.perf_counter()-start
+        jallad.http.close()
+        latencies.sort()
+        starts = [started[index] for index in range(options.nodes)]
+        print("%-5s %d dispatches to %d nodes: total %.2f s, latency median %.1f ms, p99 %.1f ms, starts per node %d-%d" % (
+            policy, options.dispatches, options.nodes, elapsed, 1000 *
+            statistics.median(latencies), 1000*latencies[int(len(latencies)*0.99)],
+            min(starts), max(starts)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
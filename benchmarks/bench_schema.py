@@ -0,0 +1,103 @@
+"""Idle daemon tick against a growing history of MARKED executions, with and without the schema's indexes (user-007)
+
+The history is written in the first schema version, with TEXT timestamps, and the migration to the
+latest version is timed as well.
+
+    python benchmarks/bench_schema.py 1000 10000 100000
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import common  # noqa: F401, puts the repo on the path
+
+import schema
+from daemon import Jallad
+
+STATE_MARKED = 4
+
+
+def populate(path, executions):
+    """Writes a history of MARKED executions of a 3 task instance workflow in schema version 1"""
+    db = sqlite3.connect(path)
+    cur = db.cursor()
+    schema.createTables(cur)
+    cur.execute("PRAGMA user_version=1;")
+    cur.execute(
+        "INSERT INTO Workflow (Title,InputDataTypeId,OutputDataTypeId) VALUES ('history',1,1);")
+    cur.execute(
+        "INSERT INTO Task (Title,Type,InputDataTypeId,OutputDataTypeId) VALUES ('script',5,1,1);")
+    for taskId in [0, 1, 0]:
+        cur.execute(
+            "INSERT INTO TaskInstance (WorkflowId,TaskId) VALUES (1,?);", [taskId])
+    cur.execute(
+        "INSERT INTO Edge (WorkflowId,TaskInstanceId1,TaskInstanceId2) VALUES (1,1,2);")
+    cur.execute(
+        "INSERT INTO Edge (WorkflowId,TaskInstanceId1,TaskInstanceId2) VALUES (1,2,3);")
+    now = str(time.time())
+    cur.executemany("INSERT INTO Data (Title,DataTypeId,Created) VALUES ('history',1,?);", [
+        (now,) for i in range(executions)])
+    cur.executemany("INSERT INTO UnitData (DataId,Value) VALUES (?,?);", [
+        (i//3+1, i) for i in range(3*executions)])
+    cur.executemany("INSERT INTO WorkflowExecution (WorkflowId,EntryTime,InputDataId,ExecutionState,StartTime,OutputDataId,EndTime) VALUES (1,?,?,?,?,?,?);", [
+        (now, i+1, STATE_MARKED, now, i+1, now) for i in range(executions)])
+    cur.executemany("INSERT INTO TaskInstanceExecution (WorkflowExecutionId,TaskInstanceId,EntryTime,InputDataId,ExecutionState,StartTime,OutputDataId,EndTime) VALUES (?,?,?,?,?,?,?,?);", [
+        (i//3+1, i % 3+1, now, i//3+1, STATE_MARKED, now, i//3+1, now) for i in range(3*executions)])
+    db.commit()
+    db.close()
+
+
+def idleTick(path, ticks):
+    """Milliseconds per tick of a daemon with nothing to run"""
+    jallad = Jallad(db_name=path, registry_cache=None)
+    try:
+        jallad.tick()
+        start = time.perf_counter()
+        for i in range(ticks):
+            jallad.tick()
+        return 1000*(time.perf_counter()-start)/ticks
+    finally:
+        jallad.http.close()
+        jallad.script_pool.close()
+        jallad.db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("executions", type=int, nargs="*", default=[1000, 10000, 100000],
+                        help="workflow executions in the history, each with 3 task instance executions")
+    parser.add_argument("--ticks", type=int, default=20)
+    options = parser.parse_args()
+    print("executions  task executions  without indexes  with indexes  migration")
+    with tempfile.TemporaryDirectory() as directory:
+        for executions in options.executions:
+            path = os.path.join(directory, "history.db")
+            unindexed = os.path.join(directory, "unindexed.db")
+            for stale in [path, unindexed]:
+                for suffix in ["", "-wal", "-shm"]:
+                    if os.path.exists(stale+suffix):
+                        os.remove(stale+suffix)
+            populate(path, executions)
+            start = time.perf_counter()
+            db = schema.connect(path)
+            schema.migrate(db)
+            migration = time.perf_counter()-start
+            db.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+            db.close()
+            shutil.copyfile(path, unindexed)
+            db = sqlite3.connect(unindexed)
+            # every index the migrations created, the ones SQLite keeps for its own constraints have no sql
+            for row in db.execute("SELECT name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL;").fetchall():
+                db.execute("DROP INDEX "+row[0]+";")
+            db.commit()
+            db.close()
+            print("%10d  %15d  %12.2f ms  %9.2f ms  %7.2f s" % (executions, 3*executions,
+                                                                 idleTick(unindexed, options.ticks), idleTick(path, options.ticks), migration))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""Latency of a deep chain of script tasks with the daemon polling and woken by its own state transitions (user-001)
+
+Also checks that one notification wakes every daemon worker listening from the wakeup address on.
+
+    python benchmarks/bench_wakeup.py --steps 10 --runs 1 --sleep-interval 0.5
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from common import INT_DATATYPE, TASK_SCRIPT, catalog, chain, datastore, durations, execution, runDaemon, summary, task
+
+from wakeup import WakeupListener, notify, workerAddress
+
+
+def chainLatency(directory, steps, runs, sleep_interval, event_driven):
+    path = os.path.join(directory, "wakeup.db")
+    db = datastore(path)
+    cur = db.cursor()
+    taskId = task(cur, "increment", TASK_SCRIPT, 1, 1, code="output = input + 1")
+    workflowId = chain(cur, 1, 1, [taskId]*steps)
+    for run in range(runs):
+        execution(cur, workflowId, 1, [run])
+    db.commit()
+    db.close()
+    elapsed = runDaemon(path, catalog(directory, [INT_DATATYPE]),
+                        sleep_interval=sleep_interval, event_driven=event_driven)
+    return elapsed, durations(path)
+
+
+def wokenWorkers(workers, address=("127.0.0.1", 5902)):
+    listeners = [WakeupListener(workerAddress(index, address))
+                 for index in range(workers)]
+    try:
+        start = time.perf_counter()
+        notify(address)
+        sent = time.perf_counter()-start
+        return sum(1 for listener in listeners if listener.wait(0.1)), sent
+    finally:
+        for listener in listeners:
+            listener.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--steps", type=int, default=10,
+                        help="script tasks in the chain")
+    parser.add_argument("--runs", type=int, default=1,
+                        help="executions of the chain, run concurrently")
+    parser.add_argument("--sleep-interval", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=4,
+                        help="worker listeners a notification must wake")
+    options = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        for name, event_driven in [("polling", False), ("event-driven", True)]:
+            elapsed, seconds = chainLatency(
+                directory, options.steps, options.runs, options.sleep_interval, event_driven)
+            print("%-12s %d-step chain x %d: total %.2f s, per execution %s" %
+                  (name, options.steps, options.runs, elapsed, summary(seconds)))
+    woken, sent = wokenWorkers(options.workers)
+    print("notify woke %d of %d worker listeners in %.2f ms" %
+          (woken, options.workers, 1000*sent))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""Requests per second the webserver answers on /workflow, /task and /data/<id> (user-018)
+
+Each path is measured in process through Flask's test client, and over HTTP against the threaded
+development server with several client threads.
+
+    python benchmarks/bench_webserver.py --seconds 5 --clients 8
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+from werkzeug.serving import make_server
+
+from common import INT_DATATYPE, ROOT, TASK_SYSTEM, catalog, data, datastore, task
+
+
+def seed(path, workflows, tasks):
+    """Writes workflows, tasks with 5 params each and a Data of 100 values, the Data id is 1"""
+    db = datastore(path)
+    cur = db.cursor()
+    data(cur, 1, range(100), "values")
+    for i in range(workflows):
+        cur.execute("INSERT INTO Workflow (Title,InputDataTypeId,OutputDataTypeId) VALUES (?,1,1);", [
+            "workflow"+str(i)])
+    for i in range(tasks):
+        task(cur, "task"+str(i), TASK_SYSTEM, 1, 1, **dict([("param"+str(k), "value") for k in range(5)]))
+    db.commit()
+    db.close()
+
+
+def inProcess(webserver, path, seconds):
+    client = webserver.app.test_client()
+    client.get(path)
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter()-start < seconds:
+        if client.get(path).status_code == 200:
+            count += 1
+    return count/(time.perf_counter()-start)
+
+
+def overHttp(url, seconds, clients):
+    """Requests per second answered with 200 to several client threads, and the count of other answers"""
+    counts = []
+    errors = []
+    stop = time.time()+seconds
+
+    def client():
+        session = requests.Session()
+        count = 0
+        error = 0
+        while time.time() < stop:
+            if session.get(url).status_code == 200:
+                count += 1
+            else:
+                error += 1
+        counts.append(count)
+        errors.append(error)
+    threads = [threading.Thread(target=client) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts)/seconds, sum(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--seconds", type=float, default=5,
+                        help="seconds each path is measured for")
+    parser.add_argument("--clients", type=int, default=8,
+                        help="client threads sending requests to the development server")
+    parser.add_argument("--workflows", type=int, default=50)
+    parser.add_argument("--tasks", type=int, default=200)
+    options = parser.parse_args()
+    paths = ["/workflow", "/task", "/data/1"]
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory() as directory:
+        registryCache = catalog(directory, [INT_DATATYPE])
+        # importing the webserver sets it up in the working directory
+        os.chdir(directory)
+        import webserver
+        webserver.db_name = os.path.join(directory, "webserver.db")
+        webserver.registry_cache = registryCache
+        seed(webserver.db_name, options.workflows, options.tasks)
+        webserver.setup()
+        print("in process (test client)")
+        for path in paths:
+            print("  %-10s %7.0f req/s" %
+                  (path, inProcess(webserver, path, options.seconds)))
+        server = make_server("127.0.0.1", 0, webserver.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print("development server, %d client threads" % options.clients)
+        try:
+            for path in paths:
+                rate, errors = overHttp(
+                    "http://127.0.0.1:"+str(server.server_port)+path, options.seconds, options.clients)
+                print("  %-10s %7.0f req/s, %d errors" %
+                      (path, rate, errors))
+        finally:
+            server.shutdown()
+            webserver.pool.close()
+            webserver.read_only_pool.close()
+            webserver.registry.stop()
+            os.chdir(ROOT)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
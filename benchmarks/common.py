@@ -0,0 +1,200 @@
+"""Helpers shared by the benchmarks: scratch datastores, a persisted data type catalog and daemon runs"""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import schema  # noqa: E402
+
+TASK_SYSTEM = 0
+TASK_SERVICE = 1
+TASK_WORKFLOW = 2
+TASK_WEB = 3
+TASK_SCRIPT = 5
+TASK_MAP = 7
+TASK_REDUCE = 8
+TASK_FILTER = 9
+
+STATE_LOADED = 1
+STATE_ENDED = 3
+STATE_FAILED = -2
+
+INT_DATATYPE = {'id': 1, 'base': 0, 'length': 0,
+                'subDataTypes': [], 'title': 'int'}
+
+
+def datastore(path):
+    """Opens a new migrated datastore at path, removing the one left there by a previous run"""
+    for suffix in ["", "-wal", "-shm"]:
+        if os.path.exists(path+suffix):
+            os.remove(path+suffix)
+    db = schema.connect(path)
+    schema.migrate(db)
+    return db
+
+
+def catalog(directory, dataTypes):
+    """Persists a data type catalog the way the registry does, so that no registry has to run
+
+    :return: the path to pass as registry_cache
+    """
+    path = os.path.join(directory, "datatypes.json")
+    with open(path, "w") as cacheFile:
+        json.dump({'etag': None, 'dataTypes': dataTypes}, cacheFile)
+    return path
+
+
+def task(cur, title, type, inputDataTypeId, outputDataTypeId, **params):
+    cur.execute("INSERT INTO Task (Title,Type,InputDataTypeId,OutputDataTypeId) VALUES (?,?,?,?);", [
+        title, type, inputDataTypeId, outputDataTypeId])
+    taskId = cur.lastrowid
+    for name, value in params.items():
+        cur.execute("INSERT INTO TaskParam (TaskId,Title,Value) VALUES (?,?,?);", [
+            taskId, name, str(value)])
+    return taskId
+
+
+def chain(cur, inputDataTypeId, outputDataTypeId, taskIds):
+    """Inserts a workflow running the tasks one after the other between its two terminals
+
+    :return: the workflow id
+    """
+    cur.execute("INSERT INTO Workflow (Title,InputDataTypeId,OutputDataTypeId) VALUES ('chain',?,?);", [
+        inputDataTypeId, outputDataTypeId])
+    workflowId = cur.lastrowid
+    cur.execute("INSERT INTO DataIndex DEFAULT VALUES;")
+    dataIndexId = cur.lastrowid
+    taskInstanceIds = []
+    for taskId in [0]+taskIds+[0]:
+        cur.execute("INSERT INTO TaskInstance (WorkflowId,TaskId) VALUES (?,?);", [
+            workflowId, taskId])
+        taskInstanceIds.append(cur.lastrowid)
+    for source, target in zip(taskInstanceIds, taskInstanceIds[1:]):
+        cur.execute("INSERT INTO Edge (WorkflowId,TaskInstanceId1,DataIndexId1,TaskInstanceId2,DataIndexId2) VALUES (?,?,?,?,?);", [
+            workflowId, source, dataIndexId, target, dataIndexId])
+    return workflowId
+
+
+def data(cur, dataTypeId, values, title="input"):
+    """Inserts a Data of the given leaf values
+
+    :return: the data id
+    """
+    cur.execute("INSERT INTO Data (Title,DataTypeId,Created) VALUES (?,?,?);", [
+        title, dataTypeId, time.time()])
+    dataId = cur.lastrowid
+    cur.executemany("INSERT INTO UnitData (DataId,Value) VALUES (?,?);", [
+        (dataId, value) for value in values])
+    return dataId
+
+
+def execution(cur, workflowId, dataTypeId, values):
+    """Inserts a LOADED execution of a workflow on the given leaf values
+
+    :return: the workflow execution id
+    """
+    dataId = data(cur, dataTypeId, values)
+    cur.execute("INSERT INTO WorkflowExecution (WorkflowId,InputDataId,ExecutionState,EntryTime) VALUES (?,?,?,?);", [
+        workflowId, dataId, STATE_LOADED, time.time()])
+    return cur.lastrowid
+
+
+def stubServers(count, routes):
+    """Serves aiohttp applications on free local ports from a background event loop
+
+    :param routes: called with the index of a server, returns its list of (method, path, handler)
+    :return: the base URL of each server
+    """
+    from aiohttp import web
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever,
+                     name="benchmark-stubs", daemon=True).start()
+
+    async def serve(index):
+        app = web.Application()
+        for method, route, handler in routes(index):
+            app.router.add_route(method, route, handler)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        return "http://127.0.0.1:"+str(runner.addresses[0][1])
+    return [asyncio.run_coroutine_threadsafe(serve(index), loop).result() for index in range(count)]
+
+
+def running(path):
+    """Counts the workflow executions that neither ended nor failed"""
+    db = sqlite3.connect(path, timeout=30)
+    try:
+        return db.execute("SELECT COUNT(*) FROM WorkflowExecution WHERE ExecutionState NOT IN (?,?);", [
+            STATE_ENDED, STATE_FAILED]).fetchone()[0]
+    finally:
+        db.close()
+
+
+def runDaemon(path, registry_cache, sleep_interval=0.5, event_driven=True, wakeup_address=("127.0.0.1", 5902), timeout=600, setup=None, **options):
+    """Runs a daemon on its own thread until every workflow execution of the datastore ended or failed
+
+    The daemon's output is discarded.
+
+    :param setup: called with the Jallad before it starts, to adjust it
+    :param options: passed to Jallad
+    :return: seconds from the start of the daemon until nothing was left running
+    """
+    from daemon import Jallad
+    started = threading.Event()
+    daemons = []
+
+    def run():
+        # the daemon's connection belongs to the thread that opens it
+        jallad = Jallad(db_name=path, registry_cache=registry_cache, **options)
+        if setup is not None:
+            setup(jallad)
+        daemons.append(jallad)
+        started.set()
+        jallad.start(sleep_interval, event_driven=event_driven,
+                     wakeup_address=wakeup_address, metrics_interval=0)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        thread = threading.Thread(target=run, name="benchmark-daemon")
+        thread.start()
+        started.wait()
+        start = time.perf_counter()
+        deadline = start+timeout
+        while running(path) > 0 and time.perf_counter() < deadline:
+            time.sleep(0.005)
+        elapsed = time.perf_counter()-start
+        daemons[0].stop()
+        thread.join()
+    jallad = daemons[0]
+    jallad.http.close()
+    jallad.script_pool.close()
+    jallad.coprocesses.close()
+    if jallad.element_scripts is not None:
+        jallad.element_scripts.close()
+        jallad.element_pool.shutdown()
+    return elapsed
+
+
+def durations(path):
+    """Seconds each ended workflow execution ran, from its start to its end, in id order"""
+    db = sqlite3.connect(path)
+    try:
+        return [row[0] for row in db.execute("SELECT EndTime-StartTime FROM WorkflowExecution WHERE ExecutionState=? ORDER BY Id;", [STATE_ENDED])]
+    finally:
+        db.close()
+
+
+def summary(seconds):
+    """Formats the median and the 99th percentile of some durations in milliseconds"""
+    ordered = sorted(seconds)
+    return "median %.1f ms, p99 %.1f ms" % (1000*statistics.median(ordered), 1000*ordered[min(len(ordered)-1, int(len(ordered)*0.99))])
@@ -0,0 +1,221 @@
+import array
+import io
+import struct
+import sys
+
+from packing import (DATATYPE_INT, DATATYPE_FLOAT, DATATYPE_TEXT, HEADER, LENGTH, PACK_INT, PACK_FLOAT, PACK_TEXT,
+                     PACK_MIXED, intValue, packValues)
+
+OP_STRUCTURE = 0
+OP_VALUE = 1
+
+
+def compileProgram(dataType, dataTypeId: int):
+    """Flattens a data type tree into the sequence of tokens of its text encoding
+
+    Nodes are visited depth first, in the order the values are stored in. A structure, a node with a
+    length and sub data types, contributes its length token, every other node one value.
+
+    :param dataType: callable returning the registry entry of a data type id
+    :return: list of (OP_STRUCTURE, length) or (OP_VALUE, base)
+    """
+    program = []
+    left = [dataTypeId]
+    while len(left) > 0:
+        currentDataType = dataType(left.pop())
+        if currentDataType['length'] > 0 and len(currentDataType['subDataTypes']) > 0:
+            program.append((OP_STRUCTURE, currentDataType['length']))
+            left.extend(reversed([subDataType['subDataTypeId'] for subDataType in currentDataType['subDataTypes']]
+                                 * currentDataType['length']))
+        else:
+            program.append((OP_VALUE, currentDataType['base']))
+    return program
+
+
+def encodeTokens(program, values):
+    """Yields the text tokens of the values, structures give their length, texts their length and character codes"""
+    index = 0
+    for op, arg in program:
+        if op == OP_STRUCTURE:
+            yield str(arg)
+            continue
+        value = values[index]
+        index = index+1
+        if arg == DATATYPE_INT or arg == DATATYPE_FLOAT:
+            yield str(value)
+        elif arg == DATATYPE_TEXT:
+            value = str(value)
+            yield str(len(value))
+            if len(value) > 0:
+                yield " ".join(map(str, map(ord, value)))
+        else:
+            yield "0"
+
+
+def encodeText(program, values):
+    return " ".join(encodeTokens(program, values))+" "
+
+
+def writeText(stream, program, values, buffer_size=65536):
+    """Writes the text encoding of the values to a binary stream in chunks of about buffer_size bytes"""
+    buffer = []
+    size = 0
+    for token in encodeTokens(program, values):
+        buffer.append(token)
+        size = size+len(token)+1
+        if size >= buffer_size:
+            buffer.append("")
+            stream.write(" ".join(buffer).encode("utf-8"))
+            buffer = []
+            size = 0
+    buffer.append("")
+    stream.write(" ".join(buffer).encode("utf-8"))
+
+
+def readTokens(stream, buffer_size=65536):
+    """Yields the whitespace separated tokens of a binary stream as they arrive"""
+    read = stream.read1 if hasattr(stream, "read1") else stream.read
+    rest = b""
+    while True:
+        chunk = read(buffer_size)
+        if not chunk:
+            break
+        chunk = rest+chunk
+        tokens = chunk.split()
+        rest = b"" if chunk[-1:].isspace() or len(tokens) == 0 else tokens.pop()
+        yield from tokens
+    if rest:
+        yield rest
+
+
+def decodeTokens(program, tokens):
+    """Parses the values of a data type from its text tokens
+
+    :param tokens: iterable of str or bytes tokens, consumed only as far as the data type reaches
+    :return: the values, None if a structure's length doesn't match the data type
+    :raise ValueError: if the tokens end early or aren't numbers
+    """
+    tokens = iter(tokens)
+    values = []
+    try:
+        for op, arg in program:
+            token = next(tokens)
+            if op == OP_STRUCTURE:
+                if int(token) != arg:
+                    return None
+            elif arg == DATATYPE_FLOAT:
+                values.append(float(token))
+            elif arg == DATATYPE_INT:
+                values.append(int(token))
+            elif arg == DATATYPE_TEXT:
+                values.append("".join([chr(int(next(tokens)))
+                                       for i in range(int(token))]))
+    except StopIteration:
+        raise ValueError("Text ended before the data type did")
+    return values
+
+
+def typedValues(program, values):
+    """Converts stored values to the Python type of their base, values of unknown bases become 0"""
+    typed = []
+    index = 0
+    for op, arg in program:
+        if op == OP_STRUCTURE:
+            continue
+        value = values[index]
+        index = index+1
+        typed.append(int(value) if arg == DATATYPE_INT else float(value) if arg == DATATYPE_FLOAT else
+                     str(value) if arg == DATATYPE_TEXT else 0)
+    return typed
+
+
+def encodeBinary(program, values):
+    """Packs the values in the PackedData blob format of packing.packValues, for commands declaring binary support"""
+    blob = packValues(typedValues(program, values))
+    if blob is None:
+        raise ValueError("Values can't be packed")
+    return blob
+
+
+def readExactly(stream, size):
+    chunks = []
+    while size > 0:
+        chunk = stream.read(size)
+        if not chunk:
+            raise ValueError("Blob ended before the data type did")
+        chunks.append(chunk)
+        size = size-len(chunk)
+    return b"".join(chunks)
+
+
+def readPackedText(stream):
+    return str(readExactly(stream, LENGTH.unpack(readExactly(stream, LENGTH.size))[0]), "utf-8")
+
+
+def fitValue(base, value):
+    """Converts a packed value to the Python type of its base, the way decodeTokens() parses its token"""
+    if base == DATATYPE_TEXT:
+        if not isinstance(value, str):
+            raise ValueError(repr(value)+" is not a text")
+        return value
+    if isinstance(value, str):
+        raise ValueError(repr(value)+" is not a number")
+    return intValue(value) if base == DATATYPE_INT else float(value)
+
+
+def readBinary(program, stream, buffer_size=65536):
+    """Parses the values of a data type from a stream holding a blob in the packing.packValues format
+
+    Numeric arrays are read and converted about buffer_size bytes at a time, the blob is never held whole.
+
+    :return: the values, None for an empty output
+    :raise ValueError: if the blob ends early, holds another number of values than the data type,
+        or a value that doesn't fit its base
+    """
+    header = stream.read(HEADER.size)
+    if len(header) == 0:
+        return None
+    fmt, count = HEADER.unpack(
+        header+readExactly(stream, HEADER.size-len(header)))
+    fmt = fmt.rstrip(b"\0")
+    bases = [arg for op, arg in program if op == OP_VALUE]
+    if count != len(bases):
+        raise ValueError("Blob holds "+str(count) +
+                         " values, the data type "+str(len(bases)))
+    values = []
+    if fmt == PACK_INT or fmt == PACK_FLOAT:
+        left = count*8
+        while left > 0:
+            block = array.array(fmt.decode())
+            block.frombytes(readExactly(
+                stream, min(left, max(buffer_size//8, 1)*8)))
+            if sys.byteorder == "big":
+                block.byteswap()
+            values.extend(block.tolist())
+            left = left-len(block)*8
+    elif fmt == PACK_TEXT:
+        values = [readPackedText(stream) for i in range(count)]
+    elif fmt == PACK_MIXED:
+        for i in range(count):
+            valueFormat = readExactly(stream, 1)
+            if valueFormat == PACK_TEXT:
+                values.append(readPackedText(stream))
+            elif valueFormat == PACK_INT or valueFormat == PACK_FLOAT:
+                values.append(struct.unpack(
+                    "<"+valueFormat.decode(), readExactly(stream, 8))[0])
+            else:
+                raise ValueError("Unknown packed value format "+repr(valueFormat))
+    else:
+        raise ValueError("Unknown packed format "+repr(fmt))
+    kinds = set(bases)
+    if (fmt == PACK_INT and kinds == {DATATYPE_INT}) or (fmt == PACK_FLOAT and kinds == {DATATYPE_FLOAT}) or \
+            (fmt == PACK_TEXT and kinds == {DATATYPE_TEXT}):
+        return values
+    # values of other bases are skipped, as decodeTokens() skips their token
+    return [fitValue(base, value) for base, value in zip(bases, values)
+            if base == DATATYPE_INT or base == DATATYPE_FLOAT or base == DATATYPE_TEXT]
+
+
+def decodeBinary(program, blob):
+    """Parses the values of a data type from a blob in the packing.packValues format, see readBinary()"""
+    return readBinary(program, io.BytesIO(blob))
@@ -0,0 +1,146 @@
+import threading
+from subprocess import Popen, PIPE, DEVNULL
+
+
+class CoprocessError(Exception):
+    """A coprocess exited, ran out of time or answered with a malformed frame"""
+
+
+class Coprocess:
+    """A long-lived instance of a command answering one request per frame
+
+    Requests and responses are framed the same way in both directions: the length in bytes of the
+    payload as a decimal line, then the payload, e.g. b"4\\n1 2 \\n". A command serving frames
+    reads a length line from stdin, reads that many bytes, and writes its answer framed to stdout.
+    """
+
+    def __init__(self, command: str):
+        self.command = command
+        self.uses = 0
+        self.expired = False
+        self.process = Popen(command.split(" "),
+                             stdin=PIPE, stdout=PIPE, stderr=DEVNULL)
+
+    def expire(self):
+        """Kills an instance that ran out of time, unblocking the request waiting on it"""
+        self.expired = True
+        self.process.kill()
+
+    def request(self, payload: bytes, timeout=None):
+        """Sends one framed request
+
+        :param timeout: seconds the command may take to answer, None to wait for as long as it takes.
+            An instance running out of time is killed.
+        :return: the response payload
+        :raise CoprocessError: if the instance exited, timed out or sent a malformed frame
+        """
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, self.expire)
+            timer.daemon = True
+            timer.start()
+        try:
+            response = self.exchange(payload)
+        except CoprocessError:
+            if self.expired:
+                raise CoprocessError("Coprocess "+self.command +
+                                     " timed out after "+str(timeout)+"s") from None
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if self.expired:
+            raise CoprocessError("Coprocess "+self.command +
+                                 " timed out after "+str(timeout)+"s")
+        self.uses += 1
+        return response
+
+    def exchange(self, payload: bytes):
+        try:
+            self.process.stdin.write(
+                str(len(payload)).encode("ascii")+b"\n"+payload)
+            self.process.stdin.flush()
+            header = self.process.stdout.readline()
+        except (BrokenPipeError, OSError) as error:
+            raise CoprocessError(
+                "Coprocess "+self.command+" exited") from error
+        if not header.endswith(b"\n"):
+            raise CoprocessError("Coprocess "+self.command+" exited")
+        try:
+            length = int(header)
+        except ValueError:
+            raise CoprocessError(
+                "Coprocess "+self.command+" sent a malformed frame header "+repr(header))
+        response = self.process.stdout.read(length)
+        if len(response) < length:
+            raise CoprocessError("Coprocess "+self.command+" exited")
+        return response
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(1)
+        except Exception:
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+
+
+class CoprocessPool:
+    """Keeps warm instances of commands, each used by one execution at a time
+
+    An instance is recycled after max_uses requests or as soon as a request to it fails or times out.
+    """
+
+    def __init__(self, max_uses=1000, timeout=None):
+        """
+        :param max_uses: default requests served by an instance before it is replaced
+        :param timeout: default seconds an instance may take to answer a request, None for no limit
+        """
+        self.max_uses = max_uses
+        self.timeout = timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, command: str):
+        with self.lock:
+            instances = self.idle.get(command)
+            if instances:
+                return instances.pop()
+        return Coprocess(command)
+
+    def release(self, instance: Coprocess, maxUses: int):
+        if instance.uses >= maxUses:
+            instance.close()
+            return
+        with self.lock:
+            self.idle.setdefault(instance.command, []).append(instance)
+
+    def request(self, command: str, payload: bytes, max_uses=None, timeout=None):
+        """Sends one request to an idle instance of the command, starting one if none is idle
+
+        :param max_uses: overrides the pool's max_uses for the command
+        :param timeout: overrides the pool's timeout
+        :return: the response payload
+        :raise CoprocessError: if the instance exited, timed out or sent a malformed frame, the instance is discarded
+        """
+        instance = self.acquire(command)
+        try:
+            response = instance.request(
+                payload, self.timeout if timeout is None else timeout)
+        except Exception:
+            instance.close()
+            raise
+        self.release(instance, self.max_uses if max_uses is None else max_uses)
+        return response
+
+    def close(self):
+        with self.lock:
+            instances = [instance for instances in self.idle.values()
+                         for instance in instances]
+            self.idle = {}
+        for instance in instances:
+            instance.close()
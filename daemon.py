@@ -1,12 +1,29 @@
+import argparse
+import asyncio
+import hashlib
 import json
-import math
-import sys
+import multiprocessing
+import os
+import queue
+import socket
+import threading
 import traceback
-import requests
-import sqlite3
 
 import time
-from subprocess import Popen, PIPE
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import Popen, PIPE, DEVNULL
+
+from codec import compileProgram, decodeBinary, decodeTokens, encodeBinary, encodeText, readBinary, readTokens, writeText
+from coprocess import CoprocessPool
+from dataparallel import chunkRanges, defaultChunkSize, splitElements
+from httpengine import HttpEngine
+from layout import compileLayout
+from nodeload import NodeLoad, POLICY_LEAST_LOADED, POLICY_TWO_CHOICES
+from packing import loadValues, storeValues
+from registry import DataTypeRegistry
+from schema import connect, migrate
+from scriptpool import ScriptPool
+from wakeup import WAKEUP_ADDRESS, WakeupListener, workerAddress
 
 TASK_SYSTEM = 0
 TASK_SERVICE = 1
@@ -20,6 +37,9 @@ TASK_REDUCE = 8
 TASK_FILTER = 9
 TASK_TERMINAL = 10
 
+# task types applying a sub task to every element of an array
+DATA_PARALLEL = [TASK_MAP, TASK_REDUCE, TASK_FILTER]
+
 STATE_QUEUED = 0
 STATE_LOADED = 1
 STATE_STARTED = 2
@@ -34,81 +54,211 @@ DATATYPE_FLOAT = 1
 DATATYPE_TEXT = 2
 DATATYPE_STRUCTURE = 3
 
+DEFAULT_CONCURRENCY = {
+    TASK_SYSTEM: os.cpu_count() or 1,
+    TASK_SERVICE: 256,
+    TASK_WEB: 256,
+    TASK_SCRIPT: os.cpu_count() or 1,
+    TASK_MAP: os.cpu_count() or 1,
+    TASK_REDUCE: os.cpu_count() or 1,
+    TASK_FILTER: os.cpu_count() or 1,
+}
+
+# task types of a --concurrency option
+TASK_NAMES = {"system": TASK_SYSTEM, "service": TASK_SERVICE, "web": TASK_WEB, "script": TASK_SCRIPT,
+              "map": TASK_MAP, "reduce": TASK_REDUCE, "filter": TASK_FILTER}
+
+# scheduler phases in the order of one tick, each applies its transitions in one transaction
+PHASES = [
+    'reloadDataTypes',
+    'renewLeases',
+    'reconcileServices',
+    'refreshWorkflowPlans',
+    'endCompletedTaskInstances',
+    'storeReplies',
+    'startLoadedWorkflows',
+    'queueNextTaskInstances',
+    'loadQueuedTaskInstances',
+    'executeLoadedTaskInstances',
+    'deliverCallbacks',
+    'evictTaskResults',
+]
+
+# seconds between evictions of expired and least recently used task results
+RESULT_CACHE_EVICT_INTERVAL = 60
+# task fields that don't change what an execution outputs, left out of its result key
+RESULT_KEY_EXCLUDED = ['workflowId', 'screenX', 'screenY', 'title', 'cacheable', 'ttl',
+                       'taskInstanceExecutionId', 'workflowExecutionId', 'resultKey']
+
+
+def resultKey(task, inputData):
+    """Hash of what the output of a deterministic execution depends on, its task with its params and its input"""
+    definition = dict([(key, value) for key, value in task.items()
+                       if key not in RESULT_KEY_EXCLUDED])
+    digest = hashlib.sha256(json.dumps(
+        [definition, inputData['dataTypeId']], sort_keys=True).encode("utf-8"))
+    digest.update(json.dumps(list(inputData['values'])).encode("utf-8"))
+    return digest.hexdigest()
+
+
+# LOADED workflow executions started per tick at most, fewer while task executions wait to be started
+WORKFLOW_START_BATCH_SIZE = 100
+# entries of one batched callback request
+CALLBACK_BATCH_SIZE = 100
+# seconds between the attempts of an undelivered callback, doubling up to CALLBACK_MAX_DELAY
+CALLBACK_RETRY_DELAY = 1
+CALLBACK_MAX_DELAY = 300
+
 
 class Jallad:
-    def __init__(self, db_name="datastore.db", registry_protocol="http:", registry_host="localhost", registry_port="5001"):
+    def __init__(self, db_name="datastore.db", registry_protocol="http:", registry_host="localhost", registry_port="5001", registry_cache="datatypes.json", registry_refresh_interval=60, concurrency=None, http_limit_per_host=16, http_timeout=30, pack_data=False, lease_duration=30, map_workers=None, map_chunk_size=None, script_timeout=None, script_memory_limit=None, coprocess_max_uses=1000, coprocess_timeout=300, node_load_ttl=5, node_policy=POLICY_TWO_CHOICES, callback_address=None, reconcile_interval=60, result_cache_size=10000, result_cache_ttl=3600):
+        """
+        :param registry_cache: file the data type catalog is persisted to, None to fetch it on every start
+        :param registry_refresh_interval: seconds between checks of the registry for changed data types
+        :param concurrency: maximum parallel executions per task type, see DEFAULT_CONCURRENCY
+        :param http_limit_per_host: maximum concurrent connections to one host for web and service tasks
+        :param http_timeout: timeout in seconds of outbound HTTP requests
+        :param pack_data: store the values of new Data as one PackedData blob instead of UnitData rows
+        :param lease_duration: seconds a started execution stays claimed by this worker without a heartbeat
+        :param map_workers: processes running the script elements of map, reduce and filter tasks, defaults to the number of CPUs
+        :param map_chunk_size: elements handed to a worker at once, None to give every worker a few chunks, overridden by a chunkSize task param
+        :param script_timeout: seconds a script, or a script element, may run, None for no limit, overridden by a timeout task param
+        :param script_memory_limit: bytes of address space a script may use, None for no limit, overridden by a memoryLimit task param, applied to script elements too
+        :param coprocess_max_uses: executions served by an instance of a persistent system command before it is restarted, overridden by a maxUses task param
+        :param coprocess_timeout: seconds an instance of a persistent system command may take to answer an execution before it is killed,
+            None for no limit, overridden by a timeout task param
+        :param node_load_ttl: seconds the queue count of a node is cached for when picking the node of a service execution
+        :param node_policy: how the node of a service execution is picked, see nodeload.NodeLoad
+        :param callback_address: base URL, e.g. http://10.0.0.1:5000, the nodes running service executions call back on,
+            None for the address they see the request coming from
+        :param reconcile_interval: seconds between polls of the nodes for service executions whose callback never arrived
+        :param result_cache_size: outputs of cacheable tasks kept, the least recently used are evicted first
+        :param result_cache_ttl: seconds the output of a cacheable task is reused for, overridden by a ttl task param
+        """
         self.db_name = db_name
+        self.pack_data = pack_data
+        self.worker_id = socket.gethostname()+":"+str(os.getpid())+":"+os.urandom(4).hex()
+        self.lease_duration = lease_duration
+        self.lease_renewed = 0
+        self.callback_address = callback_address
+        self.reconcile_interval = reconcile_interval
+        self.reconciled = time.time()
+        self.result_cache_size = result_cache_size
+        self.result_cache_ttl = result_cache_ttl
+        self.results_evicted = 0
+        # taskInstanceExecutionId -> result key of the loaded executions of cacheable tasks, hashed once
+        self.result_keys = {}
+        self.http_timeout = http_timeout
+        self.map_workers = map_workers or os.cpu_count() or 1
+        self.map_chunk_size = map_chunk_size
+        self.element_pool = None
+        self.element_scripts = None
+        self.script_timeout = script_timeout
+        self.script_memory_limit = script_memory_limit
         self.registry_protocol = registry_protocol
         self.registry_host = registry_host
         self.registry_port = registry_port
-        self.db = sqlite3.connect(self.db_name)
-        cur = self.db.cursor()
-        cur.execute(
-            "CREATE TABLE IF NOT EXISTS Registry(Id INTEGER PRIMARY KEY AUTOINCREMENT, IpAddress TEXT);")
-        cur.execute(
-            "CREATE TABLE IF NOT EXISTS Workflow(Id INTEGER PRIMARY KEY AUTOINCREMENT, Title TEXT, InputDataTypeId INT, OutputDataTypeId INT);")
-        cur.execute(
-            "CREATE TABLE IF NOT EXISTS Node(Id INTEGER PRIMARY KEY AUTOINCREMENT, Title TEXT, IpAddress TEXT);")
-        cur.execute(
-            "CREATE TABLE IF NOT EXISTS Service(Id INTEGER PRIMARY KEY AUTOINCREMENT, Title TEXT, NodeId INT REFERENCES Node(Id), WorkflowId INT REFERENCES Workflow(Id),NodeServiceId INT, UniformServiceId INT);")
-        cur.execute(
-            "CREATE TABLE IF NOT EXISTS Task(Id INTEGER PRIMARY KEY AUTOINCREMENT, Title TEXT, Type INT, InputDataTypeId INT, OutputDataTypeId INT);")
-        cur.execute(
-            "CREATE TABLE IF NOT EXISTS TaskParam(Id INTEGER PRIMARY KEY AUTOINCREMENT, TaskId INT REFERENCES Task(Id), Title TEXT, Value TEXT);")
-        cur.execute(
-            "CREATE TABLE IF NOT EXISTS TaskInstance(Id INTEGER PRIMARY KEY AUTOINCREMENT, WorkflowId INT REFERENCES Workflow(Id), TaskId INT REFERENCES Task(Id), ScreenX INT, ScreenY INT);")
-        cur.execute(
-            "CREATE TABLE IF NOT EXISTS Edge(Id INTEGER PRIMARY KEY AUTOINCREMENT,  WorkflowId INT REFERENCES Workflow(Id), TaskInstanceId1 INT REFERENCES TaskInstance(Id), DataIndexId1 INT REFERENCES DataIndex(Id), TaskInstanceId2 INT REFERENCES TaskInstance(Id), DataIndexId2 INT REFERENCES DataIndex(Id));")
-        cur.execute(
-            "CREATE TABLE IF NOT EXISTS DataIndex(Id INTEGER PRIMARY KEY AUTOINCREMENT);")
-        cur.execute(
-            "CREATE TABLE IF NOT EXISTS DataIndexValue(Id INTEGER PRIMARY KEY AUTOINCREMENT, DataIndexId INT REFERENCES DataIndex(Id), Value INT);")
-        cur.execute(
-            "CREATE TABLE IF NOT EXISTS Data(Id INTEGER PRIMARY KEY AUTOINCREMENT, Title TEXT, DataTypeId INT, Created TEXT);")
-        cur.execute(
-            "CREATE TABLE IF NOT EXISTS UnitData(Id INTEGER PRIMARY KEY AUTOINCREMENT, DataId INT REFERENCES Data(Id), Value TEXT);")
-        cur.execute(
-            "CREATE TABLE IF NOT EXISTS WorkflowExecution(Id INTEGER PRIMARY KEY AUTOINCREMENT,  WorkflowId INT REFERENCES Workflow(Id), EntryTime TEXT, InputDataId INT REFERENCES Data(Id), ExecutionState INT, StartTime TEXT, OutputDataId INT REFERENCES Data(Id), EndTime TEXT);")
-        cur.execute(
-            "CREATE TABLE IF NOT EXISTS WorkflowExecutionParams(Id INTEGER PRIMARY KEY AUTOINCREMENT, WorkflowExecutionId INT REFERENCES WorkflowExecution(Id), Title TEXT, Value TEXT);")
-        cur.execute(
-            "CREATE TABLE IF NOT EXISTS TaskInstanceExecution(Id INTEGER PRIMARY KEY AUTOINCREMENT, WorkflowExecutionId INT REFERENCES WorkflowExecution(Id), TaskInstanceId INT REFERENCES TaskInstance(Id), EntryTime TEXT, InputDataId INT REFERENCES Data(Id), ExecutionState INT, StartTime TEXT, OutputDataId INT REFERENCES Data(Id), EndTime TEXT);")
-        cur.execute(
-            "CREATE TABLE IF NOT EXISTS TaskInstanceExecutionParams(Id INTEGER PRIMARY KEY AUTOINCREMENT, TaskInstanceExecutionId INT REFERENCES TaskInstanceExecution(Id), Title TEXT, Value TEXT);")
+        self.registry = DataTypeRegistry(registry_protocol+'//'+registry_host+':'+registry_port+"/datatype",
+                                         cache_path=registry_cache, refresh_interval=registry_refresh_interval)
+        self.db = connect(self.db_name)
+        migrate(self.db)
+        self.plans = {}
+        self.layouts = {}
+        self.programs = {}
+        self.concurrency = dict(DEFAULT_CONCURRENCY)
+        self.concurrency.update(concurrency or {})
+        self.executors = dict([(taskType, ThreadPoolExecutor(max_workers=self.concurrency[taskType], thread_name_prefix="jallad-"+str(taskType)))
+                               for taskType in [TASK_SYSTEM, TASK_SCRIPT]+DATA_PARALLEL])
+        self.running = dict([(taskType, 0)
+                            for taskType in self.concurrency])
+        # script executions block a thread of the TASK_SCRIPT executor while a worker process runs them
+        self.script_pool = ScriptPool(self.concurrency[TASK_SCRIPT],
+                                      timeout=script_timeout, memory_limit=script_memory_limit)
+        self.coprocesses = CoprocessPool(max_uses=coprocess_max_uses, timeout=coprocess_timeout)
+        self.completed = queue.Queue()
+        self.replies = queue.Queue()
+        # address -> callback requests in flight to it
+        self.delivering = {}
+        self.http = HttpEngine(
+            limit_per_host=http_limit_per_host, timeout=http_timeout)
+        self.node_load = NodeLoad(
+            self.http, ttl=node_load_ttl, policy=node_policy)
+        self.resetMetrics()
+
+    def resetMetrics(self):
+        self.metrics = {'ticks': 0, 'commits': 0,
+                        'resultCacheHits': 0, 'resultCacheMisses': 0, 'resultCacheEvictions': 0,
+                        'phaseTime': dict([(phase, 0.0) for phase in PHASES])}
+        self.metrics_start = time.time()
+
+    def reportMetrics(self):
+        """Prints the commits and the wall time of each phase per tick, and the task result cache lookups, since the last report"""
+        ticks = max(self.metrics['ticks'], 1)
+        lookups = self.metrics['resultCacheHits'] + \
+            self.metrics['resultCacheMisses']
+        print("metrics:"+json.dumps({
+            'ticks': self.metrics['ticks'],
+            'commitsPerTick': self.metrics['commits']/ticks,
+            'phaseMsPerTick': dict([(phase, round(phaseTime*1000/ticks, 3)) for phase, phaseTime in self.metrics['phaseTime'].items()]),
+            'resultCache': {'hits': self.metrics['resultCacheHits'], 'misses': self.metrics['resultCacheMisses'],
+                            'hitRate': round(self.metrics['resultCacheHits']/lookups, 3) if lookups > 0 else None,
+                            'evictions': self.metrics['resultCacheEvictions']}
+        }))
+        self.resetMetrics()
+
+    def commit(self):
+        """Commits the open transaction, counted in the metrics"""
         self.db.commit()
-        cur.close()
+        self.metrics['commits'] += 1
 
     def updateDataTypes(self):
-        self.data_types = requests.get(
-            self.registry_protocol+'//'+self.registry_host+':'+self.registry_port+"/datatype").json()
+        """Loads the data type catalog, from disk if it was persisted, and keeps it refreshed in the background"""
+        self.registry.start()
+        self.layouts = {}
+        self.programs = {}
+
+    def reloadDataTypes(self):
+        """Swaps in the data types the registry changed, dropping the layouts and programs compiled from them"""
+        changed = self.registry.apply()
+        for dataTypeId in changed:
+            self.layouts.pop(dataTypeId, None)
+            self.programs.pop(dataTypeId, None)
+        if len(changed) > 0:
+            print("registry:reloaded:"+str(sorted(changed)))
 
     def dataType(self, id: int):
-        for dataType in self.data_types:
-            if dataType['id'] == id:
-                return dataType
-        return {'id': 0, 'base': DATATYPE_NONE, 'length': 0}
+        return self.registry.get(id)
 
-    def data(self, id: int):
+    def dataLayout(self, dataTypeId: int):
+        """Returns the flat layout of a data type, compiled once per update of the data types"""
+        layout = self.layouts.get(dataTypeId)
+        if layout is None:
+            layout = compileLayout(self.dataType, dataTypeId)
+            self.layouts[dataTypeId] = layout
+        return layout
+
+    def data(self, id: int, view: bool = False):
+        """
+        :param view: give packed numeric values as a memoryview over the stored blob instead of a list
+        """
         cur = self.db.cursor()
         data = None
         for row in cur.execute("SELECT * FROM Data WHERE Id=?;", [id]):
             data = dict(zip(['id', 'title', 'dataTypeId', 'created'], row))
             cur2 = self.db.cursor()
-            data['values'] = [row2[0] for row2 in cur2.execute(
-                "SELECT Value FROM UnitData Where DataId=?;", [data['id']])]
+            data['values'] = loadValues(cur2, data['id'], view)
             cur2.close()
         cur.close()
         return data
 
     def saveData(self, dataTypeId: int, values: list, title: str = 'Interprocess'):
+        """Inserts a Data row in the open transaction, committed by the calling phase"""
         cur = self.db.cursor()
         cur.execute("INSERT INTO Data (Title, DataTypeId, Created) VALUES (?,?,?);",
                     [title, dataTypeId, time.time()])
         dataId = cur.lastrowid
-        for unitdata in values:
-            cur.execute("INSERT INTO UnitData (DataId,Value) VALUES (?,?);",
-                        [dataId, unitdata])
-        self.db.commit()
+        storeValues(cur, dataId, values, self.dataType(
+            dataTypeId)['base'], self.pack_data)
         cur.close()
         return dataId
 
@@ -131,7 +281,7 @@ class Jallad:
             edge['dataIndex2'] = [row2[0] for row2 in cur2.execute(
                 "SELECT Value FROM DataIndexValue WHERE DataIndexId=?;", [edge['dataIndexId2']])]
             cur2.close()
-        self.db.commit()
+        cur.close()
         return edge
 
     def task(self, id: int):
@@ -171,90 +321,139 @@ class Jallad:
         cur.close()
         return task
 
+    def compileWorkflowPlan(self, workflowId: int):
+        """Reads a workflow definition into adjacency lists, resolved tasks and decoded data indices"""
+        cur = self.db.cursor()
+        plan = {'revision': 0, 'workflow': None, 'taskInstances': {}, 'tasks': {},
+                'edges': {}, 'edgesIn': {}, 'edgesOut': {}, 'terminals': []}
+        for row in cur.execute("SELECT Revision FROM WorkflowRevision WHERE WorkflowId=?;", [workflowId]):
+            plan['revision'] = row[0]
+        for row in cur.execute("SELECT * FROM Workflow WHERE Id=?;", [workflowId]):
+            plan['workflow'] = dict(
+                zip(['id', 'title', 'inputDataTypeId', 'outputDataTypeId'], row))
+        for row in cur.execute("SELECT * FROM TaskInstance WHERE WorkflowId=? ORDER BY Id ASC;", [workflowId]):
+            taskInstance = dict(
+                zip(['id', 'workflowId', 'taskId', 'screenX', 'screenY'], row))
+            plan['taskInstances'][taskInstance['id']] = taskInstance
+            if taskInstance['taskId'] == 0:
+                plan['terminals'].append(taskInstance['id'])
+        for row in cur.execute("SELECT * FROM Task WHERE Id IN (SELECT TaskId FROM TaskInstance WHERE WorkflowId=?);", [workflowId]):
+            plan['tasks'][row[0]] = dict(
+                zip(['id', 'title', 'type', 'inputDataTypeId', 'outputDataTypeId'], row))
+        for row in cur.execute("SELECT TaskId,Title,Value FROM TaskParam WHERE TaskId IN (SELECT TaskId FROM TaskInstance WHERE WorkflowId=?) ORDER BY Id ASC;", [workflowId]):
+            if row[0] in plan['tasks']:
+                plan['tasks'][row[0]][row[1]] = row[2]
+        dataIndices = {}
+        for row in cur.execute("SELECT DataIndexId,Value FROM DataIndexValue WHERE DataIndexId IN (SELECT DataIndexId1 FROM Edge WHERE WorkflowId=? UNION SELECT DataIndexId2 FROM Edge WHERE WorkflowId=?) ORDER BY Id ASC;", [workflowId, workflowId]):
+            dataIndices.setdefault(row[0], []).append(row[1])
+        for row in cur.execute("SELECT * FROM Edge WHERE WorkflowId=? ORDER BY Id ASC;", [workflowId]):
+            edge = dict(
+                zip(['id', 'workflowId', 'taskInstanceId1', 'dataIndexId1', 'taskInstanceId2', 'dataIndexId2'], row))
+            edge['dataIndex1'] = dataIndices.get(edge['dataIndexId1'], [])
+            edge['dataIndex2'] = dataIndices.get(edge['dataIndexId2'], [])
+            plan['edges'][edge['id']] = edge
+            plan['edgesOut'].setdefault(edge['taskInstanceId1'], []).append(edge)
+            plan['edgesIn'].setdefault(edge['taskInstanceId2'], []).append(edge)
+        cur.close()
+        return plan
+
+    def workflowPlan(self, workflowId: int):
+        """Returns the compiled plan of a workflow, compiling it on first use"""
+        plan = self.plans.get(workflowId)
+        if plan is None:
+            plan = self.compileWorkflowPlan(workflowId)
+            self.plans[workflowId] = plan
+        return plan
+
+    def refreshWorkflowPlans(self):
+        """Drops the plans of workflows whose definition was edited since they were compiled"""
+        if len(self.plans) == 0:
+            return
+        cur = self.db.cursor()
+        revisions = dict([row for row in cur.execute(
+            "SELECT WorkflowId,Revision FROM WorkflowRevision;")])
+        cur.close()
+        for workflowId in [workflowId for workflowId, plan in self.plans.items() if plan['revision'] != revisions.get(workflowId, 0)]:
+            del self.plans[workflowId]
+
+    def planTask(self, plan, id: int):
+        if id not in plan['tasks']:
+            plan['tasks'][id] = self.task(id)
+        return plan['tasks'][id]
+
+    def planTaskInstance(self, plan, id: int, taskId: int = None):
+        """Same as taskInstance() but resolved from a compiled plan, the result may be modified"""
+        if id not in plan['taskInstances']:
+            return None
+        task = dict(plan['taskInstances'][id])
+        if task['taskId'] == 0:
+            if plan['workflow'] is not None:
+                start = id == plan['terminals'][0]
+                task['title'] = "start" if start else "end"
+                task['type'] = TASK_TERMINAL
+                task['outputDataTypeId'] = plan['workflow']['inputDataTypeId'] if start else 0
+                task['inputDataTypeId'] = 0 if start else plan['workflow']['outputDataTypeId']
+        elif taskId is not None:
+            task.update(self.planTask(plan, taskId))
+        else:
+            task.update(self.planTask(plan, task['taskId']))
+        return task
+
     def dataUsingDataIndex(self, data, dataIndex):
-        values = []
-        # print(":dataIndexed:data:"+str(data))
-        if data is not None:
-            leftDataTypes = [data['dataTypeId']]
-            listOfIndices = []
-            foundIndex = False
-            j = 1
-            while(len(leftDataTypes) > 0):
-                currentDataTypeId = leftDataTypes.pop(0)
-                if currentDataTypeId > 0:
-                    currentDataType = self.dataType(currentDataTypeId)
-                    currentIndex = listOfIndices.pop(
-                        0) if len(listOfIndices) > 0 else []
-                    if currentIndex == dataIndex:
-                        foundIndex = True
-                    if currentDataType['length'] > 0 and len(currentDataType['subDataTypes']) > 0:
-                        for i in range(0, currentDataType['length']):
-                            for g in range(0, len(currentDataType['subDataTypes'])):
-                                leftDataTypes.insert(i*len(currentDataType['subDataTypes'])+g,
-                                                     currentDataType['subDataTypes'][g]['subDataTypeId'])
-                                subDataTypeIndex = list(currentIndex)
-                                subDataTypeIndex.extend([i+1, g+1])
-                                listOfIndices.insert(
-                                    i*len(currentDataType['subDataTypes'])+g, subDataTypeIndex)
-                    else:
-                        if foundIndex:
-                            #print(":dataIndexed:j:"+str(j))
-                            print(":dataIndexed:currentIndex:"+str(currentIndex))
-                            if currentIndex[:len(dataIndex)] == dataIndex:
-                                print(j)
-                                print(json.dumps(data))
-                                print(data['values'][j-1])
-                                values.append(data['values'][j-1])
-                            else:
-                                break
-                        j = j+1
-            # print(str(data['values'])+' '+str(dataIndex)+' :dataIndexed: '+str(values))
-        return values
+        if data is None:
+            return []
+        leafRange = self.dataLayout(data['dataTypeId'])[
+            'ranges'].get(tuple(dataIndex))
+        if leafRange is None:
+            return []
+        return list(data['values'][leafRange[0]:leafRange[1]])
 
     def mergePartialIndexing(self, finalDataTypeId, edgesWithData):
         if finalDataTypeId == 0:
             return []
+        order = self.dataLayout(finalDataTypeId)['order']
+        placement = sorted([(order[tuple(edgeWithData['dataIndex2'])], i) for i, edgeWithData in enumerate(edgesWithData)
+                            if tuple(edgeWithData['dataIndex2']) in order])
         values = []
-        leftDataTypes = [finalDataTypeId]
-        listOfIndices = []
-        while(len(leftDataTypes) > 0):
-            currentDataType = self.dataType(leftDataTypes.pop(0))
-            currentIndex = listOfIndices.pop(
-                0) if len(listOfIndices) > 0 else []
-            for edgeWithData in edgesWithData:
-                # print(str(currentIndex)+" "+str(edgeWithData['dataIndex2'])+" "+str(edgeWithData['data1']))
-                if edgeWithData['dataIndex2'] == currentIndex:
-                    values.extend(edgeWithData['data1'])
-            if currentDataType['length'] > 0 and len(currentDataType['subDataTypes']) > 0:
-                for i in range(0, currentDataType['length']):
-                    for g in range(0, len(currentDataType['subDataTypes'])):
-                        leftDataTypes.insert(i*len(currentDataType['subDataTypes'])+g,
-                                             currentDataType['subDataTypes'][g]['subDataTypeId'])
-                        subDataTypeIndex = list(currentIndex)
-                        subDataTypeIndex.extend([i+1, g+1])
-                        listOfIndices.insert(
-                            i*len(currentDataType['subDataTypes'])+g, subDataTypeIndex)
-                        # print(str(listOfIndices))
-        #print(str(finalDataTypeId)+' :mergePartial: '+str(values))
+        for position, i in placement:
+            values.extend(edgesWithData[i]['data1'])
         return values
 
+    def latestExecutionState(self, cur, workflowExecutionId: int, taskInstanceId: int):
+        for row in cur.execute("SELECT ExecutionState FROM TaskInstanceExecution WHERE WorkflowExecutionId=? AND TaskInstanceId=? ORDER BY Id DESC LIMIT 1;", [workflowExecutionId, taskInstanceId]):
+            return row[0]
+        return None
+
     def queueNextTaskInstances(self):
+        """Marks the ENDED executions and queues their successors
+
+        Keeps the PendingInputs counter of every QUEUED execution equal to the number of
+        its upstream task instances whose latest execution is not MARKED yet, an upstream
+        task instance without any execution holds nothing back.
+        """
         cur = self.db.cursor()
-        queuedTaskInstances = [taskInstance for taskInstance in cur.execute(
-            "SELECT TaskInstanceId,WorkflowExecutionId FROM TaskInstanceExecution WHERE ExecutionState=?;", [STATE_QUEUED])]
+        if cur.execute("SELECT Id FROM TaskInstanceExecution WHERE ExecutionState=? AND WorkflowExecutionId>0 AND WorkflowExecutionId IN (SELECT Id FROM WorkflowExecution) LIMIT 1;", [STATE_ENDED]).fetchone() is None:
+            cur.close()
+            return
+        # marking claims the ENDED executions, the transaction holds the write lock from here on so other workers can't queue them again
+        unmarkedTaskInstanceExecutions = sorted(cur.execute(
+            "UPDATE TaskInstanceExecution SET ExecutionState=? WHERE ExecutionState=? AND WorkflowExecutionId>0 AND WorkflowExecutionId IN (SELECT Id FROM WorkflowExecution) RETURNING Id,TaskInstanceId,OutputDataId,WorkflowExecutionId;", [STATE_MARKED, STATE_ENDED]).fetchall())
+        workflowIds = dict([(workflowExecutionId, self.workflowExecution(workflowExecutionId)['workflowId'])
+                            for workflowExecutionId in set([row[3] for row in unmarkedTaskInstanceExecutions])])
+        # successors are deduplicated within this pass
+        queuedTaskInstances = []
+        releasedInputs = []
         nextTaskInstances = []
-        for unmarkedTaskInstanceExecution in cur.execute(
-                "SELECT TaskInstanceExecution.Id,TaskInstanceExecution.TaskInstanceId,TaskInstanceExecution.OutputDataId,WorkflowExecution.Id,WorkflowExecution.WorkflowId FROM TaskInstanceExecution JOIN WorkflowExecution ON (TaskInstanceExecution.WorkflowExecutionId=WorkflowExecution.Id) WHERE TaskInstanceExecution.ExecutionState=?", [STATE_ENDED]):
-            cur2 = self.db.cursor()
-            cur2.execute("UPDATE TaskInstanceExecution SET ExecutionState=? WHERE Id=?;", [
-                STATE_MARKED, unmarkedTaskInstanceExecution[0]])
+        for unmarkedTaskInstanceExecution in unmarkedTaskInstanceExecutions:
             # print("queueNext:unmarked:"+str(unmarkedTaskInstanceExecution))
-            self.db.commit()
             negEdgeTaskInstance = None
             edgeTaskInstances = []
-            for edgeTaskInstance in cur2.execute(
-                    "SELECT Id FROM Edge WHERE WorkflowId=? AND TaskInstanceId1=?;", [unmarkedTaskInstanceExecution[4], unmarkedTaskInstanceExecution[1]]):
-                edge = self.edge(edgeTaskInstance[0])
+            plan = self.workflowPlan(
+                workflowIds[unmarkedTaskInstanceExecution[3]])
+            for successor in set([edge['taskInstanceId2'] for edge in plan['edgesOut'].get(unmarkedTaskInstanceExecution[1], [])]):
+                releasedInputs.append((unmarkedTaskInstanceExecution[3], successor, STATE_QUEUED,
+                                       unmarkedTaskInstanceExecution[3], unmarkedTaskInstanceExecution[1], unmarkedTaskInstanceExecution[0]))
+            for edge in plan['edgesOut'].get(unmarkedTaskInstanceExecution[1], []):
                 taskInstanceExecution = [
                     edge['taskInstanceId2'], unmarkedTaskInstanceExecution[3]]
                 isUnique = True
@@ -280,32 +479,68 @@ class Jallad:
             else:
                 nextTaskInstances.extend(edgeTaskInstances)
                 queuedTaskInstances.extend(edgeTaskInstances)
-            cur2.close()
         # print("queueNext:next:"+str(nextTaskInstances))
+        # marking, the counters and queueing the successors commit together, a crash leaves the executions ENDED to be redone
+        # a MARKED execution releases the successors waiting on it if it is the latest of its task instance
+        cur.executemany("UPDATE TaskInstanceExecution SET PendingInputs=PendingInputs-1 WHERE WorkflowExecutionId=? AND TaskInstanceId=? AND ExecutionState=? AND NOT EXISTS (SELECT Id FROM TaskInstanceExecution WHERE WorkflowExecutionId=? AND TaskInstanceId=? AND Id>?);",
+                        releasedInputs)
+        heldInputs = []
+        queuedExecutions = []
+        entryTime = time.time()
         for nextTaskInstance in nextTaskInstances:
-            cur.execute("INSERT INTO TaskInstanceExecution (WorkflowExecutionId,TaskInstanceId,EntryTime,ExecutionState) VALUES (?,?,?,?);", [
-                        nextTaskInstance[1], nextTaskInstance[0], time.time(), STATE_QUEUED])
-            # print("queueNext:added:"+str(cur.lastrowid))
-        self.db.commit()
+            plan = self.workflowPlan(workflowIds[nextTaskInstance[1]])
+            # a new execution holds its successors back again if the latest one was MARKED
+            for successor in set([edge['taskInstanceId2'] for edge in plan['edgesOut'].get(nextTaskInstance[0], [])]):
+                heldInputs.append((nextTaskInstance[1], successor, STATE_QUEUED,
+                                   nextTaskInstance[1], nextTaskInstance[0], STATE_MARKED, STATE_MARKED))
+            pendingInputs = 0
+            for predecessor in set([edge['taskInstanceId1'] for edge in plan['edgesIn'].get(nextTaskInstance[0], [])]):
+                if [predecessor, nextTaskInstance[1]] in nextTaskInstances:
+                    pendingInputs += 1
+                else:
+                    executionState = self.latestExecutionState(
+                        cur, nextTaskInstance[1], predecessor)
+                    if executionState is not None and executionState != STATE_MARKED:
+                        pendingInputs += 1
+            queuedExecutions.append(
+                (nextTaskInstance[1], nextTaskInstance[0], entryTime, STATE_QUEUED, pendingInputs))
+        cur.executemany("UPDATE TaskInstanceExecution SET PendingInputs=PendingInputs+1 WHERE WorkflowExecutionId=? AND TaskInstanceId=? AND ExecutionState=? AND IFNULL((SELECT ExecutionState FROM TaskInstanceExecution WHERE WorkflowExecutionId=? AND TaskInstanceId=? ORDER BY Id DESC LIMIT 1),?)=?;",
+                        heldInputs)
+        cur.executemany("INSERT INTO TaskInstanceExecution (WorkflowExecutionId,TaskInstanceId,EntryTime,ExecutionState,PendingInputs) VALUES (?,?,?,?,?);",
+                        queuedExecutions)
+        self.commit()
+        if len(nextTaskInstances) > 0:
+            self.wake()
         cur.close()
 
     def loadQueuedTaskInstances(self):
         cur = self.db.cursor()
-        for loadedTaskInstance in cur.execute(
-                "SELECT TaskInstanceExecution.Id,TaskInstanceExecution.TaskInstanceId,WorkflowExecution.Id,Workflow.Id,Workflow.OutputDataTypeId,Workflow.Title FROM TaskInstanceExecution JOIN WorkflowExecution JOIN Workflow ON (TaskInstanceExecution.WorkflowExecutionId=WorkflowExecution.Id AND WorkflowExecution.WorkflowId=Workflow.Id) WHERE TaskInstanceExecution.ExecutionState=?;", [STATE_QUEUED]):
-            cur2 = self.db.cursor()
+        if cur.execute("SELECT Id FROM TaskInstanceExecution WHERE ExecutionState=? AND PendingInputs=0 AND WorkflowExecutionId IN (SELECT Id FROM WorkflowExecution) LIMIT 1;", [STATE_QUEUED]).fetchone() is None:
+            cur.close()
+            return
+        # loading claims the ready executions, the ones that can't be loaded yet are put back
+        loads = []
+        unloadedTaskInstanceExecutions = []
+        for loadedTaskInstance in sorted(cur.execute(
+                "UPDATE TaskInstanceExecution SET ExecutionState=? WHERE ExecutionState=? AND PendingInputs=0 AND WorkflowExecutionId IN (SELECT Id FROM WorkflowExecution) RETURNING Id,TaskInstanceId,WorkflowExecutionId,(SELECT WorkflowId FROM WorkflowExecution WHERE WorkflowExecution.Id=TaskInstanceExecution.WorkflowExecutionId);", [STATE_LOADED, STATE_QUEUED]).fetchall()):
+            plan = self.workflowPlan(loadedTaskInstance[3])
+            if plan['workflow'] is None:
+                unloadedTaskInstanceExecutions.append(
+                    (STATE_QUEUED, loadedTaskInstance[0]))
+                continue
             edgesWithData = []
             toBeLoaded = True
-            dataTypeId = [loadedTaskInstance[4], loadedTaskInstance[5], 0]
-            for taskInstance in cur2.execute("SELECT InputDataTypeId,Task.Title FROM TaskInstance JOIN Task ON (TaskInstance.TaskId=Task.Id) WHERE TaskInstance.Id=?;", [loadedTaskInstance[1]]):
-                dataTypeId = taskInstance
-            for edgeTaskInstance in cur2.execute(
-                    "SELECT Id FROM Edge WHERE WorkflowId=? AND TaskInstanceId2=?;", [loadedTaskInstance[3], loadedTaskInstance[1]]):
-                edge = self.edge(edgeTaskInstance[0])
-                cur3 = self.db.cursor()
+            dataTypeId = [plan['workflow']['outputDataTypeId'],
+                          plan['workflow']['title'], 0]
+            taskInstance = plan['taskInstances'].get(loadedTaskInstance[1])
+            if taskInstance is not None and plan['tasks'].get(taskInstance['taskId']) is not None:
+                dataTypeId = [plan['tasks'][taskInstance['taskId']]['inputDataTypeId'],
+                              plan['tasks'][taskInstance['taskId']]['title']]
+            for edge in plan['edgesIn'].get(loadedTaskInstance[1], []):
+                edge = dict(edge)
                 dataId1 = None
                 foundButPending = False
-                for taskInstanceExecution in cur3.execute("SELECT Id,ExecutionState,OutputDataId FROM TaskInstanceExecution WHERE WorkflowExecutionId=? AND TaskInstanceId=? ORDER BY Id DESC LIMIT 1;", [loadedTaskInstance[2], edge['taskInstanceId1']]):
+                for taskInstanceExecution in cur.execute("SELECT Id,ExecutionState,OutputDataId FROM TaskInstanceExecution WHERE WorkflowExecutionId=? AND TaskInstanceId=? ORDER BY Id DESC LIMIT 1;", [loadedTaskInstance[2], edge['taskInstanceId1']]):
                     if taskInstanceExecution[1] >= STATE_ENDED:
                         dataId1 = taskInstanceExecution[2]
                     else:
@@ -317,64 +552,39 @@ class Jallad:
                     edge['data1'] = self.dataUsingDataIndex(
                         self.data(dataId1), edge['dataIndex1'])
                     edgesWithData.append(edge)
-                cur3.close()
             if toBeLoaded:
-                data = self.mergePartialIndexing(dataTypeId[0], edgesWithData)
-                dataId = self.saveData(dataTypeId[0], data, dataTypeId[1]+" Input" if len(
-                    dataTypeId) == 2 else dataTypeId[1]+" Result")
-                cur2.execute("UPDATE TaskInstanceExecution SET InputDataId=?,ExecutionState=? WHERE Id=?;", [
-                             dataId, STATE_LOADED, loadedTaskInstance[0]])
-                self.db.commit()
-            cur2.close()
+                loads.append((loadedTaskInstance[0], dataTypeId[0], self.mergePartialIndexing(dataTypeId[0], edgesWithData),
+                              dataTypeId[1]+" Input" if len(dataTypeId) == 2 else dataTypeId[1]+" Result"))
+            else:
+                unloadedTaskInstanceExecutions.append(
+                    (STATE_QUEUED, loadedTaskInstance[0]))
+        # the input Data and the LOADED state commit together, a crash leaves the executions QUEUED to be redone
+        loadedTaskInstanceExecutions = []
+        for taskInstanceExecutionId, dataTypeId, data, title in loads:
+            loadedTaskInstanceExecutions.append((self.saveData(
+                dataTypeId, data, title), taskInstanceExecutionId))
+        cur.executemany("UPDATE TaskInstanceExecution SET InputDataId=? WHERE Id=?;",
+                        loadedTaskInstanceExecutions)
+        cur.executemany("UPDATE TaskInstanceExecution SET ExecutionState=? WHERE Id=?;",
+                        unloadedTaskInstanceExecutions)
+        self.commit()
+        if len(loads) > 0:
+            self.wake()
         cur.close()
-        self.db.commit()
+
+    def dataProgram(self, dataTypeId: int):
+        """Returns the token sequence of the text encoding of a data type, compiled once per update of the data types"""
+        program = self.programs.get(dataTypeId)
+        if program is None:
+            program = compileProgram(self.dataType, dataTypeId)
+            self.programs[dataTypeId] = program
+        return program
 
     def dataToText(self, data):
-        text: str = ""
-        leftDataTypes = [data['dataTypeId']]
-        currentIndex = 0
-        while(len(leftDataTypes) > 0):
-            currentDataType = self.dataType(leftDataTypes.pop(0))
-            if currentDataType['length'] > 0 and len(currentDataType['subDataTypes']) > 0:
-                for i in range(0, currentDataType['length']):
-                    subDataTypes = [subDataType['subDataTypeId']
-                                    for subDataType in currentDataType['subDataTypes']]
-                    leftDataTypes[0:0] = subDataTypes
-                text = text+str(currentDataType['length'])+" "
-            else:
-                text = text+(str(data['values'][currentIndex]) if currentDataType['base'] == DATATYPE_FLOAT or currentDataType['base'] == DATATYPE_INT else
-                             str(len(data['values'][currentIndex]))+" "+" ".join(
-                                 [str(ord(character)) for character in data['values'][currentIndex]])
-                             if currentDataType['base'] == DATATYPE_TEXT else "0")+" "
-                currentIndex = currentIndex+1
-        return text
+        return encodeText(self.dataProgram(data['dataTypeId']), data['values'])
 
     def textToData(self, text: str, dataTypeId: int):
-        values = []
-        input = text.split(" ")
-        leftDataTypes = [dataTypeId]
-        currentIndex = 0
-        while(len(leftDataTypes) > 0):
-            currentDataType = self.dataType(leftDataTypes.pop(0))
-            if currentDataType['length'] > 0 and len(currentDataType['subDataTypes']) > 0:
-                for i in range(0, currentDataType['length']):
-                    subDataTypes = [subDataType['subDataTypeId']
-                                    for subDataType in currentDataType['subDataTypes']]
-                    leftDataTypes[0:0] = subDataTypes
-                if not (int(input[currentIndex]) == currentDataType['length']):
-                    return None
-            else:
-                if currentDataType['base'] == DATATYPE_FLOAT:
-                    values.append(float(input[currentIndex]))
-                elif currentDataType['base'] == DATATYPE_INT:
-                    values.append(int(input[currentIndex]))
-                elif currentDataType['base'] == DATATYPE_TEXT:
-                    textLength = int(input[currentIndex])
-                    text = "".join([chr(int(input[index]))
-                                    for index in range(currentIndex+1, textLength)])
-                    values.append(text)
-            currentIndex = currentIndex+1
-        return values
+        return decodeTokens(self.dataProgram(dataTypeId), text.split())
 
     def dataToObject(self, data):
         dataType = self.dataType(data['dataTypeId'])
@@ -402,128 +612,483 @@ class Jallad:
 
     def objectToData(self, obj, dataTypeId):
         dataType = self.dataType(dataTypeId)
-        print(":objToData:datatype:"+str(dataType))
         if dataType['base'] == DATATYPE_FLOAT or dataType['base'] == DATATYPE_INT or dataType['base'] == DATATYPE_TEXT:
             return [obj]
         elif dataType['base'] == DATATYPE_STRUCTURE:
             values = []
             for elem in obj:
-                print(":objToData:elem:"+str(elem))
                 for subDataType in dataType['subDataTypes']:
-                    print(":objToData:subDataType:"+str(subDataType))
                     values.extend(self.objectToData(
                         elem[subDataType['title']], subDataType['subDataTypeId']))
-                print(":objToData:values:"+str(values))
             return values
         else:
             return []
 
-    def executeSystem(self, task, inputData):
-        cur = self.db.cursor()
-        inputText = self.dataToText(inputData)
-        cur.execute("UPDATE TaskInstanceExecution SET ExecutionState=?,StartTime=? WHERE Id=?;", [
-                    STATE_STARTED, time.time(), task['taskInstanceExecutionId']])
-        self.db.commit()
+    def runSystem(self, task, inputData):
+        """Runs a command on the input, streamed as text tokens or, for an encoding=binary task, as a packed blob"""
+        binary = task.get('encoding') == "binary"
+        inputProgram = self.dataProgram(inputData['dataTypeId'])
+        outputProgram = self.dataProgram(task['outputDataTypeId'])
+        if task.get('persistent') in ["1", "true", "True"]:
+            # a warm instance of the command answers one framed request per execution, see coprocess.Coprocess
+            response = self.coprocesses.request(task['command'], encodeBinary(inputProgram, inputData['values']) if binary else
+                                                encodeText(inputProgram, inputData['values']).encode("utf-8"),
+                                                int(task['maxUses']) if 'maxUses' in task else None,
+                                                float(task['timeout']) if 'timeout' in task else None)
+            return decodeBinary(outputProgram, response) if binary else decodeTokens(outputProgram, response.split())
+        blob = encodeBinary(inputProgram, inputData['values']) if binary else None
         p = Popen(task['command'].split(" "),
-                  stdout=PIPE, stdin=PIPE, stderr=PIPE, text=True)
-        outputText = p.communicate(inputText)
-        outputDataId = self.saveData(task['outputDataTypeId'], self.textToData(
-            outputText, task['outputDataTypeId']), str(task['title'])+" Result")
-        cur.execute("UPDATE TaskInstanceExecution SET OutputDataId=?,ExecutionState=?,EndTime=? WHERE Id=?;", [
-                    outputDataId, STATE_ENDED, time.time(), task['taskInstanceExecutionId']])
-        self.db.commit()
+                  stdout=PIPE, stdin=PIPE, stderr=DEVNULL)
+        # the input is written on another thread while the output is parsed, so that neither pipe fills up
+        writer = threading.Thread(target=self.writeSystemInput, args=(
+            p.stdin, inputProgram, inputData['values'], blob), daemon=True)
+        writer.start()
+        try:
+            if binary:
+                return readBinary(outputProgram, p.stdout)
+            return decodeTokens(outputProgram, readTokens(p.stdout))
+        finally:
+            p.stdout.close()
+            writer.join()
+            p.wait()
+
+    def writeSystemInput(self, stdin, program, values, blob=None):
+        try:
+            if blob is not None:
+                stdin.write(blob)
+            else:
+                writeText(stdin, program, values)
+            stdin.close()
+        except (BrokenPipeError, ValueError):
+            # the command exited or stopped reading its input
+            pass
+
+    def executeSystem(self, task, inputData):
+        self.submitTaskInstance(task, self.executors[TASK_SYSTEM].submit(
+            self.runSystem, task, inputData))
+
+    def nodeUrl(self, ipAddress):
+        return ipAddress if "://" in ipAddress else "http://"+ipAddress
 
     def startService(self, task, inputData):
         cur = self.db.cursor()
         nodes = [dict(zip(['id', 'ipAddress', 'workflowId', 'nodeServiceId'], row)) for row in cur.execute(
             "SELECT Node.id,Node.IpAddress,Service.WorkflowId,Service.NodeServiceId FROM Node JOIN Service ON(Node.Id=Service.NodeId OR Node.Id=0) WHERE Service.UniformServiceId=?;", [task['uniformServiceId']])]
-        minCountNode = None
-        minCount = math.inf
-        for node in nodes:
-            count = requests.get(
-                node['ipAddress']+"/queueCount").json()
-            if minCount > count:
-                minCount = count
-                minCountNode = node
-        res = requests.post(minCountNode['ipAddress']+"/service/"+minCountNode['nodeServiceId']+"/start", json={
-                            'values': inputData['values'], 'callBack': '/taskInstanceExecution/'+str(task['taskInstanceExecutionId'])+'/end'
-                            }).json()
-        cur.execute("UPDATE TaskInstanceExecution SET ExecutionState=?, StartTime=? WHERE Id=?;", [
-            STATE_STARTED, time.time(), task['taskInstanceExecutionId']])
+        cur.close()
+        self.submitTaskInstance(task, self.http.submit(self.dispatchService(
+            task, inputData, nodes)), self.storeServiceDispatch)
+
+    async def dispatchService(self, task, inputData, nodes):
+        """Starts a service execution on the least loaded node, from the cached node loads"""
+        urls = dict([(self.nodeUrl(node['ipAddress']), node)
+                     for node in nodes])
+        url = await self.node_load.choose(list(urls))
+        if url is None:
+            raise RuntimeError("No node available for service " +
+                               str(task['uniformServiceId']))
+        try:
+            request = {'values': inputData['values'], 'callBack': '/taskInstanceExecution/'+str(task['taskInstanceExecutionId'])+'/end',
+                       'callBackBatch': '/taskInstanceExecution/end', 'callBackId': task['taskInstanceExecutionId']}
+            if self.callback_address is not None:
+                request['callBackAddress'] = self.callback_address
+            res = await self.http.request('POST', url+"/service/"+str(urls[url]['nodeServiceId'])+"/start", json=request)
+        except Exception:
+            self.node_load.failed(url)
+            raise
+        return urls[url], res
+
+    def storeServiceDispatch(self, cur, task, dispatch):
+        """Records the node a service execution was started on, releasing the lease as the node calls back when it ends"""
+        node, res = dispatch
+        cur.execute("UPDATE TaskInstanceExecution SET ExecutionState=?,StartTime=?,LeaseOwner=NULL,LeaseExpiry=NULL WHERE Id=? AND ExecutionState=? AND LeaseOwner=?;", [
+            STATE_STARTED, time.time(), task['taskInstanceExecutionId'], STATE_STARTED, self.worker_id])
+        if cur.rowcount == 0:
+            print("lease:lost:"+str(task['taskInstanceExecutionId']))
+            return
         cur.execute("INSERT INTO TaskInstanceExecutionParams (Title,Value,TaskInstanceExecutionId) VALUES (?,?,?);", [
-                    'ipAddress', minCountNode['ipAddress'], task['taskInstanceExecutionId']])
+                    'ipAddress', node['ipAddress'], task['taskInstanceExecutionId']])
         cur.execute("INSERT INTO TaskInstanceExecutionParams (Title,Value,TaskInstanceExecutionId) VALUES (?,?,?);", [
                     'workflowExecutionId', res['workflowExecutionId'], task['taskInstanceExecutionId']])
-        self.db.commit()
 
-    def checkService(self, task):
+    def reconcileServices(self):
+        """Polls the nodes for the service executions started before the last sweep that are still waiting for their callback
+
+        Runs every reconcile_interval, callbacks are the way results arrive, this only catches the lost ones.
+        """
+        now = time.time()
+        if now < self.reconciled+self.reconcile_interval:
+            return
+        self.reconciled = now
         cur = self.db.cursor()
-        nodeInfo = dict([row for row in cur.execute(
-            "SELECT Title,Value FROM TaskInstanceExecutionParams WHERE TaskInstanceExecutionId=?;", [task['taskInstanceExecutionId']])])
-        if "workflowExecutionId" in nodeInfo and "ipAddress" in nodeInfo:
-            res = requests.get(
-                nodeInfo['ipAddress']+"/service/execution/"+nodeInfo['workflowExecutionId']).json()
-            if(res["executionState"] == STATE_ENDED or res["executionState"] == STATE_MARKED):
-                outputDataId = self.saveData(
-                    task['outputDataTypeId'], res['outputDataValues'], str(task['title'])+" Result")
-                cur.execute("UPDATE TaskInstanceExecution SET OutputDataId=?,ExecutionState=?,EndTime=? WHERE Id=?;", [
-                    outputDataId, STATE_ENDED, time.time(), task['taskInstanceExecutionId']])
-
-    def loadWorkflow(self, task, inputData):
+        waiting = cur.execute("SELECT TaskInstanceExecution.Id,Nodes.Value,Executions.Value FROM TaskInstanceExecution JOIN TaskInstanceExecutionParams AS Nodes ON (Nodes.TaskInstanceExecutionId=TaskInstanceExecution.Id AND Nodes.Title='ipAddress') JOIN TaskInstanceExecutionParams AS Executions ON (Executions.TaskInstanceExecutionId=TaskInstanceExecution.Id AND Executions.Title='workflowExecutionId') WHERE TaskInstanceExecution.ExecutionState=? AND TaskInstanceExecution.LeaseOwner IS NULL AND TaskInstanceExecution.StartTime<?;", [
+            STATE_STARTED, now-self.reconcile_interval]).fetchall()
+        cur.close()
+        for taskInstanceExecutionId, ipAddress, workflowExecutionId in waiting:
+            self.onReply(self.http.submit(self.http.request('GET', self.nodeUrl(ipAddress)+"/service/execution/"+str(workflowExecutionId))),
+                         lambda cur, future, taskInstanceExecutionId=taskInstanceExecutionId: self.checkService(cur, taskInstanceExecutionId, future))
+
+    def checkService(self, cur, taskInstanceExecutionId, future):
+        """Ends a service execution from the state of its workflow execution on the node, unless its callback came first"""
+        if future.exception() is not None:
+            print("reconcile:failed:"+str(taskInstanceExecutionId) +
+                  ":"+repr(future.exception()))
+            return
+        res = future.result()
+        if res.get("executionState") == STATE_ENDED or res.get("executionState") == STATE_MARKED:
+            task = None
+            for row in cur.execute("SELECT TaskInstanceId,WorkflowExecutionId FROM TaskInstanceExecution WHERE Id=?;", [taskInstanceExecutionId]):
+                task = self.planTaskInstance(self.workflowPlan(
+                    self.workflowExecution(row[1])['workflowId']), row[0])
+            if task is None:
+                return
+            cur.execute("UPDATE TaskInstanceExecution SET OutputDataId=?,ExecutionState=?,EndTime=? WHERE Id=? AND ExecutionState=?;", [
+                0, STATE_ENDED, time.time(), taskInstanceExecutionId, STATE_STARTED])
+            if cur.rowcount > 0:
+                print("reconcile:ended:"+str(taskInstanceExecutionId))
+                cur.execute("UPDATE TaskInstanceExecution SET OutputDataId=? WHERE Id=?;", [self.saveData(
+                    task['outputDataTypeId'], res['outputDataValues'], str(task['title'])+" Result"), taskInstanceExecutionId])
+        elif res.get("executionState") == STATE_KILLED or res.get("executionState") == STATE_FAILED:
+            for row in cur.execute("UPDATE TaskInstanceExecution SET ExecutionState=?,EndTime=? WHERE Id=? AND ExecutionState=? RETURNING WorkflowExecutionId;", [
+                    STATE_FAILED, time.time(), taskInstanceExecutionId, STATE_STARTED]).fetchall():
+                print("reconcile:failed:"+str(taskInstanceExecutionId))
+                self.failWorkflowExecution(cur, row[0])
+
+    def onReply(self, future, handler):
+        """Hands a finished background request to handler(cur, future) on the daemon thread, see storeReplies"""
+        future.add_done_callback(
+            lambda future: self.completeReply(handler, future))
+
+    def completeReply(self, handler, future):
+        self.replies.put((handler, future))
+        if self.wakeup_listener is not None:
+            self.wakeup_listener.set()
+
+    def storeReplies(self):
+        """Applies the replies of the background requests, callback deliveries and reconciliation polls"""
+        if self.replies.empty():
+            return
+        cur = self.db.cursor()
+        while True:
+            try:
+                handler, future = self.replies.get_nowait()
+            except queue.Empty:
+                break
+            handler(cur, future)
+        self.commit()
+        self.wake()
+        cur.close()
+
+    def deliverCallbacks(self):
+        """Sends the due results in the callback outbox, one batched request per node
+
+        Sending claims the entries until the request can have timed out, an entry is deleted once
+        its node accepted it and retried with a growing delay otherwise. A node gets one request at a
+        time, the results that end meanwhile go together in the next one.
+        """
         cur = self.db.cursor()
-        cur.execute("UPDATE TaskInstanceExecution SET ExecutionState=?,StartTime=? WHERE Id=?;", [
-                    STATE_STARTED, time.time(), task['taskInstanceExecutionId']])
+        now = time.time()
+        busy = [address for address, requests in self.delivering.items()
+                if requests > 0]
+        exclusion = " AND Address NOT IN ("+",".join(["?"]*len(busy))+")" if len(busy) > 0 else ""
+        if cur.execute("SELECT Id FROM CallbackOutbox WHERE NextAttempt<=?"+exclusion+" LIMIT 1;", [now]+busy).fetchone() is None:
+            cur.close()
+            return
+        entries = sorted(cur.execute("UPDATE CallbackOutbox SET NextAttempt=? WHERE NextAttempt<=?"+exclusion+" RETURNING Id,Address,Path,ExecutionId,Body;", [
+            now+self.http_timeout+CALLBACK_RETRY_DELAY, now]+busy).fetchall())
+        self.commit()
+        cur.close()
+        batches = {}
+        for entry in entries:
+            if entry[3] is None:
+                batches[(entry[1], entry[2], entry[0])] = [entry]
+            else:
+                batches.setdefault((entry[1], entry[2], None), []).append(entry)
+        for (address, path, single), batch in batches.items():
+            for start in range(0, len(batch), CALLBACK_BATCH_SIZE):
+                chunk = batch[start:start+CALLBACK_BATCH_SIZE]
+                body = {'values': json.loads(chunk[0][4])} if single is not None else {'results': [
+                    {'taskInstanceExecutionId': entry[3], 'values': json.loads(entry[4])} for entry in chunk]}
+                self.delivering[address] = self.delivering.get(address, 0)+1
+                self.onReply(self.http.submit(self.http.request('POST', address+path, json=body)),
+                             lambda cur, future, address=address, ids=[entry[0] for entry in chunk]: self.storeDelivery(cur, address, ids, future))
+
+    def storeDelivery(self, cur, address, ids, future):
+        self.delivering[address] -= 1
+        if future.exception() is None:
+            cur.executemany("DELETE FROM CallbackOutbox WHERE Id=?;", [
+                            [id] for id in ids])
+            return
+        print("callback:failed:"+str(ids)+":"+repr(future.exception()))
+        now = time.time()
+        cur.executemany("UPDATE CallbackOutbox SET Attempts=Attempts+1,NextAttempt=?+MIN(?*(1<<MIN(Attempts,20)),?) WHERE Id=?;", [
+                        [now, CALLBACK_RETRY_DELAY, CALLBACK_MAX_DELAY, id] for id in ids])
+
+    def loadWorkflow(self, cur, task, inputData):
         cur.execute("INSERT INTO WorkflowExecution (WorkflowId,InputDataId,ExecutionState,EntryTime) VALUES (?,?,?,?);", [
             task['workflowId'], inputData['id'], STATE_LOADED, time.time()])
         workflowExecutionId = cur.lastrowid
-        cur.execute("UPDATE TaskInstanceExecution SET ExecutionState=? WHERE Id=?;", [
-            STATE_STARTED, task['taskInstanceExecutionId']])
         cur.execute("INSERT INTO WorkflowExecutionParams (Title,Value,WorkflowExecutionId) VALUES (?,?,?);", [
                     'taskInstanceExecutionId', task['taskInstanceExecutionId'], workflowExecutionId])
-        self.db.commit()
+
+    def loadElementWorkflows(self, cur, task, inputData):
+        """Loads one execution of the sub-workflow of a map or filter task per element, gathered by gatherElementWorkflows as they end"""
+        subTask = task['subTask']
+        try:
+            elements = self.dataElements(inputData)
+        except ValueError:
+            print(traceback.format_exc())
+            self.failWorkflowExecution(cur, task['workflowExecutionId'])
+            return
+        params = []
+        entryTime = time.time()
+        for index, element in enumerate(elements):
+            cur.execute("INSERT INTO WorkflowExecution (WorkflowId,InputDataId,ExecutionState,EntryTime) VALUES (?,?,?,?);", [
+                subTask['workflowId'], self.saveData(subTask['inputDataTypeId'], element, str(task['title'])+" Element"), STATE_LOADED, entryTime])
+            params.append(('mapTaskInstanceExecutionId',
+                          task['taskInstanceExecutionId'], cur.lastrowid))
+            params.append(('mapIndex', index, cur.lastrowid))
+        cur.executemany("INSERT INTO WorkflowExecutionParams (Title,Value,WorkflowExecutionId) VALUES (?,?,?);",
+                        params)
+        if len(elements) == 0:
+            self.gatherElementWorkflows(cur, task['taskInstanceExecutionId'])
+
+    def gatherElementWorkflows(self, cur, taskInstanceExecutionId):
+        """Ends a map or filter over a sub-workflow once the executions of all its elements ended, in the open transaction"""
+        elements = cur.execute("SELECT CAST(Indices.Value AS INT),WorkflowExecution.ExecutionState,WorkflowExecution.InputDataId,WorkflowExecution.OutputDataId FROM WorkflowExecutionParams AS Parents JOIN WorkflowExecutionParams AS Indices ON (Indices.WorkflowExecutionId=Parents.WorkflowExecutionId AND Indices.Title='mapIndex') JOIN WorkflowExecution ON (WorkflowExecution.Id=Parents.WorkflowExecutionId) WHERE Parents.Title='mapTaskInstanceExecutionId' AND Parents.Value=?;", [
+                               str(taskInstanceExecutionId)]).fetchall()
+        if any([element[1] != STATE_ENDED for element in elements]):
+            return
+        task = None
+        for row in cur.execute("SELECT TaskInstanceId,WorkflowExecutionId FROM TaskInstanceExecution WHERE Id=? AND ExecutionState=?;", [taskInstanceExecutionId, STATE_STARTED]):
+            task = self.planTaskInstance(self.workflowPlan(
+                self.workflowExecution(row[1])['workflowId']), row[0])
+        if task is None:
+            return
+        values = []
+        for index, executionState, inputDataId, outputDataId in sorted(elements):
+            outputData = self.data(outputDataId)
+            outputValues = [] if outputData is None else outputData['values']
+            if task['type'] == TASK_MAP:
+                values.extend(outputValues)
+            elif self.elementPredicate(outputValues):
+                values.extend(self.data(inputDataId)['values'])
+        cur.execute("UPDATE TaskInstanceExecution SET OutputDataId=?,ExecutionState=?,EndTime=? WHERE Id=?;", [self.saveData(
+            task['outputDataTypeId'], values, str(task['title'])+" Result"), STATE_ENDED, time.time(), taskInstanceExecutionId])
+
+    async def fetchWeb(self, task, inputData):
+        inputObj = self.dataToObject(inputData)[0]
+        outputObj = await self.http.request(task['method'], task['url'], data=(
+            json.dumps(inputObj) if task['sendBody'] else None))
+        return self.objectToData(outputObj, task['outputDataTypeId'])
 
     def executeWeb(self, task, inputData):
-        cur = self.db.cursor()
-        inputObj = self.dataToObject(inputData)
-        cur.execute("UPDATE TaskInstanceExecution SET ExecutionState=?,StartTime=? WHERE Id=?;", [
-                    STATE_STARTED, time.time(), task['taskInstanceExecutionId']])
-        self.db.commit()
-        outputObj = requests.request(url=task['url'], method=task['method'], data=(
-            json.dumps(inputObj) if task['sendBody'] else None)).json()
-        outputDataId = self.saveData(task['outputDataTypeId'], self.objectToData(
-            outputObj, task['outputDataTypeId']), str(task['title'])+" Result")
-        cur.execute("UPDATE TaskInstanceExecution SET OutputDataId=?,ExecutionState=?,EndTime=? WHERE Id=?;", [
-                    outputDataId, STATE_ENDED, time.time(), task['taskInstanceExecutionId']])
+        self.submitTaskInstance(task, self.http.submit(
+            self.fetchWeb(task, inputData)))
+
+    def scriptLimits(self, task):
+        """(timeout, memory limit) a script task sets with its params, None for the pool's defaults"""
+        return (float(task['timeout']) if 'timeout' in task else None,
+                int(task['memoryLimit']) if 'memoryLimit' in task else None)
+
+    def runScript(self, task, inputData):
+        output = self.script_pool.run(task['id'], task['code'], self.dataToObject(inputData)[0],
+                                      *self.scriptLimits(task))
+        if output is not None:
+            return self.objectToData(output, task['outputDataTypeId'])
+        return None
 
     def executeScript(self, task, inputData):
-        cur = self.db.cursor()
-        cur.execute("UPDATE TaskInstanceExecution SET ExecutionState=?,StartTime=? WHERE Id=?;", [
-                    STATE_STARTED, time.time(), task['taskInstanceExecutionId']])
-        self.db.commit()
-        locals = {"input": self.dataToObject(inputData)[0]}
-        try:
-            exec(task['code'], globals(), locals)
-            print(locals)
-            outputDataId = 0
-            if "output" in locals:
-                outputData=self.objectToData(
-                    locals["output"], task['outputDataTypeId'])
-                print(outputData)
-                outputDataId = self.saveData(task['outputDataTypeId'], outputData, str(task['title'])+" Result")
-                print(outputDataId)
-            cur.execute("UPDATE TaskInstanceExecution SET OutputDataId=?,ExecutionState=?,EndTime=? WHERE Id=?;", [
-                    outputDataId, STATE_ENDED, time.time(), task['taskInstanceExecutionId']])
-        except Exception:
-            print(locals)
-            print(traceback.format_exc())
-            cur.execute("UPDATE TaskInstanceExecution SET ExecutionState=?,EndTime=? WHERE WorkflowExecutionId=?;", [
-                    STATE_FAILED, time.time(), task['workflowExecutionId']])
-            cur.execute("UPDATE WorkflowExecution SET ExecutionState=?,EndTime=? WHERE Id=?;", [
-                    STATE_FAILED, time.time(), task['workflowExecutionId']])
-        self.db.commit()
+        self.submitTaskInstance(task, self.executors[TASK_SCRIPT].submit(
+            self.runScript, task, inputData))
+
+    def dataElements(self, data):
+        """Splits array data, a STRUCTURE with a length over 1, into the leaf values of its elements"""
+        dataType = self.dataType(data['dataTypeId'])
+        if dataType['base'] != DATATYPE_STRUCTURE or dataType['length'] <= 1:
+            raise ValueError("Data type "+str(data['dataTypeId'])+" is not an array")
+        return splitElements(list(data['values']), dataType['length'], self.dataLayout(data['dataTypeId'])['leafCount'])
+
+    def isLeased(self, task):
+        """Whether an execution runs on this worker until it ends, a map or filter over a sub-workflow ends with the workflow executions of its elements instead"""
+        if task['type'] in DATA_PARALLEL and task['type'] != TASK_REDUCE:
+            return task['subTask']['type'] != TASK_WORKFLOW
+        return task['type'] in self.running
+
+    def elementPool(self):
+        """Returns the thread pool handing chunks of script elements to the element script pool, both started on first use
+
+        The chunks run on worker processes of their own, with the script timeout and memory limit applied per element.
+        """
+        if self.element_pool is None:
+            self.element_scripts = ScriptPool(self.map_workers, timeout=self.script_timeout,
+                                              memory_limit=self.script_memory_limit)
+            self.element_pool = ThreadPoolExecutor(
+                max_workers=self.map_workers, thread_name_prefix="jallad-elements")
+        return self.element_pool
 
-    def endWorkflowExecution(self, workflowExecution, outputData):
+    def elementPredicate(self, values):
+        return len(values) > 0 and bool(values[0])
+
+    def runSystemElements(self, subTask, elementsData):
+        return [self.runSystem(subTask, elementData) for elementData in elementsData]
+
+    async def fetchWebElements(self, subTask, elementsData):
+        return await asyncio.gather(*[self.fetchWeb(subTask, elementData) for elementData in elementsData])
+
+    def submitElements(self, subTask, elements, chunkSize):
+        """Hands the chunks of elements to the pool running the sub task
+
+        :return: list of (start, future) per chunk, the future gives the output of each element
+        """
+        chunks = []
+        for start, end in chunkRanges(len(elements), chunkSize):
+            elementsData = [{'dataTypeId': subTask['inputDataTypeId'], 'values': element}
+                            for element in elements[start:end]]
+            if subTask['type'] == TASK_SCRIPT:
+                future = self.elementPool().submit(self.element_scripts.map, subTask['id'], subTask['code'], [
+                    self.dataToObject(elementData)[0] for elementData in elementsData], *self.scriptLimits(subTask))
+            elif subTask['type'] == TASK_SYSTEM:
+                future = self.executors[TASK_SYSTEM].submit(
+                    self.runSystemElements, subTask, elementsData)
+            elif subTask['type'] == TASK_WEB:
+                future = self.http.submit(
+                    self.fetchWebElements(subTask, elementsData))
+            else:
+                raise ValueError("Task type "+str(subTask['type'])+" can't be applied to elements")
+            chunks.append((start, future))
+        return chunks
+
+    def chunkOutputs(self, subTask, future, filter):
+        outputs = future.result()
+        if subTask['type'] == TASK_SCRIPT:
+            if filter:
+                return [bool(output) for output in outputs]
+            return [self.objectToData(output, subTask['outputDataTypeId']) for output in outputs]
+        if filter:
+            return [self.elementPredicate(output or []) for output in outputs]
+        return [output or [] for output in outputs]
+
+    def runDataParallel(self, task, inputData):
+        """Applies the sub task of a map, filter or reduce task to the elements of its input, run on the coordinator pool
+
+        The elements are split into chunks handed to the sub task's pool, script elements run on the
+        element script pool. The chunk results are consumed in order as they arrive, a map concatenates the
+        outputs of the elements, a filter the elements whose output is true and a reduce folds them.
+        """
+        subTask = task['subTask']
+        elements = self.dataElements(inputData)
+        chunkSize = int(task['chunkSize']) if 'chunkSize' in task else self.map_chunk_size or defaultChunkSize(
+            len(elements), self.map_workers)
+        if task['type'] == TASK_REDUCE:
+            return self.reduceElements(task, elements, chunkSize)
+        filter = task['type'] == TASK_FILTER
+        values = []
+        for start, future in self.submitElements(subTask, elements, chunkSize):
+            for index, output in enumerate(self.chunkOutputs(subTask, future, filter)):
+                if not filter:
+                    values.extend(output)
+                elif output:
+                    values.extend(elements[start+index])
+        return values
+
+    def reduceElements(self, task, elements, chunkSize):
+        """Reduces every chunk on the element script pool and folds the partial results in order there too, the script must be associative"""
+        subTask = task['subTask']
+        if subTask['type'] != TASK_SCRIPT:
+            raise ValueError("Reduce needs a script task, got type " +
+                             str(subTask['type']))
+        limits = self.scriptLimits(subTask)
+        futures = [self.elementPool().submit(self.element_scripts.reduce, subTask['id'], subTask['code'], [self.dataToObject({'dataTypeId': subTask['inputDataTypeId'], 'values': element})[0]
+                                                                                                           for element in elements[start:end]], None, False, *limits)
+                   for start, end in chunkRanges(len(elements), chunkSize)]
+        hasAccumulator = 'initial' in task
+        accumulator = json.loads(task['initial']) if hasAccumulator else None
+        for future in futures:
+            accumulator = self.element_scripts.reduce(
+                subTask['id'], subTask['code'], [future.result()], accumulator, hasAccumulator, *limits)
+            hasAccumulator = True
+        return self.objectToData(accumulator, task['outputDataTypeId'])
+
+    def executeDataParallel(self, task, inputData):
+        self.submitTaskInstance(task, self.executors[task['type']].submit(
+            self.runDataParallel, task, inputData))
+
+    def submitTaskInstance(self, task, future, store=None):
+        """Tracks a started task execution running on a worker pool or the HTTP engine
+
+        The result is stored by endCompletedTaskInstances on the daemon thread.
+
+        :param future: future of the output values, None for no output
+        :param store: called as store(cur, task, result) instead of ending the execution with the output values
+        """
+        self.running[task['type']] += 1
+        future.add_done_callback(
+            lambda future: self.completeTaskInstance(task, future, store))
+
+    def completeTaskInstance(self, task, future, store):
+        """Hands a finished execution back to the daemon thread, called on the worker thread"""
+        self.completed.put((task, future, store))
+        if self.wakeup_listener is not None:
+            self.wakeup_listener.set()
+
+    def endCompletedTaskInstances(self):
+        """Stores the results of the executions finished by the worker pools and the HTTP engine"""
         cur = self.db.cursor()
+        completed = 0
+        while True:
+            try:
+                task, future, store = self.completed.get_nowait()
+            except queue.Empty:
+                break
+            completed += 1
+            self.running[task['type']] -= 1
+            try:
+                outputData = future.result()
+                if store is not None:
+                    store(cur, task, outputData)
+            except Exception:
+                print(traceback.format_exc())
+                cur.execute("UPDATE TaskInstanceExecution SET ExecutionState=?,EndTime=?,LeaseOwner=NULL,LeaseExpiry=NULL WHERE Id=? AND ExecutionState=? AND LeaseOwner=?;", [
+                    STATE_FAILED, time.time(), task['taskInstanceExecutionId'], STATE_STARTED, self.worker_id])
+                if cur.rowcount > 0:
+                    self.failWorkflowExecution(
+                        cur, task['workflowExecutionId'])
+            else:
+                if store is None:
+                    # ending claims the execution, unless its lease expired and another worker reclaimed it
+                    cur.execute("UPDATE TaskInstanceExecution SET OutputDataId=?,ExecutionState=?,EndTime=?,LeaseOwner=NULL,LeaseExpiry=NULL WHERE Id=? AND ExecutionState=? AND LeaseOwner=?;", [
+                        0, STATE_ENDED, time.time(), task['taskInstanceExecutionId'], STATE_STARTED, self.worker_id])
+                    if cur.rowcount == 0:
+                        print("lease:lost:" +
+                              str(task['taskInstanceExecutionId']))
+                    elif outputData is not None:
+                        outputDataId = self.saveData(
+                            task['outputDataTypeId'], outputData, str(task['title'])+" Result")
+                        cur.execute("UPDATE TaskInstanceExecution SET OutputDataId=? WHERE Id=?;", [
+                                    outputDataId, task['taskInstanceExecutionId']])
+                        if 'resultKey' in task:
+                            self.storeResult(cur, task, outputDataId)
+            self.wake()
+        if completed > 0:
+            self.commit()
+        cur.close()
+
+    def failWorkflowExecution(self, cur, workflowExecutionId):
+        """Fails a workflow execution in the open transaction, with the map, filter or workflow task waiting for it
+
+        The task holds no lease and would stay started, its own workflow execution fails in turn.
+        """
+        cur.execute("UPDATE TaskInstanceExecution SET ExecutionState=?,EndTime=? WHERE WorkflowExecutionId=?;", [
+            STATE_FAILED, time.time(), workflowExecutionId])
+        cur.execute("UPDATE WorkflowExecution SET ExecutionState=?,EndTime=? WHERE Id=?;", [
+            STATE_FAILED, time.time(), workflowExecutionId])
+        for param in cur.execute("SELECT Value FROM WorkflowExecutionParams WHERE WorkflowExecutionId=? AND Title IN ('taskInstanceExecutionId','mapTaskInstanceExecutionId');", [workflowExecutionId]).fetchall():
+            for row in cur.execute("UPDATE TaskInstanceExecution SET ExecutionState=?,EndTime=? WHERE Id=? AND ExecutionState=? RETURNING WorkflowExecutionId;", [
+                    STATE_FAILED, time.time(), int(param[0]), STATE_STARTED]).fetchall():
+                self.failWorkflowExecution(cur, row[0])
+
+    def endWorkflowExecution(self, cur, workflowExecution, outputData):
+        """Ends a workflow execution in the open transaction, queueing its output in the callback outbox if a node waits for it"""
         cur.execute("UPDATE WorkflowExecution SET OutputDataId=?,ExecutionState=?,EndTime=? WHERE Id=?;", [
                     outputData['id'], STATE_ENDED, time.time(), workflowExecution['id']])
         print("workflow:end:"+str(outputData['values']))
@@ -531,66 +1096,217 @@ class Jallad:
         for param in cur.execute("SELECT Title,Value FROM WorkflowExecutionParams WHERE WorkflowExecutionId=?;", [workflowExecution['id']]):
             params[param[0]] = param[1]
         if 'callBack' in params and 'remoteAddr' in params:
-            requests.post("http://"+params['remoteAddr']+params['callBack'], json={
-                'values': outputData['values']}).json()
+            batched = 'callBackBatch' in params and 'callBackId' in params
+            cur.execute("INSERT INTO CallbackOutbox (Address,Path,ExecutionId,Body,NextAttempt,Created) VALUES (?,?,?,?,?,?);", [
+                params.get('callBackAddress', "http://"+params['remoteAddr']), params['callBackBatch'] if batched else params['callBack'],
+                int(params['callBackId']) if batched else None, json.dumps(list(outputData['values'])), time.time(), time.time()])
         if 'taskInstanceExecutionId' in params:
             cur.execute("UPDATE TaskInstanceExecution SET OutputDataId=?,ExecutionState=?,EndTime=? WHERE Id=?;", [
                 outputData['id'], STATE_ENDED, time.time(), params['taskInstanceExecutionId']])
+        if 'mapTaskInstanceExecutionId' in params:
+            self.gatherElementWorkflows(
+                cur, int(params['mapTaskInstanceExecutionId']))
+
+    def isCacheable(self, task):
+        """Whether the output of a task is reused for the same input, opted in with a cacheable task param
+
+        Only scripts, system commands and GET requests are, their output is taken to depend on their
+        definition and input alone.
+        """
+        if task.get('cacheable') not in ["1", "true", "True"]:
+            return False
+        if task['type'] == TASK_WEB:
+            return str(task.get('method', "")).upper() == "GET"
+        return task['type'] in [TASK_SCRIPT, TASK_SYSTEM]
+
+    def cachedResult(self, key):
+        """
+        :return: id of the output Data cached for a result key, None if there is none or it expired
+        """
+        cur = self.db.cursor()
+        outputDataId = None
+        for row in cur.execute("SELECT TaskResultCache.OutputDataId FROM TaskResultCache JOIN Data ON (Data.Id=TaskResultCache.OutputDataId) WHERE TaskResultCache.Key=? AND TaskResultCache.Expiry>?;", [
+                key, time.time()]):
+            outputDataId = row[0]
+        cur.close()
+        return outputDataId
+
+    def storeResult(self, cur, task, outputDataId):
+        """Caches the output of an execution of a cacheable task in the open transaction"""
+        now = time.time()
+        ttl = float(task['ttl']) if 'ttl' in task else self.result_cache_ttl
+        cur.execute("INSERT INTO TaskResultCache (Key,TaskId,OutputDataId,Created,Expiry,LastUsed) VALUES (?,?,?,?,?,?) ON CONFLICT(Key) DO UPDATE SET OutputDataId=excluded.OutputDataId,Created=excluded.Created,Expiry=excluded.Expiry,LastUsed=excluded.LastUsed,Hits=0;", [
+                    task['resultKey'], task['id'], outputDataId, now, now+ttl, now])
+
+    def evictTaskResults(self):
+        """Drops the expired task results and the least recently used ones over result_cache_size
+
+        Runs every RESULT_CACHE_EVICT_INTERVAL, the size may be exceeded in between. Lookups skip expired
+        results whenever they run.
+        """
+        now = time.time()
+        if now < self.results_evicted+RESULT_CACHE_EVICT_INTERVAL:
+            return
+        self.results_evicted = now
+        cur = self.db.cursor()
+        cur.execute("DELETE FROM TaskResultCache WHERE Expiry<=?;", [now])
+        evicted = cur.rowcount
+        cur.execute("DELETE FROM TaskResultCache WHERE Key IN (SELECT Key FROM TaskResultCache ORDER BY LastUsed DESC LIMIT -1 OFFSET ?);", [
+                    self.result_cache_size])
+        evicted = evicted+cur.rowcount
+        self.commit()
+        cur.close()
+        self.metrics['resultCacheEvictions'] += evicted
 
     def executeLoadedTaskInstances(self):
         cur = self.db.cursor()
+        starting = {}
+        startedTasks = []
+        cachedTasks = []
+        resultKeys = {}
+        # (workflowId, taskInstanceId) of tasks whose pool is full, their other executions wait as well
+        waiting = set()
         for loadedTaskInstance in cur.execute(
-                "SELECT Id,TaskInstanceId,InputDataId,WorkflowExecutionId FROM TaskInstanceExecution WHERE ExecutionState=?;", [STATE_LOADED]):
-            cur2 = self.db.cursor()
-            cur2.execute("UPDATE TaskInstanceExecution SET StartTime=?,ExecutionState=? WHERE Id=?;", [
-                time.time(), STATE_STARTED, loadedTaskInstance[0]])
-            self.db.commit()
-            task = self.taskInstance(loadedTaskInstance[1])
+                "SELECT TaskInstanceExecution.Id,TaskInstanceExecution.TaskInstanceId,TaskInstanceExecution.InputDataId,TaskInstanceExecution.WorkflowExecutionId,WorkflowExecution.WorkflowId FROM TaskInstanceExecution JOIN WorkflowExecution ON (TaskInstanceExecution.WorkflowExecutionId=WorkflowExecution.Id) WHERE TaskInstanceExecution.ExecutionState=?;", [STATE_LOADED]).fetchall():
+            if (loadedTaskInstance[4], loadedTaskInstance[1]) in waiting:
+                continue
+            plan = self.workflowPlan(loadedTaskInstance[4])
+            task = self.planTaskInstance(plan, loadedTaskInstance[1])
             if task['type'] == TASK_DECISION:
-                task = self.taskInstance(
-                    loadedTaskInstance[1], task('subTaskId'))
+                task = self.planTaskInstance(
+                    plan, loadedTaskInstance[1], int(task['subTaskId']))
+            elif task['type'] in DATA_PARALLEL:
+                task['subTask'] = self.planTask(plan, int(task['subTaskId']))
+            inputData = None
+            outputDataId = None
+            if self.isCacheable(task):
+                # an execution waiting for a slot is looked up again every tick, an identical one may end meanwhile
+                if loadedTaskInstance[0] not in self.result_keys:
+                    inputData = self.data(loadedTaskInstance[2])
+                    self.result_keys[loadedTaskInstance[0]] = resultKey(
+                        task, inputData)
+                task['resultKey'] = self.result_keys[loadedTaskInstance[0]]
+                resultKeys[loadedTaskInstance[0]] = task['resultKey']
+                outputDataId = self.cachedResult(task['resultKey'])
+            if outputDataId is None and self.isLeased(task):
+                if self.running[task['type']]+starting.get(task['type'], 0) >= self.concurrency[task['type']]:
+                    if 'resultKey' not in task:
+                        waiting.add(
+                            (loadedTaskInstance[4], loadedTaskInstance[1]))
+                    continue
+                starting[task['type']] = starting.get(task['type'], 0)+1
             task['taskInstanceExecutionId'] = loadedTaskInstance[0]
             task['workflowExecutionId'] = loadedTaskInstance[3]
-            inputData = self.data(loadedTaskInstance[2])
+            if outputDataId is not None:
+                cachedTasks.append((task, outputDataId))
+            else:
+                startedTasks.append((task, inputData if inputData is not None else self.data(
+                    loadedTaskInstance[2])))
+        self.result_keys = resultKeys
+        if len(startedTasks) == 0 and len(cachedTasks) == 0:
+            cur.close()
+            return
+        startTime = time.time()
+        # an execution whose output is cached ends with it right away, nothing runs
+        reused = []
+        for task, outputDataId in cachedTasks:
+            cur.execute("UPDATE TaskInstanceExecution SET StartTime=?,EndTime=?,ExecutionState=?,OutputDataId=? WHERE Id=? AND ExecutionState=?;", [
+                startTime, startTime, STATE_ENDED, outputDataId, task['taskInstanceExecutionId'], STATE_LOADED])
+            if cur.rowcount > 0:
+                reused.append((startTime, task['resultKey']))
+        cur.executemany(
+            "UPDATE TaskResultCache SET LastUsed=?,Hits=Hits+1 WHERE Key=?;", reused)
+        self.metrics['resultCacheHits'] += len(reused)
+        if len(reused) > 0:
+            self.wake()
+        # starting claims the executions before they are handed to the worker pools, a worker that crashes
+        # while running them stops renewing their leases and they are reclaimed by renewLeases
+        claimedTasks = []
+        for task, inputData in startedTasks:
+            leased = self.isLeased(task)
+            cur.execute("UPDATE TaskInstanceExecution SET StartTime=?,ExecutionState=?,LeaseOwner=?,LeaseExpiry=? WHERE Id=? AND ExecutionState=?;", [
+                startTime, STATE_STARTED, self.worker_id if leased else None, startTime+self.lease_duration if leased else None, task['taskInstanceExecutionId'], STATE_LOADED])
+            if cur.rowcount > 0:
+                claimedTasks.append((task, inputData))
+                if 'resultKey' in task:
+                    self.metrics['resultCacheMisses'] += 1
+        startedTasks = claimedTasks
+        for task, inputData in startedTasks:
+            if task['type'] == TASK_WORKFLOW:
+                self.loadWorkflow(cur, task, inputData)
+            elif task['type'] in DATA_PARALLEL and not self.isLeased(task):
+                self.loadElementWorkflows(cur, task, inputData)
+            elif task['type'] == TASK_TERMINAL:
+                self.endWorkflowExecution(cur, self.workflowExecution(
+                    task['workflowExecutionId']), inputData)
+                cur.execute("UPDATE TaskInstanceExecution SET EndTime=?,ExecutionState=? WHERE Id=?;", [
+                    time.time(), STATE_ENDED, task['taskInstanceExecutionId']])
+        self.commit()
+        cur.close()
+        for task, inputData in startedTasks:
             if task['type'] == TASK_SYSTEM:
                 self.executeSystem(task, inputData)
             elif task['type'] == TASK_SERVICE:
                 self.startService(task, inputData)
-            elif task['type'] == TASK_WORKFLOW:
-                self.loadWorkflow(task, inputData)
             elif task['type'] == TASK_WEB:
                 self.executeWeb(task, inputData)
             elif task['type'] == TASK_SCRIPT:
                 self.executeScript(task, inputData)
-            # elif task['type'] == TASK_MAP:
-            #     for i in inputData['dataTypeId']:
-
-            # elif task['type'] == TASK_REDUCE:
-            elif task['type'] == TASK_TERMINAL:
-                self.endWorkflowExecution(self.workflowExecution(
-                    loadedTaskInstance[3]), inputData)
-                cur2.execute("UPDATE TaskInstanceExecution SET EndTime=?,ExecutionState=? WHERE Id=?;", [
-                    time.time(), STATE_ENDED, loadedTaskInstance[0]])
-            cur2.close()
-        cur.close()
-        self.db.commit()
+            elif task['type'] in DATA_PARALLEL and self.isLeased(task):
+                self.executeDataParallel(task, inputData)
+            elif not self.isLeased(task):
+                self.wake()
 
     def startLoadedWorkflows(self):
+        """Starts LOADED workflow executions, queueing their input terminals in one transaction
+
+        Every LOADED task execution takes one of WORKFLOW_START_BATCH_SIZE, executeLoadedTaskInstances goes
+        through all of them every tick. At least one workflow execution starts per tick.
+        """
         cur = self.db.cursor()
-        for row in cur.execute("SELECT * FROM WorkflowExecution WHERE ExecutionState=? ORDER BY Id ASC LIMIT 1;", [STATE_LOADED]):
-            cur2 = self.db.cursor()
+        if cur.execute("SELECT Id FROM WorkflowExecution WHERE ExecutionState=? LIMIT 1;", [STATE_LOADED]).fetchone() is None:
+            cur.close()
+            return
+        loaded = cur.execute("SELECT COUNT(*) FROM (SELECT 1 FROM TaskInstanceExecution WHERE ExecutionState=? LIMIT ?);", [
+                             STATE_LOADED, WORKFLOW_START_BATCH_SIZE]).fetchone()[0]
+        startTime = time.time()
+        # starting claims the workflow execution, only the worker that started it queues its input terminal
+        terminalTaskInstanceExecutions = []
+        for row in cur.execute("UPDATE WorkflowExecution SET ExecutionState=?,StartTime=? WHERE Id IN (SELECT Id FROM WorkflowExecution WHERE ExecutionState=? ORDER BY Id ASC LIMIT ?) RETURNING Id,WorkflowId,InputDataId;", [
+                STATE_STARTED, startTime, STATE_LOADED, max(1, WORKFLOW_START_BATCH_SIZE-loaded)]).fetchall():
             workflowExecution = dict(
-                zip(['id', 'workflowId', 'entryTime', 'inputDataId', 'executionState', 'startTime', 'outputDataId', 'endTime'], row))
-            cur2.execute("UPDATE WorkflowExecution SET ExecutionState=?,StartTime=? WHERE Id=? RETURNING WorkflowId;", [
-                STATE_STARTED, time.time(), workflowExecution['id']])
-            terminals = [row2[0] for row2 in cur2.execute(
-                'SELECT Id FROM TaskInstance WHERE WorkflowId=? AND TaskId=0 ORDER BY Id ASC LIMIT 1;', [workflowExecution['workflowId']])]
+                zip(['id', 'workflowId', 'inputDataId'], row))
+            terminals = self.workflowPlan(
+                workflowExecution['workflowId'])['terminals'][:1]
             for terminal in terminals:
-                cur2.execute('INSERT INTO TaskInstanceExecution (WorkflowExecutionId,TaskInstanceId,EntryTime,InputDataId,ExecutionState,StartTime,OutputDataId,EndTime) VALUES (?,?,?,?,?,?,?,?);', [
-                    workflowExecution['id'], terminal, time.time(), 0, STATE_ENDED, time.time(), workflowExecution['inputDataId'], time.time()])
-            cur2.close()
+                terminalTaskInstanceExecutions.append(
+                    (workflowExecution['id'], terminal, startTime, 0, STATE_ENDED, startTime, workflowExecution['inputDataId'], startTime))
+        cur.executemany('INSERT INTO TaskInstanceExecution (WorkflowExecutionId,TaskInstanceId,EntryTime,InputDataId,ExecutionState,StartTime,OutputDataId,EndTime) VALUES (?,?,?,?,?,?,?,?);',
+                        terminalTaskInstanceExecutions)
+        self.commit()
+        if len(terminalTaskInstanceExecutions) > 0:
+            self.wake()
+        cur.close()
+
+    def renewLeases(self):
+        """Extends the leases of the executions running on this worker and reclaims the expired leases of other workers
+
+        Runs every third of the lease duration, an execution whose worker crashed goes back to LOADED to be started again.
+        """
+        now = time.time()
+        if now < self.lease_renewed+self.lease_duration/3:
+            return
+        self.lease_renewed = now
+        cur = self.db.cursor()
+        cur.execute("UPDATE TaskInstanceExecution SET LeaseExpiry=? WHERE LeaseOwner=? AND ExecutionState=?;", [
+                    now+self.lease_duration, self.worker_id, STATE_STARTED])
+        reclaimed = cur.execute("UPDATE TaskInstanceExecution SET ExecutionState=?,LeaseOwner=NULL,LeaseExpiry=NULL WHERE LeaseExpiry<? AND ExecutionState=? RETURNING Id;", [
+            STATE_LOADED, now, STATE_STARTED]).fetchall()
+        self.commit()
+        if len(reclaimed) > 0:
+            print("lease:reclaimed:"+str([row[0] for row in reclaimed]))
+            self.wake()
         cur.close()
-        self.db.commit()
 
     def workflowExecution(self, workflowExecutionId: int):
         cur = self.db.cursor()
@@ -604,34 +1320,164 @@ class Jallad:
 
 
     is_executing = True
+    is_woken = False
+    wakeup_listener = None
 
     def stop(self):
         """Stops the daemon"""
         self.is_executing = False
 
+    def wake(self):
+        """Makes the next sleep return immediately, used after state transitions"""
+        self.is_woken = True
+
     def sleep(self):
-        """Makes the process sleep"""
+        """Makes the process sleep until notified or the sleep interval elapses"""
+        if self.is_woken and self.wakeup_listener is not None:
+            self.is_woken = False
+            self.next_start_time = time.time()
+            return
+        self.is_woken = False
         sleep_duration = self.next_start_time+self.sleep_interval-time.time()
         if(sleep_duration > 0):
-            time.sleep(sleep_duration)
+            if self.wakeup_listener is not None:
+                self.wakeup_listener.wait(sleep_duration)
+            else:
+                time.sleep(sleep_duration)
         self.next_start_time = time.time()
 
-    def start(self, sleep_interval=5):
+    def tick(self):
+        """Runs every scheduler phase once, timing each"""
+        for phase in PHASES:
+            phaseStart = time.perf_counter()
+            getattr(self, phase)()
+            self.metrics['phaseTime'][phase] += time.perf_counter()-phaseStart
+        self.metrics['ticks'] += 1
+
+    def start(self, sleep_interval=5, event_driven=True, wakeup_address=WAKEUP_ADDRESS, metrics_interval=60):
         """Runs the daemon iteratively
 
         :param sleep_interval: maximum sleep duration between iterations
+        :param event_driven: wake up on notifications and own state transitions instead of only polling
+        :param wakeup_address: (host, port) to listen on for notifications from the webserver
+        :param metrics_interval: seconds between metrics reports, 0 to disable them
         """
         self.is_executing = True
         self.sleep_interval = sleep_interval
         self.next_start_time = time.time()
+        if event_driven:
+            try:
+                self.wakeup_listener = WakeupListener(wakeup_address)
+            except OSError:
+                print("wakeup:unavailable:"+str(wakeup_address)+", polling")
         self.updateDataTypes()
-        while self.is_executing:
-            self.startLoadedWorkflows()
-            self.queueNextTaskInstances()
-            self.loadQueuedTaskInstances()
-            self.executeLoadedTaskInstances()
-            self.sleep()
+        self.resetMetrics()
+        try:
+            while self.is_executing:
+                self.tick()
+                if metrics_interval > 0 and time.time() >= self.metrics_start+metrics_interval:
+                    self.reportMetrics()
+                self.sleep()
+        finally:
+            # an interrupted phase left its transaction half applied, it's redone by whichever worker runs it next
+            self.db.rollback()
+            # wait for the executions still on the worker pools so that their results are stored
+            while sum(self.running.values()) > 0:
+                self.completed.put(self.completed.get())
+                self.endCompletedTaskInstances()
+            if self.wakeup_listener is not None:
+                self.wakeup_listener.close()
+                self.wakeup_listener = None
+            self.registry.stop()
 
 
-jallad = Jallad()
-jallad.start(0.5)
+def concurrencyOption(value):
+    """Parses a --concurrency option, <task type>=<maximum parallel executions>"""
+    name, separator, count = value.partition("=")
+    if name not in TASK_NAMES or not count.isdigit() or int(count) < 1:
+        raise argparse.ArgumentTypeError(
+            "expected <"+"|".join(TASK_NAMES)+">=<count>, got "+value)
+    return TASK_NAMES[name], int(count)
+
+
+def work(options, index=0):
+    jallad = Jallad(db_name=options.db, registry_protocol=options.registry_protocol, registry_host=options.registry_host,
+                    registry_port=options.registry_port, registry_cache=options.registry_cache or None,
+                    registry_refresh_interval=options.registry_refresh_interval, concurrency=dict(options.concurrency),
+                    http_limit_per_host=options.http_limit_per_host, http_timeout=options.http_timeout,
+                    pack_data=options.pack_data, lease_duration=options.lease_duration, map_workers=options.map_workers,
+                    map_chunk_size=options.map_chunk_size, script_timeout=options.script_timeout,
+                    script_memory_limit=options.script_memory_limit, coprocess_max_uses=options.coprocess_max_uses,
+                    coprocess_timeout=options.coprocess_timeout, node_load_ttl=options.node_load_ttl,
+                    node_policy=options.node_policy, callback_address=options.callback_address,
+                    reconcile_interval=options.reconcile_interval, result_cache_size=options.result_cache_size,
+                    result_cache_ttl=options.result_cache_ttl)
+    try:
+        jallad.start(options.sleep_interval,
+                     wakeup_address=workerAddress(index))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the workflow daemon")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="daemon processes sharing the datastore, each woken on its own port from the wakeup address on")
+    parser.add_argument("--db", default="datastore.db")
+    parser.add_argument("--sleep-interval", type=float, default=0.5)
+    parser.add_argument("--lease-duration", type=float, default=30,
+                        help="seconds before the executions of a silent worker are reclaimed")
+    parser.add_argument("--registry-protocol", default="http:")
+    parser.add_argument("--registry-host", default="localhost")
+    parser.add_argument("--registry-port", default="5001")
+    parser.add_argument("--registry-cache", default="datatypes.json",
+                        help="file the data type catalog is persisted to, empty to fetch it on every start")
+    parser.add_argument("--registry-refresh-interval", type=float, default=60,
+                        help="seconds between checks of the registry for changed data types")
+    parser.add_argument("--concurrency", type=concurrencyOption, action="append", default=[], metavar="TYPE=COUNT",
+                        help="maximum parallel executions of a task type, one of "+", ".join(TASK_NAMES)+", repeatable")
+    parser.add_argument("--http-limit-per-host", type=int, default=16,
+                        help="maximum concurrent connections to one host for web and service tasks")
+    parser.add_argument("--http-timeout", type=float, default=30,
+                        help="timeout in seconds of outbound HTTP requests")
+    parser.add_argument("--pack-data", action="store_true",
+                        help="store the values of new Data as one PackedData blob instead of UnitData rows")
+    parser.add_argument("--map-workers", type=int,
+                        help="processes running the script elements of map, reduce and filter tasks, defaults to the number of CPUs")
+    parser.add_argument("--map-chunk-size", type=int,
+                        help="elements handed to a map worker at once, defaults to a few chunks per worker")
+    parser.add_argument("--script-timeout", type=float,
+                        help="seconds a script may run, no limit by default")
+    parser.add_argument("--script-memory-limit", type=int,
+                        help="bytes of address space a script may use, no limit by default")
+    parser.add_argument("--coprocess-max-uses", type=int, default=1000,
+                        help="executions served by an instance of a persistent system command before it is restarted")
+    parser.add_argument("--coprocess-timeout", type=float, default=300,
+                        help="seconds an instance of a persistent system command may take to answer an execution")
+    parser.add_argument("--node-load-ttl", type=float, default=5,
+                        help="seconds the queue count of a node is cached for")
+    parser.add_argument("--node-policy", choices=[POLICY_TWO_CHOICES, POLICY_LEAST_LOADED], default=POLICY_TWO_CHOICES,
+                        help="how the node of a service execution is picked")
+    parser.add_argument("--callback-address",
+                        help="base URL the nodes running service executions call back on, defaults to the address they see")
+    parser.add_argument("--reconcile-interval", type=float, default=60,
+                        help="seconds between polls of the nodes for service executions whose callback never arrived")
+    parser.add_argument("--result-cache-size", type=int, default=10000,
+                        help="outputs of cacheable tasks kept")
+    parser.add_argument("--result-cache-ttl", type=float, default=3600,
+                        help="seconds the output of a cacheable task is reused for")
+    options = parser.parse_args()
+    if options.workers == 1:
+        work(options)
+    else:
+        workers = [multiprocessing.Process(target=work, args=(options, i), name="jallad-"+str(i))
+                   for i in range(options.workers)]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            # the workers got the interrupt as well and store their running executions before they exit
+            for worker in workers:
+                worker.join()
@@ -0,0 +1,69 @@
+import json
+import math
+import sqlite3
+import sys
+import time
+import traceback
+from subprocess import PIPE, Popen
+
+import requests
+
+# names scripts could use when they ran with the daemon's globals, every run starts from a copy
+SCRIPT_GLOBALS = {"__name__": "__script__", "json": json, "math": math, "sqlite3": sqlite3, "sys": sys,
+                  "time": time, "traceback": traceback, "requests": requests, "Popen": Popen, "PIPE": PIPE}
+
+
+def splitElements(values, length: int, leafCount: int):
+    """Splits the leaf values of an array into the leaf values of its elements
+
+    Every element of an array has the same data type, so each holds leafCount/length values.
+    Arrays holding fewer values than their type, as filtered ones do, give fewer elements.
+
+    :param length: number of elements of the array data type
+    :param leafCount: number of leaf values of the array data type
+    """
+    size = leafCount//length if length > 0 else 0
+    if size == 0:
+        return []
+    return [values[start:start+size] for start in range(0, len(values)-size+1, size)]
+
+
+def chunkRanges(count: int, chunkSize: int):
+    """Splits count elements into (start, end) ranges of at most chunkSize elements"""
+    chunkSize = max(1, int(chunkSize))
+    return [(start, min(start+chunkSize, count)) for start in range(0, count, chunkSize)]
+
+
+def defaultChunkSize(count: int, workers: int, chunksPerWorker: int = 4):
+    """Picks a chunk size giving every worker a few chunks, small enough to balance the load
+    and large enough to amortize handing a chunk to a worker"""
+    return max(1, math.ceil(count/(max(1, workers)*chunksPerWorker)))
+
+
+def runScript(code, input, accumulator=None):
+    """Runs compiled script code on one element, the script reads input (and accumulator when reducing) and sets output"""
+    locals = {"input": input, "accumulator": accumulator}
+    exec(code, dict(SCRIPT_GLOBALS), locals)
+    return locals.get("output")
+
+
+def mapScript(code, inputs: list):
+    """Runs compiled script code on every element of a chunk, run by a ScriptPool worker
+
+    :return: the output of each element in order
+    """
+    return [runScript(code, input) for input in inputs]
+
+
+def reduceScript(code, inputs: list, accumulator=None, hasAccumulator: bool = False):
+    """Folds the elements of a chunk in order, starting with the accumulator or else the first element
+
+    The script must be associative for the partial results of the chunks to fold into the same result.
+    """
+    for input in inputs:
+        if hasAccumulator:
+            accumulator = runScript(code, input, accumulator)
+        else:
+            accumulator = input
+            hasAccumulator = True
+    return accumulator
@@ -0,0 +1,328 @@
+import array
+import csv
+import io
+import itertools
+import json
+import struct
+import sys
+
+from layout import compileLayout
+from packing import DATATYPE_INT, DATATYPE_FLOAT, DATATYPE_TEXT, HEADER, LENGTH, PACK_INT, PACK_FLOAT, PACK_TEXT, packArray, valuesView
+
+FORMAT_NDJSON = "ndjson"
+FORMAT_CSV = "csv"
+FORMAT_BINARY = "binary"
+
+# bytes read from a body or a blob at once
+BLOCK_SIZE = 65536
+# values encoded or inserted per batch
+VALUE_BATCH_SIZE = 1024
+
+INT64_MIN = -2**63
+INT64_MAX = 2**63-1
+
+
+def valueLayout(dataType, dataTypeId: int):
+    """Leaf bases of one element of a data type and the number of leaf values its data holds at most
+
+    An array, a structure with a length over 1, holds length elements, any other data type is a single
+    element. Data may hold fewer elements than its type, as filtered arrays do, but only whole ones.
+
+    :param dataType: callable returning the registry entry of a data type id
+    :return: {'bases', 'maxCount'}, None if the registry doesn't know the data type
+    """
+    root = dataType(dataTypeId)
+    if root.get('id') != dataTypeId:
+        return None
+    length = 1
+    if root['length'] > 1 and len(root.get('subDataTypes', [])) > 0:
+        length = root['length']
+        element = dict(root, length=1)
+        bases = compileLayout(lambda id: element if id == dataTypeId else dataType(id),
+                              dataTypeId)['leafBases']
+    else:
+        bases = compileLayout(dataType, dataTypeId)['leafBases']
+    if len(bases) == 0:
+        return None
+    return {'bases': bases, 'maxCount': length*len(bases)}
+
+
+def binaryTypecode(layout):
+    """
+    :return: "q" if the leaves of the layout are all INT, "d" if they are all FLOAT, None otherwise
+    """
+    if layout is None:
+        return None
+    if all(base == DATATYPE_INT for base in layout['bases']):
+        return "q"
+    if all(base == DATATYPE_FLOAT for base in layout['bases']):
+        return "d"
+    return None
+
+
+def readBlocks(stream, size=BLOCK_SIZE):
+    while True:
+        block = stream.read(size)
+        if not block:
+            return
+        yield block
+
+
+def spoolBlocks(blocks, spool):
+    """Passes the blocks on, writing each to spool too"""
+    for block in blocks:
+        spool.write(block)
+        yield block
+
+
+def splitLines(blocks):
+    """Splits blocks into lines, a chunked request body is read a byte at a time by readline()"""
+    for lines in lineBatches(blocks):
+        yield from lines
+
+
+def lineBatches(blocks):
+    """Yields the complete lines of each block as a list"""
+    rest = b""
+    for block in blocks:
+        lines = (rest+block).split(b"\n")
+        rest = lines.pop()
+        yield lines
+    if rest:
+        yield [rest]
+
+
+def splitBinary(blocks, typecode):
+    """Yields the little endian int64 or float64 values of each block as an array"""
+    rest = b""
+    for block in blocks:
+        block = rest+block
+        end = len(block)-len(block) % 8
+        rest = block[end:]
+        values = array.array(typecode)
+        values.frombytes(block[:end])
+        if sys.byteorder == "big":
+            values.byteswap()
+        yield values
+    if rest:
+        raise ValueError("the body isn't a whole number of 8 byte values")
+
+
+def castValue(value, base):
+    """Gives a leaf value the type of its base, raising ValueError if it doesn't fit"""
+    if isinstance(value, (list, dict)):
+        raise ValueError("expected a leaf value, not "+json.dumps(value))
+    if base == DATATYPE_INT or base == DATATYPE_FLOAT:
+        if isinstance(value, bool) or value is None:
+            raise ValueError("expected a number, not "+json.dumps(value))
+        if base == DATATYPE_FLOAT:
+            return float(value)
+        if isinstance(value, str):
+            try:
+                value = int(value)
+            except ValueError:
+                try:
+                    value = float(value)
+                except ValueError:
+                    raise ValueError(
+                        "expected an integer, not "+json.dumps(value)) from None
+        if isinstance(value, float):
+            if not value.is_integer():
+                raise ValueError("expected an integer, not "+repr(value))
+            value = int(value)
+        if value < INT64_MIN or value > INT64_MAX:
+            raise ValueError(str(value)+" doesn't fit in 64 bits")
+        return value
+    if base == DATATYPE_TEXT and not isinstance(value, str):
+        raise ValueError("expected a text, not "+json.dumps(value))
+    return value
+
+
+def castBatch(batch, bases, offset=0):
+    """Casts a batch of values with castValue(), the first being value offset of the data
+
+    Elements of a single leaf whose values already have, or convert wholesale to, the type of its base
+    are cast without visiting the values one by one.
+
+    :return: the cast values
+    """
+    if len(bases) == 1 and len(batch) > 0:
+        base = bases[0]
+        types = set(map(type, batch))
+        try:
+            if base == DATATYPE_INT and types <= {int, str}:
+                if str in types:
+                    batch = list(map(int, batch))
+                if min(batch) >= INT64_MIN and max(batch) <= INT64_MAX:
+                    return batch
+            elif base == DATATYPE_FLOAT and types <= {int, float, str}:
+                return batch if types == {float} else list(map(float, batch))
+            elif base == DATATYPE_TEXT and types == {str}:
+                return batch
+            elif base not in [DATATYPE_INT, DATATYPE_FLOAT, DATATYPE_TEXT] and not (types & {list, dict}):
+                return batch
+        except ValueError:
+            pass
+    cast = []
+    for index, value in enumerate(batch):
+        try:
+            cast.append(castValue(value, bases[(offset+index) % len(bases)]))
+        except (ValueError, TypeError) as error:
+            raise ValueError("value "+str(offset+index)+": "+str(error))
+    return cast
+
+
+def checkValues(batches, layout):
+    """Casts batches of values to the bases of the layout as they pass, raising ValueError at the first value that doesn't fit
+
+    Without a layout values are only checked to be leaves.
+    """
+    count = 0
+    bases = layout['bases'] if layout is not None else [None]
+    maxCount = layout['maxCount'] if layout is not None else None
+    for batch in batches:
+        if maxCount is not None and count+len(batch) > maxCount:
+            raise ValueError("the data type holds at most " +
+                             str(maxCount)+" values")
+        batch = castBatch(batch, bases, count)
+        count = count+len(batch)
+        yield batch
+    if count % len(bases) != 0:
+        raise ValueError(str(count)+" values aren't whole elements of " +
+                         str(len(bases))+" values")
+
+
+def castValues(batches, layout):
+    """Casts batches of stored values to the bases of the layout, UnitData holds them as texts"""
+    count = 0
+    for batch in batches:
+        batch = castBatch(batch, layout['bases'], count)
+        count = count+len(batch)
+        yield batch
+
+
+def parseNdjson(lines):
+    lines = [line for line in lines if line.strip()]
+    try:
+        items = json.loads(b"["+b",".join(lines)+b"]")
+    except ValueError:
+        # the line that doesn't parse gives the error
+        for line in lines:
+            json.loads(line)
+        raise
+    if list in set(map(type, items)):
+        items = [value for item in items
+                 for value in (item if isinstance(item, list) else [item])]
+    return items
+
+
+def parseValues(blocks, format, layout):
+    """Yields the leaf values of a body in batches as its blocks arrive, checked against the layout
+
+    ndjson lines hold a value or a JSON array of values, csv rows any number of values, binary bodies
+    little endian int64 or float64 values, depending on the binaryTypecode() of the layout.
+    """
+    if format == FORMAT_BINARY:
+        values = splitBinary(blocks, binaryTypecode(layout))
+    elif format == FORMAT_CSV:
+        values = ([value for row in csv.reader([line.decode("utf-8") for line in lines]) for value in row]
+                  for lines in lineBatches(blocks))
+    else:
+        values = (parseNdjson(lines) for lines in lineBatches(blocks))
+    return checkValues(values, layout)
+
+
+def batches(values, size=VALUE_BATCH_SIZE):
+    values = iter(values)
+    while True:
+        batch = list(itertools.islice(values, size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+def formatValues(valueBatches, format, layout):
+    """Encodes batches of values in chunks, one element per line for ndjson and csv, raw for binary"""
+    size = len(layout['bases']) if layout is not None else 1
+    typecode = binaryTypecode(layout)
+    if format == FORMAT_BINARY:
+        for batch in valueBatches:
+            yield packArray(typecode, batch)
+        return
+    if size > 1:
+        valueBatches = batches(itertools.chain.from_iterable(valueBatches),
+                               size*max(1, VALUE_BATCH_SIZE//size))
+    for batch in valueBatches:
+        if len(batch) == 0:
+            continue
+        if format == FORMAT_CSV:
+            text = io.StringIO()
+            csv.writer(text, lineterminator="\n").writerows(
+                zip(batch) if size == 1 else [batch[start:start+size] for start in range(0, len(batch), size)])
+            yield text.getvalue()
+        elif size == 1 and typecode is not None:
+            # numbers hold no ", "
+            yield json.dumps(list(batch))[1:-1].replace(", ", "\n")+"\n"
+        elif size == 1:
+            yield "\n".join(map(json.dumps, batch))+"\n"
+        else:
+            yield "".join([json.dumps(batch[start:start+size])+"\n" for start in range(0, len(batch), size)])
+
+
+def blobValues(blob):
+    """Yields the values of a packed blob opened with blobopen() in batches, reading it in blocks"""
+    fmt, count = HEADER.unpack(blob.read(HEADER.size))
+    fmt = fmt.rstrip(b"\0")
+    if fmt == PACK_INT or fmt == PACK_FLOAT:
+        yield from splitBinary(readBlocks(blob), fmt.decode())
+        return
+
+    def values():
+        for i in range(0, count):
+            valueFormat = PACK_TEXT if fmt == PACK_TEXT else blob.read(1)
+            if valueFormat == PACK_TEXT:
+                yield str(blob.read(LENGTH.unpack(blob.read(LENGTH.size))[0]), "utf-8")
+            else:
+                yield struct.unpack("<"+valueFormat.decode(), blob.read(8))[0]
+    yield from batches(values())
+
+
+def loadStream(db, dataId):
+    """Yields the stored values of a Data row in batches, without holding all of them, the way loadValues() gives them"""
+    for row in db.execute("SELECT 1 FROM PackedData WHERE DataId=?;", [dataId]).fetchall():
+        if not hasattr(db, "blobopen"):
+            yield list(valuesView(db.execute("SELECT Value FROM PackedData WHERE DataId=?;", [dataId]).fetchone()[0]))
+            return
+        with db.blobopen("PackedData", "Value", dataId, readonly=True) as blob:
+            yield from blobValues(blob)
+        return
+    cur = db.execute(
+        "SELECT Value FROM UnitData WHERE DataId=? ORDER BY Id ASC;", [dataId])
+    while True:
+        rows = cur.fetchmany(VALUE_BATCH_SIZE)
+        if len(rows) == 0:
+            break
+        yield [row[0] for row in rows]
+    cur.close()
+
+
+def storeStream(db, dataId, valueBatches, count, typecode=None, packed=False):
+    """Stores batches of values the way storeValues() does, without holding all of them
+
+    Numeric values are packed into a blob written in blocks, which needs their count up front, other
+    values become UnitData rows.
+
+    :param typecode: binaryTypecode() of the values, None if they aren't numeric
+    """
+    cur = db.cursor()
+    if packed and typecode is not None and hasattr(db, "blobopen"):
+        cur.execute("INSERT INTO PackedData (DataId,Value) VALUES (?,zeroblob(?));", [
+                    dataId, HEADER.size+8*count])
+        with db.blobopen("PackedData", "Value", dataId) as blob:
+            blob.write(HEADER.pack(typecode.encode(), count))
+            for batch in valueBatches:
+                blob.write(packArray(typecode, batch))
+    else:
+        cur.executemany("INSERT INTO UnitData (DataId,Value) VALUES (?,?);",
+                        zip(itertools.repeat(dataId), itertools.chain.from_iterable(valueBatches)))
+    cur.close()
@@ -0,0 +1,64 @@
+import asyncio
+import threading
+
+import aiohttp
+
+
+class HttpEngine:
+    """Runs outbound HTTP requests on one asyncio event loop in a background thread
+
+    Connections are pooled and kept alive per host, and each host gets at most
+    limit_per_host concurrent connections.
+    """
+
+    def __init__(self, limit=256, limit_per_host=16, timeout=30, keepalive_timeout=30):
+        """
+        :param limit: maximum open connections in total
+        :param limit_per_host: maximum open connections to one host
+        :param timeout: total timeout of a request in seconds
+        :param keepalive_timeout: seconds an idle connection is kept in the pool
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="http-engine", daemon=True)
+        self.thread.start()
+        self.session = self.submit(self.createSession()).result()
+
+    async def createSession(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.limit, limit_per_host=self.limit_per_host, keepalive_timeout=self.keepalive_timeout)
+        return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    def submit(self, coroutine):
+        """Schedules a coroutine on the engine's loop
+
+        :return: concurrent.futures.Future of the coroutine's result
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    async def request(self, method, url, json=None, data=None, timeout=None):
+        """Sends a request and decodes the JSON response
+
+        :param timeout: overrides the engine's total timeout in seconds
+        """
+        async with self.session.request(method, url, json=json, data=data,
+                                        timeout=None if timeout is None else aiohttp.ClientTimeout(total=timeout)) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def requestAll(self, requests, return_exceptions=True):
+        """Sends requests in parallel
+
+        :param requests: list of dicts of request() arguments
+        :return: list of decoded responses in the same order, or exceptions for failed ones
+        """
+        return await asyncio.gather(*[self.request(**request) for request in requests], return_exceptions=return_exceptions)
+
+    def close(self):
+        self.submit(self.session.close()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
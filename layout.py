@@ -0,0 +1,36 @@
+def compileLayout(dataType, dataTypeId: int):
+    """Flattens a data type tree into lookup tables over its leaf values
+
+    Nodes are visited in the same depth first order the values are stored in.
+    A node's index path is its parent's path extended by [element+1, subDataType+1].
+
+    :param dataType: callable returning the registry entry of a data type id
+    :param dataTypeId: id of the root data type
+    :return: dict with
+        'ranges': index path tuple -> (start, end) range of the leaf values below it,
+            nodes with an id <= 0 and their subtrees hold no values and are left out,
+        'order': index path tuple -> position of the node in the traversal, for every node,
+        'leafBases': base type of every leaf value in order,
+        'leafCount': number of leaf values
+    """
+    layout = {'dataTypeId': dataTypeId, 'ranges': {},
+              'order': {}, 'leafBases': [], 'leafCount': 0}
+
+    def visit(typeId, index, counted):
+        layout['order'][index] = len(layout['order'])
+        currentDataType = dataType(typeId)
+        counted = counted and typeId > 0
+        start = layout['leafCount']
+        if currentDataType['length'] > 0 and len(currentDataType['subDataTypes']) > 0:
+            for i in range(0, currentDataType['length']):
+                for g in range(0, len(currentDataType['subDataTypes'])):
+                    visit(currentDataType['subDataTypes'][g]['subDataTypeId'],
+                          index+(i+1, g+1), counted)
+        elif counted:
+            layout['leafBases'].append(currentDataType['base'])
+            layout['leafCount'] = layout['leafCount']+1
+        if counted:
+            layout['ranges'][index] = (start, layout['leafCount'])
+
+    visit(dataTypeId, (), True)
+    return layout
@@ -0,0 +1,114 @@
+import asyncio
+import math
+import random
+import time
+
+POLICY_TWO_CHOICES = "p2c"
+POLICY_LEAST_LOADED = "least"
+
+
+class NodeLoad:
+    """Tracks the load of the nodes services are dispatched to, on the HttpEngine's loop
+
+    The load of a node is the count its /service/queueCount reported, cached for ttl seconds and
+    refreshed in the background, plus the dispatches this daemon made to it since that count was
+    probed, so that a burst of dispatches spreads over the nodes before the next probe. A node that
+    doesn't answer counts as fully loaded until a probe reaches it again.
+    """
+
+    def __init__(self, http, ttl=5, policy=POLICY_TWO_CHOICES, idle_timeout=300):
+        """
+        :param http: HttpEngine the probes are sent with
+        :param ttl: seconds a probed count is used for before it is refreshed
+        :param policy: POLICY_TWO_CHOICES to pick the less loaded of two random nodes,
+            POLICY_LEAST_LOADED to pick the least loaded of all
+        :param idle_timeout: seconds after which a node nothing was dispatched to stops being refreshed
+        """
+        self.http = http
+        self.ttl = ttl
+        self.policy = policy
+        self.idle_timeout = idle_timeout
+        # url -> {'count', 'probed', 'dispatched': times of the dispatches not yet in count, 'used'}
+        self.nodes = {}
+        self.probing = {}
+        self.refresher = None
+
+    def node(self, url):
+        node = self.nodes.get(url)
+        if node is None:
+            node = {'count': None, 'probed': 0,
+                    'dispatched': [], 'used': time.time()}
+            self.nodes[url] = node
+        return node
+
+    def load(self, url):
+        node = self.nodes[url]
+        if node['count'] is None:
+            return math.inf
+        return node['count']+len(node['dispatched'])
+
+    async def probe(self, url):
+        """Fetches the count of a node, at most one probe per node at a time"""
+        if url in self.probing:
+            return await asyncio.shield(self.probing[url])
+        self.probing[url] = asyncio.ensure_future(self.fetch(url))
+        try:
+            return await asyncio.shield(self.probing[url])
+        finally:
+            del self.probing[url]
+
+    async def fetch(self, url):
+        node = self.node(url)
+        probed = time.time()
+        try:
+            count = (await self.http.request('GET', url+"/service/queueCount"))['count']
+        except Exception:
+            count = None
+        node['count'] = count
+        node['probed'] = probed
+        # dispatches made before the probe was sent are in its count now
+        node['dispatched'] = [dispatched for dispatched in node['dispatched']
+                              if dispatched >= probed]
+
+    async def refresh(self):
+        """Probes the nodes in use whose count is older than the ttl, in parallel"""
+        now = time.time()
+        for url in [url for url, node in self.nodes.items() if now-node['used'] > self.idle_timeout]:
+            del self.nodes[url]
+        await asyncio.gather(*[self.probe(url) for url, node in list(self.nodes.items())
+                               if now-node['probed'] >= self.ttl])
+
+    async def refreshLoop(self):
+        while True:
+            await asyncio.sleep(self.ttl/2)
+            try:
+                await self.refresh()
+            except Exception:
+                pass
+
+    async def choose(self, urls):
+        """Picks the node to dispatch to out of the urls and counts the dispatch against it
+
+        Nodes without a count yet are probed first, the others are served from the cache.
+
+        :return: the chosen url, None if none of the nodes answers
+        """
+        if self.refresher is None:
+            self.refresher = asyncio.ensure_future(self.refreshLoop())
+        now = time.time()
+        for url in urls:
+            self.node(url)['used'] = now
+        await asyncio.gather(*[self.probe(url) for url in urls if self.nodes[url]['probed'] == 0])
+        candidates = [url for url in urls if self.nodes[url]['count'] is not None]
+        if len(candidates) == 0:
+            return None
+        if self.policy == POLICY_TWO_CHOICES and len(candidates) > 2:
+            candidates = random.sample(candidates, 2)
+        chosen = min(candidates, key=self.load)
+        self.nodes[chosen]['dispatched'].append(time.time())
+        return chosen
+
+    def failed(self, url):
+        """Marks a node whose dispatch failed as fully loaded until its next probe"""
+        if url in self.nodes:
+            self.nodes[url]['count'] = None
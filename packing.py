@@ -0,0 +1,200 @@
+import array
+import struct
+import sys
+
+DATATYPE_INT = 0
+DATATYPE_FLOAT = 1
+DATATYPE_TEXT = 2
+DATATYPE_STRUCTURE = 3
+
+PACK_INT = b"q"
+PACK_FLOAT = b"d"
+PACK_TEXT = b"t"
+PACK_MIXED = b"m"
+
+# format code padded to 4 bytes and the number of values, keeps the payload 8 byte aligned
+HEADER = struct.Struct("<4sI")
+LENGTH = struct.Struct("<I")
+
+
+def inferFormat(values):
+    if all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+        return PACK_INT
+    if all(isinstance(value, float) for value in values):
+        return PACK_FLOAT
+    if all(isinstance(value, str) for value in values):
+        return PACK_TEXT
+    return PACK_MIXED
+
+
+def intValue(value):
+    """int() of a leaf value of INT data, raising ValueError for a fractional float instead of truncating it"""
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError(repr(value)+" is not an integer")
+    return int(value)
+
+
+def packArray(typecode, values):
+    packed = array.array(typecode, values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def packText(values):
+    chunks = []
+    for value in values:
+        encoded = value.encode("utf-8")
+        chunks.append(LENGTH.pack(len(encoded)))
+        chunks.append(encoded)
+    return b"".join(chunks)
+
+
+def packValues(values, base=None):
+    """Packs leaf values into one blob
+
+    INT and FLOAT data become little endian int64/float64 arrays, INT data holding a fractional value
+    doesn't fit and is left to UnitData, TEXT data
+    length prefixed UTF-8, STRUCTURE data and unknown bases pick the format
+    from the values, tagging each value if their types are mixed.
+
+    :param base: DATATYPE_* base of the data type, None to pick from the values
+    :return: the blob, None if the values don't fit the format
+    """
+    try:
+        if base == DATATYPE_INT:
+            fmt, payload = PACK_INT, packArray(
+                "q", [value if type(value) is int else intValue(value) for value in values])
+        elif base == DATATYPE_FLOAT:
+            fmt, payload = PACK_FLOAT, packArray(
+                "d", [float(value) for value in values])
+        elif base == DATATYPE_TEXT:
+            fmt, payload = PACK_TEXT, packText(
+                [str(value) for value in values])
+        else:
+            fmt = inferFormat(values)
+            if fmt == PACK_INT:
+                payload = packArray("q", values)
+            elif fmt == PACK_FLOAT:
+                payload = packArray("d", values)
+            elif fmt == PACK_TEXT:
+                payload = packText(values)
+            else:
+                chunks = []
+                for value in values:
+                    valueFormat = inferFormat([value])
+                    if valueFormat == PACK_MIXED:
+                        return None
+                    chunks.append(valueFormat)
+                    chunks.append(packArray("q", [value]) if valueFormat == PACK_INT else
+                                  packArray("d", [value]) if valueFormat == PACK_FLOAT else packText([value]))
+                payload = b"".join(chunks)
+    except (ValueError, TypeError, OverflowError):
+        return None
+    return HEADER.pack(fmt, len(values))+payload
+
+
+def unpackText(view, count):
+    values = []
+    offset = 0
+    for i in range(0, count):
+        length = LENGTH.unpack_from(view, offset)[0]
+        offset = offset+LENGTH.size
+        values.append(str(view[offset:offset+length], "utf-8"))
+        offset = offset+length
+    return values, offset
+
+
+def valuesView(blob):
+    """Gives access to packed values without copying numeric arrays
+
+    :return: memoryview of int64/float64 values for numeric blobs, list of values otherwise
+    """
+    view = memoryview(blob)
+    fmt, count = HEADER.unpack_from(view)
+    fmt = fmt.rstrip(b"\0")
+    payload = view[HEADER.size:]
+    if fmt == PACK_INT or fmt == PACK_FLOAT:
+        if sys.byteorder == "big":
+            values = array.array(fmt.decode())
+            values.frombytes(payload)
+            values.byteswap()
+            return memoryview(values)
+        return payload.cast(fmt.decode())
+    if fmt == PACK_TEXT:
+        return unpackText(payload, count)[0]
+    values = []
+    offset = 0
+    for i in range(0, count):
+        valueFormat = bytes(payload[offset:offset+1])
+        offset = offset+1
+        if valueFormat == PACK_TEXT:
+            text, length = unpackText(payload[offset:], 1)
+            values.extend(text)
+            offset = offset+length
+        else:
+            values.append(struct.unpack_from(
+                "<"+valueFormat.decode(), payload, offset)[0])
+            offset = offset+8
+    return values
+
+
+def unpackValues(blob):
+    values = valuesView(blob)
+    return values.tolist() if isinstance(values, memoryview) else values
+
+
+def storeValues(cur, dataId, values, base=None, packed=False):
+    """Stores the values of a Data row, as one PackedData blob if packed and packable, as UnitData rows otherwise"""
+    storeValuesBatch(cur, [(dataId, values)], base, packed)
+
+
+def storeValuesBatch(cur, values, base=None, packed=False):
+    """Stores the values of several Data rows with one statement per storage table
+
+    :param values: (Data id, values) pairs, stored the way storeValues() stores each
+    """
+    blobs = []
+    units = []
+    for dataId, dataValues in values:
+        blob = packValues(dataValues, base) if packed else None
+        if blob is not None:
+            blobs.append((dataId, blob))
+        else:
+            units.extend([(dataId, value) for value in dataValues])
+    if len(blobs) > 0:
+        cur.executemany(
+            "INSERT INTO PackedData (DataId,Value) VALUES (?,?);", blobs)
+    if len(units) > 0:
+        cur.executemany(
+            "INSERT INTO UnitData (DataId,Value) VALUES (?,?);", units)
+
+
+def loadValues(cur, dataId, view=False):
+    """Reads the values of a Data row from PackedData, or from UnitData rows for unpacked data
+
+    :param view: return valuesView() of packed values instead of a list
+    """
+    for row in cur.execute("SELECT Value FROM PackedData WHERE DataId=?;", [dataId]).fetchall():
+        return valuesView(row[0]) if view else unpackValues(row[0])
+    return [row[0] for row in cur.execute("SELECT Value FROM UnitData WHERE DataId=? ORDER BY Id ASC;", [dataId])]
+
+
+def loadValuesBatch(cur, dataIds):
+    """Reads the values of several Data rows with one query per storage table
+
+    :return: dict of Data id -> values, in the order loadValues() gives them
+    """
+    dataIds = list(dataIds)
+    values = dict([(dataId, []) for dataId in dataIds])
+    if len(dataIds) == 0:
+        return values
+    placeholders = ",".join(["?"]*len(dataIds))
+    packed = set()
+    for row in cur.execute("SELECT DataId,Value FROM PackedData WHERE DataId IN ("+placeholders+");", dataIds):
+        values[row[0]] = unpackValues(row[1])
+        packed.add(row[0])
+    for row in cur.execute("SELECT DataId,Value FROM UnitData WHERE DataId IN ("+placeholders+") ORDER BY DataId,Id;", dataIds):
+        if row[0] not in packed:
+            values[row[0]].append(row[1])
+    return values
@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+
+import requests
+
+DATATYPE_NONE = -1
+
+UNKNOWN_DATATYPE = {'id': 0, 'base': DATATYPE_NONE, 'length': 0}
+
+
+class DataTypeRegistry:
+    """Local copy of the data type catalog of the registry, indexed by id
+
+    The catalog is persisted to cache_path, so a node starts from its last copy without reaching the
+    registry, and refreshed on a background thread with conditional requests. A refreshed catalog is
+    only staged by the thread, apply() swaps it in on the thread using the lookups so that whatever
+    it derived from the changed types can be dropped in the same step.
+    """
+
+    def __init__(self, url, cache_path=None, refresh_interval=60, timeout=10):
+        """
+        :param url: URL of the registry's /datatype list
+        :param cache_path: file the catalog is persisted to, None to keep it in memory only
+        :param refresh_interval: seconds between conditional requests to the registry
+        :param timeout: timeout in seconds of a request to the registry
+        """
+        self.url = url
+        self.cache_path = cache_path
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.etag = None
+        self.data_types = {}
+        self.staged = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.refresher = None
+
+    def get(self, id: int):
+        return self.data_types.get(id, UNKNOWN_DATATYPE)
+
+    def load(self):
+        """Reads the persisted catalog
+
+        :return: True if there was one
+        """
+        if self.cache_path is None:
+            return False
+        try:
+            with open(self.cache_path) as cacheFile:
+                cache = json.load(cacheFile)
+        except (OSError, ValueError):
+            return False
+        self.etag = cache.get('etag')
+        self.data_types = dict([(dataType['id'], dataType)
+                               for dataType in cache['dataTypes']])
+        return True
+
+    def persist(self, etag, dataTypes):
+        if self.cache_path is None:
+            return
+        temporaryPath = self.cache_path+".tmp"
+        try:
+            with open(temporaryPath, "w") as cacheFile:
+                json.dump({'etag': etag, 'dataTypes': dataTypes}, cacheFile)
+            os.replace(temporaryPath, self.cache_path)
+        except OSError as error:
+            print("registry:unpersisted:"+str(error))
+
+    def fetch(self):
+        """Asks the registry for the catalog unless it still has the copy of the last request
+
+        :return: True if a changed catalog was staged
+        """
+        headers = {} if self.etag is None else {'If-None-Match': self.etag}
+        response = requests.get(self.url, headers=headers,
+                                timeout=self.timeout)
+        if response.status_code == 304:
+            return False
+        response.raise_for_status()
+        dataTypes = response.json()
+        etag = response.headers.get('ETag')
+        index = dict([(dataType['id'], dataType) for dataType in dataTypes])
+        with self.lock:
+            # a registry without ETags sends the whole catalog every time, only changes are staged
+            changed = index != (
+                self.staged if self.staged is not None else self.data_types)
+            if changed:
+                self.staged = index
+        if changed or etag != self.etag:
+            self.persist(etag, dataTypes)
+            self.etag = etag
+        return changed
+
+    def refreshLoop(self):
+        while not self.stopped.wait(self.refresh_interval):
+            try:
+                self.fetch()
+            except (requests.RequestException, ValueError) as error:
+                print("registry:unreachable:"+str(error))
+
+    def start(self):
+        """Loads the catalog, from the registry only if none was persisted, and starts refreshing it"""
+        if not self.load():
+            try:
+                self.fetch()
+            except (requests.RequestException, ValueError) as error:
+                print("registry:unreachable:"+str(error))
+            self.apply()
+        if self.refresher is None:
+            self.refresher = threading.Thread(
+                target=self.refreshLoop, name="registry-refresh", daemon=True)
+            self.refresher.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def apply(self):
+        """Swaps in the catalog staged by the last refresh
+
+        :return: ids of the data types that changed, were added or removed, together with every data type
+            containing one of them, empty if nothing was staged
+        """
+        with self.lock:
+            staged = self.staged
+            self.staged = None
+        if staged is None:
+            return set()
+        previous = self.data_types
+        self.data_types = staged
+        changed = set([id for id in set(previous) | set(staged)
+                       if previous.get(id) != staged.get(id)])
+        # data type -> data types it's a sub data type of, in either catalog
+        parents = {}
+        for dataTypes in [previous, staged]:
+            for dataType in dataTypes.values():
+                for subDataType in dataType.get('subDataTypes', []):
+                    parents.setdefault(subDataType['subDataTypeId'], set()).add(
+                        dataType['id'])
+        left = list(changed)
+        while len(left) > 0:
+            for parent in parents.get(left.pop(), ()):
+                if parent not in changed:
+                    changed.add(parent)
+                    left.append(parent)
+        return changed
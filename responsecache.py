@@ -0,0 +1,105 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """Keeps the bodies of read responses until a write to what they were built from
+
+    Every entry is tagged with the entities it was read from, e.g. "Task" for a listing of all tasks or
+    "Edge:3" for the edges of workflow 3. Writers invalidate the tags they touched after committing. An
+    entry built while one of its tags was invalidated may hold what the write replaced and isn't stored,
+    builds run between begin() and end() so that invalidations no build started before are forgotten.
+    The cache lives in one process, writes made through another process aren't seen.
+    """
+
+    def __init__(self, max_entries=256):
+        """
+        :param max_entries: entries kept, the least recently used are evicted first
+        """
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # tag -> keys of the entries built from it
+        self.tagged = {}
+        # tag -> version it was last invalidated at, kept while a build started before it runs
+        self.invalidated = {}
+        # version -> builds started at it still running
+        self.building = {}
+        self.version = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        :return: (body, etag), None if not cached
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def begin(self):
+        """Starts building a body, end() must follow
+
+        :return: the version to put() the body with
+        """
+        with self.lock:
+            self.building[self.version] = self.building.get(
+                self.version, 0)+1
+            return self.version
+
+    def end(self, since: int):
+        """Ends a build started with begin(), forgetting the invalidations no running build started before"""
+        with self.lock:
+            self.building[since] -= 1
+            if self.building[since] == 0:
+                del self.building[since]
+            if len(self.building) == 0:
+                self.invalidated.clear()
+            elif len(self.invalidated) > self.max_entries:
+                oldest = min(self.building)
+                self.invalidated = dict([(tag, version) for tag, version in self.invalidated.items()
+                                         if version > oldest])
+
+    def put(self, key, body: str, tags, since: int):
+        """Caches a body unless one of its tags was invalidated after since
+
+        :param since: the version begin() gave before building the body
+        :return: (body, etag)
+        """
+        etag = hashlib.sha1(body.encode("utf-8")).hexdigest()
+        with self.lock:
+            if any(self.invalidated.get(tag, -1) > since for tag in tags):
+                return body, etag
+            self.remove(key)
+            self.entries[key] = (body, etag, tags)
+            for tag in tags:
+                self.tagged.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self.remove(next(iter(self.entries)))
+        return body, etag
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self.tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if len(keys) == 0:
+                    del self.tagged[tag]
+
+    def invalidate(self, *tags):
+        """Drops the entries built from any of the tags"""
+        with self.lock:
+            self.version += 1
+            for tag in tags:
+                self.invalidated[tag] = self.version
+                for key in list(self.tagged.get(tag, ())):
+                    self.remove(key)
@@ -0,0 +1,289 @@
+import os
+import queue
+import sqlite3
+from urllib.request import pathname2url
+
+PRAGMAS = [
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA temp_store=MEMORY;",
+    "PRAGMA cache_size=-16000;",
+]
+
+
+def connect(db_name, timeout=30, **kwargs):
+    """Opens a connection to the datastore with the pragmas used by the daemon and the webserver
+
+    :param timeout: seconds to wait for a lock held by another connection
+    """
+    db = sqlite3.connect(db_name, timeout=timeout, **kwargs)
+    for pragma in PRAGMAS:
+        db.execute(pragma)
+    return db
+
+
+class ConnectionPool:
+    """Keeps datastore connections open across requests, with their prepared statements cached
+
+    A connection serves one request at a time but may serve it from any thread. Read-only pools open
+    the datastore with mode=ro, so their connections never take a write lock; with the WAL journal
+    they don't wait for writers either.
+    """
+
+    def __init__(self, db_name, size=8, read_only=False, cached_statements=256):
+        """
+        :param size: idle connections kept open, more are opened under load and closed when given back
+        :param cached_statements: prepared statements kept per connection
+        """
+        self.db_name = db_name
+        self.size = size
+        self.read_only = read_only
+        self.cached_statements = cached_statements
+        self.idle = queue.LifoQueue()
+
+    def open(self):
+        if self.read_only:
+            return connect("file:"+pathname2url(os.path.abspath(self.db_name))+"?mode=ro", uri=True,
+                           check_same_thread=False, cached_statements=self.cached_statements)
+        return connect(self.db_name, check_same_thread=False, cached_statements=self.cached_statements)
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return self.open()
+
+    def release(self, db):
+        """Takes a connection back, rolling back whatever its request left uncommitted"""
+        try:
+            if db.in_transaction:
+                db.rollback()
+        except sqlite3.Error:
+            db.close()
+            return
+        if self.idle.qsize() >= self.size:
+            db.close()
+            return
+        self.idle.put(db)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def createTables(cur):
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS Registry(Id INTEGER PRIMARY KEY AUTOINCREMENT, IpAddress TEXT);")
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS Workflow(Id INTEGER PRIMARY KEY AUTOINCREMENT, Title TEXT, InputDataTypeId INT, OutputDataTypeId INT);")
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS Node(Id INTEGER PRIMARY KEY AUTOINCREMENT, Title TEXT, IpAddress TEXT);")
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS Service(Id INTEGER PRIMARY KEY AUTOINCREMENT, Title TEXT, NodeId INT REFERENCES Node(Id), WorkflowId INT REFERENCES Workflow(Id),NodeServiceId INT, UniformServiceId INT);")
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS Task(Id INTEGER PRIMARY KEY AUTOINCREMENT, Title TEXT, Type INT, InputDataTypeId INT, OutputDataTypeId INT);")
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS TaskParam(Id INTEGER PRIMARY KEY AUTOINCREMENT, TaskId INT REFERENCES Task(Id), Title TEXT, Value TEXT);")
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS TaskInstance(Id INTEGER PRIMARY KEY AUTOINCREMENT, WorkflowId INT REFERENCES Workflow(Id), TaskId INT REFERENCES Task(Id), ScreenX INT, ScreenY INT);")
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS Edge(Id INTEGER PRIMARY KEY AUTOINCREMENT,  WorkflowId INT REFERENCES Workflow(Id), TaskInstanceId1 INT REFERENCES TaskInstance(Id), DataIndexId1 INT REFERENCES DataIndex(Id), TaskInstanceId2 INT REFERENCES TaskInstance(Id), DataIndexId2 INT REFERENCES DataIndex(Id));")
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS DataIndex(Id INTEGER PRIMARY KEY AUTOINCREMENT);")
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS DataIndexValue(Id INTEGER PRIMARY KEY AUTOINCREMENT, DataIndexId INT REFERENCES DataIndex(Id), Value INT);")
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS Data(Id INTEGER PRIMARY KEY AUTOINCREMENT, Title TEXT, DataTypeId INT, Created TEXT);")
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS UnitData(Id INTEGER PRIMARY KEY AUTOINCREMENT, DataId INT REFERENCES Data(Id), Value TEXT);")
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS WorkflowExecution(Id INTEGER PRIMARY KEY AUTOINCREMENT,  WorkflowId INT REFERENCES Workflow(Id), EntryTime TEXT, InputDataId INT REFERENCES Data(Id), ExecutionState INT, StartTime TEXT, OutputDataId INT REFERENCES Data(Id), EndTime TEXT);")
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS WorkflowExecutionParams(Id INTEGER PRIMARY KEY AUTOINCREMENT, WorkflowExecutionId INT REFERENCES WorkflowExecution(Id), Title TEXT, Value TEXT);")
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS TaskInstanceExecution(Id INTEGER PRIMARY KEY AUTOINCREMENT, WorkflowExecutionId INT REFERENCES WorkflowExecution(Id), TaskInstanceId INT REFERENCES TaskInstance(Id), EntryTime TEXT, InputDataId INT REFERENCES Data(Id), ExecutionState INT, StartTime TEXT, OutputDataId INT REFERENCES Data(Id), EndTime TEXT);")
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS TaskInstanceExecutionParams(Id INTEGER PRIMARY KEY AUTOINCREMENT, TaskInstanceExecutionId INT REFERENCES TaskInstanceExecution(Id), Title TEXT, Value TEXT);")
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS WorkflowRevision(WorkflowId INTEGER PRIMARY KEY, Revision INT);")
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS PackedData(DataId INTEGER PRIMARY KEY REFERENCES Data(Id), Value BLOB);")
+
+
+def rebuildTable(cur, table, create, columns, converted):
+    """Recreates a table with a new definition, keeping its rows and AUTOINCREMENT sequence
+
+    :param create: CREATE TABLE statement of the new definition with the table name as {}
+    :param columns: columns copied as they are
+    :param converted: column -> SQL expression computing its new value
+    """
+    cur.execute(create.format(table+"Rebuilt"))
+    names = columns+list(converted.keys())
+    cur.execute("INSERT INTO "+table+"Rebuilt ("+",".join(names)+") SELECT " +
+                ",".join(columns+list(converted.values()))+" FROM "+table+";")
+    cur.execute("DELETE FROM sqlite_sequence WHERE name=?;", [table+"Rebuilt"])
+    cur.execute("UPDATE sqlite_sequence SET name=? WHERE name=?;",
+                [table+"Rebuilt", table])
+    cur.execute("DROP TABLE "+table+";")
+    cur.execute("ALTER TABLE "+table+"Rebuilt RENAME TO "+table+";")
+
+
+def realTimestamps(cur):
+    rebuildTable(cur, "Data",
+                 "CREATE TABLE {}(Id INTEGER PRIMARY KEY AUTOINCREMENT, Title TEXT, DataTypeId INT, Created REAL);",
+                 ['Id', 'Title', 'DataTypeId'], {'Created': "CAST(Created AS REAL)"})
+    rebuildTable(cur, "WorkflowExecution",
+                 "CREATE TABLE {}(Id INTEGER PRIMARY KEY AUTOINCREMENT,  WorkflowId INT REFERENCES Workflow(Id), EntryTime REAL, InputDataId INT REFERENCES Data(Id), ExecutionState INT, StartTime REAL, OutputDataId INT REFERENCES Data(Id), EndTime REAL);",
+                 ['Id', 'WorkflowId', 'InputDataId', 'ExecutionState', 'OutputDataId'],
+                 {'EntryTime': "CAST(EntryTime AS REAL)", 'StartTime': "CAST(StartTime AS REAL)", 'EndTime': "CAST(EndTime AS REAL)"})
+    rebuildTable(cur, "TaskInstanceExecution",
+                 "CREATE TABLE {}(Id INTEGER PRIMARY KEY AUTOINCREMENT, WorkflowExecutionId INT REFERENCES WorkflowExecution(Id), TaskInstanceId INT REFERENCES TaskInstance(Id), EntryTime REAL, InputDataId INT REFERENCES Data(Id), ExecutionState INT, StartTime REAL, OutputDataId INT REFERENCES Data(Id), EndTime REAL);",
+                 ['Id', 'WorkflowExecutionId', 'TaskInstanceId',
+                     'InputDataId', 'ExecutionState', 'OutputDataId'],
+                 {'EntryTime': "CAST(EntryTime AS REAL)", 'StartTime': "CAST(StartTime AS REAL)", 'EndTime': "CAST(EndTime AS REAL)"})
+
+
+def createIndexes(cur):
+    # scheduler phases select executions by state
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS TaskInstanceExecutionState ON TaskInstanceExecution(ExecutionState, WorkflowExecutionId, TaskInstanceId, InputDataId, OutputDataId);")
+    # latest execution of a task instance within a workflow execution
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS TaskInstanceExecutionLatest ON TaskInstanceExecution(WorkflowExecutionId, TaskInstanceId, ExecutionState, OutputDataId);")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS WorkflowExecutionState ON WorkflowExecution(ExecutionState);")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS EdgeSource ON Edge(WorkflowId, TaskInstanceId1);")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS EdgeTarget ON Edge(WorkflowId, TaskInstanceId2);")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS UnitDataData ON UnitData(DataId);")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS DataIndexValueIndex ON DataIndexValue(DataIndexId, Value);")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS TaskParamTask ON TaskParam(TaskId, Title, Value);")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS TaskInstanceWorkflow ON TaskInstance(WorkflowId, TaskId);")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS WorkflowExecutionParamsExecution ON WorkflowExecutionParams(WorkflowExecutionId);")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS TaskInstanceExecutionParamsExecution ON TaskInstanceExecutionParams(TaskInstanceExecutionId);")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS ServiceUniform ON Service(UniformServiceId);")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS ServiceNode ON Service(NodeId);")
+
+
+def pendingInputs(cur):
+    cur.execute(
+        "ALTER TABLE TaskInstanceExecution ADD COLUMN PendingInputs INT DEFAULT 0;")
+    # upstream task instances whose latest execution is not yet MARKED (4), for the QUEUED (0) executions
+    cur.execute("UPDATE TaskInstanceExecution SET PendingInputs=(SELECT COUNT(DISTINCT Edge.TaskInstanceId1) FROM Edge WHERE Edge.TaskInstanceId2=TaskInstanceExecution.TaskInstanceId AND (SELECT Latest.ExecutionState FROM TaskInstanceExecution AS Latest WHERE Latest.WorkflowExecutionId=TaskInstanceExecution.WorkflowExecutionId AND Latest.TaskInstanceId=Edge.TaskInstanceId1 ORDER BY Latest.Id DESC LIMIT 1)<4) WHERE ExecutionState=0;")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS TaskInstanceExecutionReady ON TaskInstanceExecution(ExecutionState, PendingInputs);")
+
+
+def leases(cur):
+    cur.execute(
+        "ALTER TABLE TaskInstanceExecution ADD COLUMN LeaseOwner TEXT;")
+    cur.execute(
+        "ALTER TABLE TaskInstanceExecution ADD COLUMN LeaseExpiry REAL;")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS TaskInstanceExecutionLeaseOwner ON TaskInstanceExecution(LeaseOwner) WHERE LeaseOwner IS NOT NULL;")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS TaskInstanceExecutionLeaseExpiry ON TaskInstanceExecution(LeaseExpiry) WHERE LeaseExpiry IS NOT NULL;")
+
+
+def paramValues(cur):
+    # map and filter tasks over a sub-workflow find the executions of their elements by param value
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS WorkflowExecutionParamsValue ON WorkflowExecutionParams(Title, Value);")
+
+
+def callbackOutbox(cur):
+    # results of service executions waiting to be delivered to the node that started them, ExecutionId is
+    # the TaskInstanceExecution on that node for batched delivery, NULL to post to Path alone
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS CallbackOutbox(Id INTEGER PRIMARY KEY AUTOINCREMENT, Address TEXT, Path TEXT, ExecutionId INT, Body TEXT, Attempts INT DEFAULT 0, NextAttempt REAL, Created REAL);")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS CallbackOutboxNextAttempt ON CallbackOutbox(NextAttempt);")
+
+
+def dataIndexes(cur):
+    # filtering the /data listing by data type, newest first
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS DataDataType ON Data(DataTypeId);")
+
+
+def executionHistory(cur):
+    # /service/execution lists executions newest first, optionally of some states or of one workflow,
+    # the services started on other nodes are the task instance executions without a task instance
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS WorkflowExecutionEntry ON WorkflowExecution(EntryTime);")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS WorkflowExecutionStateEntry ON WorkflowExecution(ExecutionState, EntryTime);")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS WorkflowExecutionWorkflowEntry ON WorkflowExecution(WorkflowId, EntryTime);")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS TaskInstanceExecutionServiceEntry ON TaskInstanceExecution(EntryTime) WHERE TaskInstanceId=0;")
+
+
+def batches(cur):
+    # executions submitted together, Submitted counts the inputs stored so far and SubmitTime is set
+    # once the last of them was
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS Batch(Id INTEGER PRIMARY KEY AUTOINCREMENT, WorkflowId INT REFERENCES Workflow(Id), ServiceId INT, Submitted INT DEFAULT 0, EntryTime REAL, SubmitTime REAL);")
+    cur.execute(
+        "ALTER TABLE WorkflowExecution ADD COLUMN BatchId INT REFERENCES Batch(Id);")
+    # the progress of a batch is counted from this index alone
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS WorkflowExecutionBatch ON WorkflowExecution(BatchId, ExecutionState, StartTime, EndTime) WHERE BatchId IS NOT NULL;")
+
+
+def taskResultCache(cur):
+    # outputs of cacheable task executions by the hash of their task, params and input, the Data of an
+    # output outlives its entry as the output of the executions that ran or reused it
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS TaskResultCache(Key TEXT PRIMARY KEY, TaskId INT REFERENCES Task(Id), OutputDataId INT REFERENCES Data(Id), Created REAL, Expiry REAL, LastUsed REAL, Hits INT DEFAULT 0);")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS TaskResultCacheExpiry ON TaskResultCache(Expiry);")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS TaskResultCacheLastUsed ON TaskResultCache(LastUsed);")
+    # writes to a Data row drop the results it was cached as
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS TaskResultCacheOutput ON TaskResultCache(OutputDataId);")
+
+
+# MIGRATIONS[n] brings a datastore from user_version n to n+1, only ever append to this list
+MIGRATIONS = [
+    createTables,
+    realTimestamps,
+    createIndexes,
+    pendingInputs,
+    leases,
+    paramValues,
+    callbackOutbox,
+    dataIndexes,
+    executionHistory,
+    batches,
+    taskResultCache,
+]
+
+
+def migrate(db):
+    """Brings the datastore up to the latest schema version, safe to run from several processes at once"""
+    db.execute("PRAGMA journal_mode=WAL;")
+    cur = db.cursor()
+    while True:
+        db.commit()
+        cur.execute("BEGIN IMMEDIATE;")
+        version = cur.execute("PRAGMA user_version;").fetchone()[0]
+        if version >= len(MIGRATIONS):
+            db.commit()
+            break
+        MIGRATIONS[version](cur)
+        cur.execute("PRAGMA user_version="+str(version+1)+";")
+        db.commit()
+    cur.close()
@@ -0,0 +1,196 @@
+import hashlib
+import multiprocessing
+import pickle
+import queue
+import traceback
+from collections import OrderedDict
+
+from dataparallel import mapScript, reduceScript, runScript
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+RESULT_OK = 0
+RESULT_ERROR = 1
+RESULT_MISSING = 2
+
+# what a worker does with the compiled script and the input it is sent
+OPERATION_RUN = 0
+OPERATION_MAP = 1
+OPERATION_REDUCE = 2
+
+
+class ScriptError(Exception):
+    """A script raised, ran out of time or memory, or its worker process died"""
+
+
+def setMemoryLimit(memoryLimit):
+    """Caps the address space of the worker for the next execution, None to lift the cap"""
+    if resource is None:
+        return
+    hard = resource.getrlimit(resource.RLIMIT_AS)[1]
+    soft = hard if memoryLimit is None else memoryLimit if hard == resource.RLIM_INFINITY else min(
+        memoryLimit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+
+
+def serve(conn, cacheSize):
+    """Runs scripts sent by the pool until the pipe closes, the main loop of a worker process
+
+    Compiled code is cached by key, the pool only sends the source of a key the worker hasn't compiled yet.
+    """
+    codes = OrderedDict()
+    while True:
+        try:
+            key, code, operation, input, memoryLimit = pickle.loads(
+                conn.recv_bytes())
+        except EOFError:
+            return
+        compiled = codes.get(key)
+        if compiled is not None:
+            codes.move_to_end(key)
+        elif code is None:
+            conn.send_bytes(pickle.dumps(
+                (RESULT_MISSING, None), pickle.HIGHEST_PROTOCOL))
+            continue
+        try:
+            if compiled is None:
+                compiled = compile(code, "<script "+str(key[0])+">", "exec")
+                codes[key] = compiled
+                if len(codes) > cacheSize:
+                    codes.popitem(last=False)
+            setMemoryLimit(memoryLimit)
+            try:
+                if operation == OPERATION_MAP:
+                    output = mapScript(compiled, input)
+                elif operation == OPERATION_REDUCE:
+                    output = reduceScript(compiled, *input)
+                else:
+                    output = runScript(compiled, input)
+            finally:
+                setMemoryLimit(None)
+            result = pickle.dumps(
+                (RESULT_OK, output), pickle.HIGHEST_PROTOCOL)
+        except BaseException:
+            result = pickle.dumps(
+                (RESULT_ERROR, traceback.format_exc()), pickle.HIGHEST_PROTOCOL)
+        conn.send_bytes(result)
+
+
+class ScriptWorker:
+    def __init__(self, context, cacheSize):
+        self.conn, childConn = context.Pipe()
+        self.process = context.Process(
+            target=serve, args=(childConn, cacheSize), name="script-worker", daemon=True)
+        self.process.start()
+        childConn.close()
+        self.keys = set()
+
+    def close(self):
+        self.conn.close()
+        self.process.kill()
+        self.process.join()
+
+
+class ScriptPool:
+    """Runs scripts on pre-forked worker processes, isolated from the calling process
+
+    A worker runs one script at a time and keeps the compiled code of the scripts it ran. A worker
+    whose script runs out of time is killed and replaced, a script running out of memory raises
+    MemoryError inside its worker. Inputs and outputs are pickled, so they must be plain objects.
+    """
+
+    def __init__(self, workers, timeout=None, memory_limit=None, cache_size=256):
+        """
+        :param workers: worker processes, started up front
+        :param timeout: default seconds a script may run, None for no limit
+        :param memory_limit: default bytes of address space of a worker while running a script, None for no limit
+        :param cache_size: compiled scripts kept per worker
+        """
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.cache_size = cache_size
+        self.context = multiprocessing.get_context(
+            "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+        self.workers = [ScriptWorker(self.context, cache_size)
+                        for i in range(workers)]
+        self.idle = queue.Queue()
+        for worker in self.workers:
+            self.idle.put(worker)
+
+    def replace(self, worker):
+        worker.close()
+        replacement = ScriptWorker(self.context, self.cache_size)
+        self.workers[self.workers.index(worker)] = replacement
+        return replacement
+
+    def run(self, taskId, code: str, input, timeout=None, memory_limit=None):
+        """Runs a script on an idle worker, blocking until it ends
+
+        The script reads input and sets output.
+
+        :param timeout: overrides the pool's timeout
+        :param memory_limit: overrides the pool's memory limit
+        :return: the output, None if the script didn't set it
+        :raise ScriptError: if the script raised, timed out or its worker died
+        """
+        return self.execute(taskId, code, OPERATION_RUN, input, 1, timeout, memory_limit)
+
+    def map(self, taskId, code: str, inputs: list, timeout=None, memory_limit=None):
+        """Runs a script on every element of a chunk on one idle worker, the way run() does
+
+        The timeout applies per element, the chunk may run that long times its elements.
+
+        :return: the output of each element in order
+        """
+        return self.execute(taskId, code, OPERATION_MAP, inputs, len(inputs), timeout, memory_limit)
+
+    def reduce(self, taskId, code: str, inputs: list, accumulator=None, hasAccumulator: bool = False, timeout=None, memory_limit=None):
+        """Folds the elements of a chunk with a script on one idle worker, the way run() and reduceScript() do
+
+        The script reads input and accumulator and sets output. The timeout applies per element.
+        """
+        return self.execute(taskId, code, OPERATION_REDUCE, (inputs, accumulator, hasAccumulator), len(inputs), timeout, memory_limit)
+
+    def execute(self, taskId, code: str, operation, input, count, timeout, memory_limit):
+        timeout = self.timeout if timeout is None else timeout
+        if timeout is not None:
+            timeout = timeout*max(1, count)
+        memory_limit = self.memory_limit if memory_limit is None else memory_limit
+        key = (taskId, hashlib.sha1(code.encode("utf-8")).hexdigest())
+        worker = self.idle.get()
+        try:
+            status, result = self.send(
+                worker, key, None if key in worker.keys else code, operation, input, memory_limit, timeout)
+            if status == RESULT_MISSING:
+                status, result = self.send(
+                    worker, key, code, operation, input, memory_limit, timeout)
+            worker.keys.add(key)
+            if status == RESULT_ERROR:
+                raise ScriptError(result)
+            return result
+        except ScriptError:
+            raise
+        except TimeoutError:
+            worker = self.replace(worker)
+            raise ScriptError("Script of task "+str(taskId) +
+                              " timed out after "+str(timeout)+"s")
+        except (EOFError, OSError):
+            worker = self.replace(worker)
+            raise ScriptError("Worker running the script of task " +
+                              str(taskId)+" exited")
+        finally:
+            self.idle.put(worker)
+
+    def send(self, worker, key, code, operation, input, memory_limit, timeout):
+        worker.conn.send_bytes(pickle.dumps(
+            (key, code, operation, input, memory_limit), pickle.HIGHEST_PROTOCOL))
+        if not worker.conn.poll(timeout):
+            raise TimeoutError()
+        return pickle.loads(worker.conn.recv_bytes())
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
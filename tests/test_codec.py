@@ -0,0 +1,50 @@
+import io
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from codec import OP_STRUCTURE, OP_VALUE, decodeBinary, encodeBinary, readBinary  # noqa: E402
+from packing import DATATYPE_FLOAT, DATATYPE_INT, DATATYPE_TEXT, packValues  # noqa: E402
+
+INTS = [(OP_STRUCTURE, 3)]+[(OP_VALUE, DATATYPE_INT)]*3
+RECORD = [(OP_STRUCTURE, 3), (OP_VALUE, DATATYPE_INT),
+          (OP_VALUE, DATATYPE_FLOAT), (OP_VALUE, DATATYPE_TEXT)]
+
+
+class ReadBinaryTest(unittest.TestCase):
+
+    def test_reads_in_blocks(self):
+        program = [(OP_STRUCTURE, 1000)]+[(OP_VALUE, DATATYPE_INT)]*1000
+        values = list(range(-500, 500))
+        self.assertEqual(readBinary(program, io.BytesIO(
+            encodeBinary(program, values)), buffer_size=24), values)
+
+    def test_mixed_values_take_their_base(self):
+        self.assertEqual(decodeBinary(RECORD, encodeBinary(
+            RECORD, [1, 2.5, "é"])), [1, 2.5, "é"])
+        self.assertEqual(decodeBinary(
+            RECORD, packValues([1.0, 2, "x"])), [1, 2.0, "x"])
+
+    def test_empty_output(self):
+        self.assertIsNone(decodeBinary(INTS, b""))
+
+    def test_value_count_must_match(self):
+        with self.assertRaisesRegex(ValueError, "holds 2 values"):
+            decodeBinary(INTS, packValues([1, 2]))
+
+    def test_values_must_fit_their_base(self):
+        with self.assertRaises(ValueError):
+            decodeBinary(INTS, packValues(["1", "2", "3"]))
+        with self.assertRaises(ValueError):
+            decodeBinary(INTS, packValues([1.0, 2.5, 3.0]))
+
+    def test_truncated_blob(self):
+        with self.assertRaisesRegex(ValueError, "ended"):
+            decodeBinary(INTS, packValues([1, 2, 3])[:-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from coprocess import CoprocessError, CoprocessPool  # noqa: E402
+
+# answers every frame with the payload it received, or never answers a payload of b"hang"
+ECHO = """import sys
+while True:
+    line = sys.stdin.buffer.readline()
+    if not line:
+        break
+    payload = sys.stdin.buffer.read(int(line))
+    if payload == b"hang":
+        while True:
+            pass
+    sys.stdout.buffer.write(str(len(payload)).encode()+b"\\n"+payload)
+    sys.stdout.buffer.flush()
+"""
+
+
+class CoprocessPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.dir.name, "echo.py")
+        with open(path, "w") as f:
+            f.write(ECHO)
+        self.command = sys.executable+" "+path
+        self.pool = CoprocessPool(timeout=1)
+
+    def tearDown(self):
+        self.pool.close()
+        self.dir.cleanup()
+
+    def test_request(self):
+        self.assertEqual(self.pool.request(self.command, b"1 2 "), b"1 2 ")
+        self.assertEqual(self.pool.request(self.command, b"3 "), b"3 ")
+        self.assertEqual(len(self.pool.idle[self.command]), 1)
+
+    def test_hung_instance_is_killed(self):
+        self.pool.request(self.command, b"1 ")
+        instance = self.pool.idle[self.command][0]
+        started = time.monotonic()
+        with self.assertRaisesRegex(CoprocessError, "timed out"):
+            self.pool.request(self.command, b"hang", timeout=0.5)
+        self.assertLess(time.monotonic()-started, 5)
+        self.assertIsNotNone(instance.process.poll())
+        self.assertEqual(self.pool.idle.get(self.command, []), [])
+        # the next execution gets a fresh instance
+        self.assertEqual(self.pool.request(self.command, b"2 "), b"2 ")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import schema  # noqa: E402
+from daemon import Jallad  # noqa: E402
+
+TASK_SCRIPT = 5
+STATE_LOADED = 1
+STATE_ENDED = 3
+STATE_FAILED = -2
+
+INT_DATATYPE = {'id': 1, 'base': 0, 'length': 0,
+                'subDataTypes': [], 'title': 'int'}
+
+
+class DaemonTest(unittest.TestCase):
+    """Runs a daemon in process against a scratch datastore holding a one script workflow"""
+
+    code = "output = input + 1"
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.directory.name, "datastore.db")
+        self.registry_cache = os.path.join(
+            self.directory.name, "datatypes.json")
+        with open(self.registry_cache, "w") as cacheFile:
+            json.dump({'etag': None, 'dataTypes': [INT_DATATYPE]}, cacheFile)
+        db = schema.connect(self.db)
+        schema.migrate(db)
+        cur = db.cursor()
+        cur.execute(
+            "INSERT INTO Workflow (Title,InputDataTypeId,OutputDataTypeId) VALUES ('script',1,1);")
+        self.workflowId = cur.lastrowid
+        cur.execute("INSERT INTO DataIndex DEFAULT VALUES;")
+        dataIndexId = cur.lastrowid
+        cur.execute("INSERT INTO Task (Title,Type,InputDataTypeId,OutputDataTypeId) VALUES ('script',?,1,1);", [
+            TASK_SCRIPT])
+        cur.execute("INSERT INTO TaskParam (TaskId,Title,Value) VALUES (?,'code',?);", [
+            cur.lastrowid, self.code])
+        taskInstanceIds = []
+        for taskId in [0, 1, 0]:
+            cur.execute("INSERT INTO TaskInstance (WorkflowId,TaskId) VALUES (?,?);", [
+                self.workflowId, taskId])
+            taskInstanceIds.append(cur.lastrowid)
+        for source, target in zip(taskInstanceIds, taskInstanceIds[1:]):
+            cur.execute("INSERT INTO Edge (WorkflowId,TaskInstanceId1,DataIndexId1,TaskInstanceId2,DataIndexId2) VALUES (?,?,?,?,?);", [
+                self.workflowId, source, dataIndexId, target, dataIndexId])
+        db.commit()
+        db.close()
+        self.jallads = []
+
+    def tearDown(self):
+        for jallad in self.jallads:
+            jallad.http.close()
+            jallad.script_pool.close()
+            jallad.registry.stop()
+            jallad.db.close()
+        self.directory.cleanup()
+
+    def jallad(self, **options):
+        jallad = Jallad(db_name=self.db,
+                        registry_cache=self.registry_cache, **options)
+        jallad.updateDataTypes()
+        self.jallads.append(jallad)
+        return jallad
+
+    def execute(self, value):
+        """Inserts a LOADED execution of the workflow on a value"""
+        db = sqlite3.connect(self.db, timeout=30)
+        cur = db.cursor()
+        cur.execute("INSERT INTO Data (Title,DataTypeId,Created) VALUES ('input',1,?);", [
+            time.time()])
+        dataId = cur.lastrowid
+        cur.execute(
+            "INSERT INTO UnitData (DataId,Value) VALUES (?,?);", [dataId, value])
+        cur.execute("INSERT INTO WorkflowExecution (WorkflowId,InputDataId,ExecutionState,EntryTime) VALUES (?,?,?,?);", [
+            self.workflowId, dataId, STATE_LOADED, time.time()])
+        workflowExecutionId = cur.lastrowid
+        db.commit()
+        db.close()
+        return workflowExecutionId
+
+    def query(self, sql, parameters=()):
+        db = sqlite3.connect(self.db, timeout=30)
+        try:
+            return db.execute(sql, parameters).fetchall()
+        finally:
+            db.close()
+
+    def runUntilEnded(self, jallad, timeout=30):
+        """Ticks until every workflow execution ended or failed"""
+        deadline = time.time()+timeout
+        while self.query("SELECT Id FROM WorkflowExecution WHERE ExecutionState NOT IN (?,?);", [STATE_ENDED, STATE_FAILED]):
+            self.assertLess(time.time(), deadline,
+                            "workflow executions still running")
+            jallad.tick()
+            time.sleep(0.01)
+
+    def outputs(self):
+        """workflow execution id -> (state, output values)"""
+        return dict((row[0], (row[1], [int(float(value[0])) for value in self.query("SELECT Value FROM UnitData WHERE DataId=? ORDER BY Id;", [row[2]])]))
+                    for row in self.query("SELECT Id,ExecutionState,OutputDataId FROM WorkflowExecution;"))
+
+
+class InterruptTest(DaemonTest):
+    # long enough to still be running on the script pool when the worker is interrupted
+    code = "import time\ntime.sleep(2)\noutput = input + 1"
+
+    def test_interrupted_phase_is_rolled_back(self):
+        jallad = self.jallad()
+        running = self.execute(1)
+        deadline = time.time()+30
+        while jallad.running[TASK_SCRIPT] == 0:
+            self.assertLess(time.time(), deadline)
+            jallad.tick()
+        interrupted = self.execute(2)
+        jallad.startLoadedWorkflows()
+
+        def interrupt(workflowExecutionId):
+            del jallad.workflowExecution
+            raise KeyboardInterrupt()
+
+        def queueNextTaskInstances():
+            # interrupts the phase once it claimed the ENDED input terminal, before it queued the script
+            jallad.workflowExecution = interrupt
+            Jallad.queueNextTaskInstances(jallad)
+        jallad.queueNextTaskInstances = queueNextTaskInstances
+        with self.assertRaises(KeyboardInterrupt):
+            jallad.start(0.05, event_driven=False, metrics_interval=0)
+        # storing the running execution's result on the way out didn't commit the interrupted phase
+        self.assertEqual(self.query("SELECT ExecutionState FROM TaskInstanceExecution WHERE WorkflowExecutionId=?;", [interrupted]),
+                         [(STATE_ENDED,)])
+        self.runUntilEnded(self.jallad())
+        self.assertEqual(self.outputs(), {
+            running: (STATE_ENDED, [2]), interrupted: (STATE_ENDED, [3])})
+
+
+if __name__ == "__main__":
+    unittest.main()
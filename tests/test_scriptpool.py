@@ -0,0 +1,38 @@
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from scriptpool import ScriptPool  # noqa: E402
+
+# scripts stored before they ran on worker processes use the modules the daemon imported without importing them
+STORED_SCRIPT = "output = json.dumps({'root': math.sqrt(input)}, sort_keys=True)"
+
+
+class ScriptPoolTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = ScriptPool(1, timeout=30)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+
+    def test_script_uses_daemon_modules(self):
+        self.assertEqual(self.pool.run(1, STORED_SCRIPT, 16), '{"root": 4.0}')
+
+    def test_element_scripts_use_daemon_modules(self):
+        self.assertEqual(self.pool.map(1, STORED_SCRIPT, [1, 4]), [
+                         '{"root": 1.0}', '{"root": 2.0}'])
+
+    def test_scripts_start_from_fresh_globals(self):
+        self.pool.run(2, "global leaked\nleaked = input\nmath = None", 1)
+        self.assertEqual(self.pool.run(
+            3, "output = ('leaked' in globals(), math.floor(input))", 2.5), (False, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+STATE_LOADED = 1
+
+
+class ServiceStartTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # importing the webserver sets up its datastore and data type catalog in the working directory
+        cls.cwd = os.getcwd()
+        cls.dir = tempfile.TemporaryDirectory()
+        os.chdir(cls.dir.name)
+        with open("datatypes.json", "w") as f:
+            json.dump({'etag': None, 'dataTypes': [
+                {'id': 1, 'title': "int", 'base': 0, 'length': 0, 'subDataTypes': []}]}, f)
+        import webserver
+        cls.webserver = webserver
+        cls.client = webserver.app.test_client()
+        db = sqlite3.connect(webserver.db_name)
+        db.execute(
+            "INSERT INTO Workflow (Id,Title,InputDataTypeId,OutputDataTypeId) VALUES (1,'square',1,1);")
+        db.execute(
+            "INSERT INTO Service (Id,Title,NodeId,WorkflowId) VALUES (1,'squares',0,1);")
+        db.commit()
+        db.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.webserver.registry.stop()
+        cls.webserver.pool.close()
+        cls.webserver.read_only_pool.close()
+        os.chdir(cls.cwd)
+        cls.dir.cleanup()
+
+    def query(self, sql, params=()):
+        db = sqlite3.connect(self.webserver.db_name)
+        try:
+            return db.execute(sql, params).fetchall()
+        finally:
+            db.close()
+
+    def test_start_stores_input_and_params(self):
+        res = self.client.post("/service/1/start", json={'values': [7], 'options': {'fast': True}, 'tags': ["a"],
+                                                          'user': "x"})
+        started = json.loads(res.data)
+        self.assertEqual(started['title'], "squares")
+        (inputDataId, state), = self.query("SELECT InputDataId,ExecutionState FROM WorkflowExecution WHERE Id=?;",
+                                           [started['workflowExecutionId']])
+        self.assertEqual(state, STATE_LOADED)
+        self.assertEqual(self.query(
+            "SELECT Value FROM UnitData WHERE DataId=?;", [inputDataId]), [("7",)])
+        params = dict(self.query("SELECT Title,Value FROM WorkflowExecutionParams WHERE WorkflowExecutionId=?;",
+                                 [started['workflowExecutionId']]))
+        self.assertEqual((json.loads(params['options']), json.loads(params['tags']), params['user']),
+                         ({'fast': True}, ["a"], "x"))
+        self.assertIn('remoteAddr', params)
+
+    def test_failed_start_stores_nothing(self):
+        counts = self.query(
+            "SELECT (SELECT COUNT(*) FROM WorkflowExecution),(SELECT COUNT(*) FROM Data);")
+        res = self.client.post("/service/1/start", json={'values': [{'not': "a value"}]})
+        self.assertIn('error', json.loads(res.data))
+        self.assertEqual(self.query(
+            "SELECT (SELECT COUNT(*) FROM WorkflowExecution),(SELECT COUNT(*) FROM Data);"), counts)
+
+
+if __name__ == "__main__":
+    unittest.main()
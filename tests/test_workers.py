@@ -0,0 +1,250 @@
+import collections
+import json
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import schema  # noqa: E402
+
+TASK_SCRIPT = 5
+STATE_LOADED = 1
+STATE_ENDED = 3
+STATE_FAILED = -2
+
+INT_DATATYPE = {'id': 1, 'base': 0, 'length': 0,
+                'subDataTypes': [], 'title': 'int'}
+
+# appends the step, its input and the process running it to the run log, then adds STEP_OUTPUT
+STEP_SCRIPT = """with open({log!r}, "a") as log:
+    log.write("{step}:"+str(input)+"\\n")
+output = input + {increment}
+"""
+STEP_OUTPUT = 1000
+# logs the start and the end of a step outlasting the lease of the worker running it
+SLOW_STEP_SCRIPT = """with open({log!r}, "a") as log:
+    log.write("{step}:start\\n")
+time.sleep(3)
+with open({log!r}, "a") as log:
+    log.write("{step}:end\\n")
+output = input + {increment}
+"""
+
+
+class DaemonTestCase(unittest.TestCase):
+    """Runs daemon workers against one datastore holding executions of a chain of script tasks"""
+
+    workers = 3
+    runs = 60
+    steps = 4
+    script = STEP_SCRIPT
+    timeout = 120
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+        self.db = os.path.join(self.path, "datastore.db")
+        self.log = os.path.join(self.path, "runs.log")
+        # the workers read the catalog persisted by the registry, so they never have to reach one
+        with open(os.path.join(self.path, "datatypes.json"), "w") as cacheFile:
+            json.dump({'etag': None, 'dataTypes': [INT_DATATYPE]}, cacheFile)
+        self.createChain()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def createChain(self):
+        db = schema.connect(self.db)
+        schema.migrate(db)
+        cur = db.cursor()
+        cur.execute(
+            "INSERT INTO Workflow (Title,InputDataTypeId,OutputDataTypeId) VALUES ('chain',1,1);")
+        cur.execute("INSERT INTO DataIndex DEFAULT VALUES;")
+        dataIndexId = cur.lastrowid
+        cur.execute(
+            "INSERT INTO TaskInstance (WorkflowId,TaskId) VALUES (1,0);")
+        taskInstanceIds = [cur.lastrowid]
+        for step in range(self.steps):
+            cur.execute("INSERT INTO Task (Title,Type,InputDataTypeId,OutputDataTypeId) VALUES (?,?,1,1);", [
+                "step"+str(step), TASK_SCRIPT])
+            taskId = cur.lastrowid
+            cur.execute("INSERT INTO TaskParam (TaskId,Title,Value) VALUES (?,'code',?);", [
+                taskId, self.script.format(log=self.log, step=step, increment=STEP_OUTPUT)])
+            cur.execute(
+                "INSERT INTO TaskInstance (WorkflowId,TaskId) VALUES (1,?);", [taskId])
+            taskInstanceIds.append(cur.lastrowid)
+        cur.execute(
+            "INSERT INTO TaskInstance (WorkflowId,TaskId) VALUES (1,0);")
+        taskInstanceIds.append(cur.lastrowid)
+        for source, target in zip(taskInstanceIds, taskInstanceIds[1:]):
+            cur.execute("INSERT INTO Edge (WorkflowId,TaskInstanceId1,DataIndexId1,TaskInstanceId2,DataIndexId2) VALUES (1,?,?,?,?);", [
+                source, dataIndexId, target, dataIndexId])
+        for run in range(self.runs):
+            cur.execute(
+                "INSERT INTO Data (Title,DataTypeId,Created) VALUES ('input',1,?);", [time.time()])
+            dataId = cur.lastrowid
+            cur.execute(
+                "INSERT INTO UnitData (DataId,Value) VALUES (?,?);", [dataId, run])
+            cur.execute("INSERT INTO WorkflowExecution (WorkflowId,InputDataId,ExecutionState,EntryTime) VALUES (1,?,?,?);", [
+                dataId, STATE_LOADED, time.time()])
+        db.commit()
+        db.close()
+
+    def startDaemon(self, name, *options):
+        """Starts the daemon in a session of its own, its output goes to <name>.log"""
+        with open(os.path.join(self.path, name+".log"), "w") as output:
+            return subprocess.Popen([sys.executable, os.path.join(ROOT, "daemon.py"), "--workers", str(self.workers),
+                                     "--db", self.db, "--sleep-interval", "0.2"]+list(options),
+                                    cwd=self.path, stdout=output, stderr=subprocess.STDOUT, start_new_session=True)
+
+    def stopDaemon(self, daemon):
+        # interrupts every worker as a terminal would, they store their running executions and exit
+        os.killpg(daemon.pid, signal.SIGINT)
+        try:
+            daemon.wait(30)
+        except subprocess.TimeoutExpired:
+            os.killpg(daemon.pid, signal.SIGKILL)
+            daemon.wait()
+
+    def daemonOutput(self, name):
+        with open(os.path.join(self.path, name+".log")) as output:
+            return output.read()
+
+    def runLog(self):
+        if not os.path.exists(self.log):
+            return []
+        with open(self.log) as log:
+            return log.read().splitlines()
+
+    def left(self):
+        """Count of the workflow executions that neither ended nor failed"""
+        db = sqlite3.connect(self.db, timeout=30)
+        try:
+            return db.execute("SELECT COUNT(*) FROM WorkflowExecution WHERE ExecutionState NOT IN (?,?);", [
+                STATE_ENDED, STATE_FAILED]).fetchone()[0]
+        finally:
+            db.close()
+
+    def waitFor(self, condition, message):
+        deadline = time.time()+self.timeout
+        while not condition():
+            self.assertLess(time.time(), deadline, message +
+                            " after "+str(self.timeout)+"s")
+            time.sleep(0.2)
+
+    def assertEndedOnce(self):
+        """Asserts every workflow execution ended, its output stored by one execution of each task instance"""
+        db = sqlite3.connect(self.db)
+        try:
+            states = dict(db.execute(
+                "SELECT ExecutionState,COUNT(*) FROM WorkflowExecution GROUP BY ExecutionState;").fetchall())
+            self.assertEqual(states, {STATE_ENDED: self.runs})
+            executions = db.execute(
+                "SELECT WorkflowExecutionId,TaskInstanceId,COUNT(*) FROM TaskInstanceExecution GROUP BY WorkflowExecutionId,TaskInstanceId;").fetchall()
+            self.assertEqual(len(executions), self.runs*(self.steps+2))
+            self.assertEqual([execution for execution in executions if execution[2] != 1], [])
+            outputs = sorted(int(float(row[0])) for row in db.execute(
+                "SELECT UnitData.Value FROM WorkflowExecution JOIN UnitData ON UnitData.DataId=WorkflowExecution.OutputDataId;"))
+            self.assertEqual(
+                outputs, [run+STEP_OUTPUT*self.steps for run in range(self.runs)])
+        finally:
+            db.close()
+
+
+class WorkersTest(DaemonTestCase):
+    """Runs several daemon workers against one datastore holding many executions of a chain of script tasks"""
+
+    def test_each_task_instance_execution_runs_once(self):
+        daemon = self.startDaemon("daemon", "--concurrency", "script=2")
+        try:
+            self.waitFor(lambda: self.left() == 0,
+                         "workflow executions still running")
+        finally:
+            self.stopDaemon(daemon)
+        self.assertEndedOnce()
+        ran = collections.Counter(self.runLog())
+        expected = set(str(step)+":"+str(run+STEP_OUTPUT*step)
+                       for run in range(self.runs) for step in range(self.steps))
+        self.assertEqual(set(ran), expected)
+        self.assertEqual(
+            dict((line, count) for line, count in ran.items() if count > 1), {})
+
+
+class LeaseTest(DaemonTestCase):
+    """Takes away the worker running a slow step, another worker reclaims the step once its one second lease expires"""
+
+    workers = 1
+    runs = 1
+    steps = 1
+    script = SLOW_STEP_SCRIPT
+    lease = ["--lease-duration", "1"]
+
+    def waitForStart(self):
+        self.waitFor(lambda: "0:start" in self.runLog(),
+                     "the step never started")
+
+    def test_killed_worker_execution_is_reclaimed(self):
+        crashed = self.startDaemon("crashed", *self.lease)
+        try:
+            self.waitForStart()
+        finally:
+            os.killpg(crashed.pid, signal.SIGKILL)
+            crashed.wait()
+        daemon = self.startDaemon("daemon", *self.lease)
+        try:
+            self.waitFor(lambda: self.left() == 0,
+                         "the reclaimed step never ended")
+        finally:
+            self.stopDaemon(daemon)
+        self.assertEndedOnce()
+        self.assertEqual(self.runLog(), ["0:start", "0:start", "0:end"])
+        self.assertIn("lease:reclaimed:", self.daemonOutput("daemon"))
+
+    def test_stalled_worker_loses_its_lease(self):
+        stalled = self.startDaemon("stalled", *self.lease)
+        daemon = None
+        try:
+            self.waitForStart()
+            self.stall(stalled)
+            daemon = self.startDaemon("daemon", *self.lease)
+            self.waitFor(lambda: self.left() == 0,
+                         "the reclaimed step never ended")
+            # the stalled worker ends its run of the step after the other worker stored the output
+            os.killpg(stalled.pid, signal.SIGCONT)
+            self.waitFor(lambda: "lease:lost:" in self.daemonOutput("stalled"),
+                         "the stalled worker never lost its lease")
+        finally:
+            os.killpg(stalled.pid, signal.SIGCONT)
+            self.stopDaemon(stalled)
+            if daemon is not None:
+                self.stopDaemon(daemon)
+        self.assertEndedOnce()
+        self.assertEqual(self.runLog().count("0:end"), 2)
+        self.assertIn("lease:reclaimed:", self.daemonOutput("daemon"))
+
+    def stall(self, daemon):
+        """Stops every process of the daemon, at a moment it holds no write lock on the datastore"""
+        db = sqlite3.connect(self.db, timeout=0.1, isolation_level=None)
+        try:
+            while True:
+                os.killpg(daemon.pid, signal.SIGSTOP)
+                try:
+                    db.execute("BEGIN IMMEDIATE;")
+                    db.execute("ROLLBACK;")
+                    return
+                except sqlite3.OperationalError:
+                    os.killpg(daemon.pid, signal.SIGCONT)
+                    time.sleep(0.05)
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
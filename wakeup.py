@@ -0,0 +1,82 @@
+import select
+import socket
+
+WAKEUP_ADDRESS = ("127.0.0.1", 5002)
+# consecutive ports from WAKEUP_ADDRESS notified at once, daemon worker i listens on the i-th
+WAKEUP_PORTS = 16
+
+
+def workerAddress(index, address=WAKEUP_ADDRESS):
+    """The address the index-th daemon worker listens on
+
+    Workers past WAKEUP_PORTS share ports, the kernel hands a datagram to only one of the workers
+    sharing a port.
+    """
+    return (address[0], address[1]+index % WAKEUP_PORTS)
+
+
+def notify(address=WAKEUP_ADDRESS, ports=WAKEUP_PORTS):
+    """Wakes up the daemon workers waiting on the given address and the ports after it
+
+    :param address: (host, port) the WakeupListener of the first worker is bound to
+    :param ports: consecutive ports notified, one datagram each
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for port in range(address[1], address[1]+ports):
+            try:
+                sock.sendto(b"1", (address[0], port))
+            except OSError:
+                pass
+    finally:
+        sock.close()
+
+
+class WakeupListener:
+    """Receives wakeup datagrams sent by notify()"""
+
+    def __init__(self, address=WAKEUP_ADDRESS):
+        self.address = address
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.sock.bind(address)
+        self.sock.setblocking(False)
+        self.local_reader, self.local_writer = socket.socketpair()
+        self.local_reader.setblocking(False)
+        self.local_writer.setblocking(False)
+
+    def set(self):
+        """Wakes up the listener from another thread of the same process"""
+        try:
+            self.local_writer.send(b"1")
+        except OSError:
+            pass
+
+    def drain(self):
+        """Discards every pending wakeup"""
+        for sock in [self.sock, self.local_reader]:
+            while True:
+                try:
+                    sock.recv(64)
+                except (BlockingIOError, InterruptedError):
+                    break
+
+    def wait(self, timeout):
+        """Blocks until a wakeup arrives or the timeout elapses
+
+        :param timeout: maximum wait in seconds
+        :return: True if woken up by a notification
+        """
+        readable, _, _ = select.select(
+            [self.sock, self.local_reader], [], [], max(timeout, 0))
+        if readable:
+            self.drain()
+            return True
+        return False
+
+    def close(self):
+        self.sock.close()
+        self.local_reader.close()
+        self.local_writer.close()
@@ -1,13 +1,30 @@
 from time import time
 import requests
-from flask import Flask, request
+from flask import Flask, Response, g, request, stream_with_context
 from flask_cors import CORS
-import sqlite3
 import json
+import sqlite3
+import tempfile
+
+from datastream import FORMAT_BINARY, FORMAT_CSV, FORMAT_NDJSON, binaryTypecode, castValues, formatValues, loadStream, parseValues, readBlocks, splitLines, spoolBlocks, storeStream, valueLayout
+from packing import loadValues, loadValuesBatch, storeValues, storeValuesBatch
+from registry import DataTypeRegistry
+from responsecache import ResponseCache
+from schema import ConnectionPool, connect, migrate
+from wakeup import notify
 
 app = Flask(__name__)
 CORS(app)
 db_name = "datastore.db"
+pack_data = False
+registry_url = "http://localhost:5001/datatype"
+registry_cache = "datatypes.json"
+pool = None
+read_only_pool = None
+response_cache = ResponseCache()
+registry = None
+# data type id -> valueLayout(), dropped when the registry changes the data type
+value_layouts = {}
 
 TASK_SYSTEM = 0
 TASK_SERVICE = 1
@@ -29,44 +46,94 @@ STATE_MARKED = 4
 STATE_KILLED = -1
 STATE_FAILED = -2
 
+# rows of a /data listing sent per batched values query
+DATA_BATCH_SIZE = 100
+# rows of a /data page at most
+DATA_MAX_LIMIT = 10000
+# inputs of a batch submission stored per transaction
+BATCH_CHUNK_SIZE = 1000
+# content types of the bodies /data/<id>/values takes
+VALUE_FORMATS = {"application/x-ndjson": FORMAT_NDJSON, "application/jsonl": FORMAT_NDJSON,
+                 "text/csv": FORMAT_CSV, "application/octet-stream": FORMAT_BINARY}
+
 
 def setup():
-    db = sqlite3.connect(db_name)
-    cur = db.cursor()
-    cur.execute(
-        "CREATE TABLE IF NOT EXISTS Registry(Id INTEGER PRIMARY KEY AUTOINCREMENT, IpAddress TEXT);")
-    cur.execute(
-        "CREATE TABLE IF NOT EXISTS Workflow(Id INTEGER PRIMARY KEY AUTOINCREMENT, Title TEXT, InputDataTypeId INT, OutputDataTypeId INT);")
-    cur.execute(
-        "CREATE TABLE IF NOT EXISTS Node(Id INTEGER PRIMARY KEY AUTOINCREMENT, Title TEXT, IpAddress TEXT);")
-    cur.execute(
-        "CREATE TABLE IF NOT EXISTS Service(Id INTEGER PRIMARY KEY AUTOINCREMENT, Title TEXT, NodeId INT REFERENCES Node(Id), WorkflowId INT REFERENCES Workflow(Id),NodeServiceId INT, UniformServiceId INT);")
-    cur.execute(
-        "CREATE TABLE IF NOT EXISTS Task(Id INTEGER PRIMARY KEY AUTOINCREMENT, Title TEXT, Type INT, InputDataTypeId INT, OutputDataTypeId INT);")
-    cur.execute(
-        "CREATE TABLE IF NOT EXISTS TaskParam(Id INTEGER PRIMARY KEY AUTOINCREMENT, TaskId INT REFERENCES Task(Id), Title TEXT, Value TEXT);")
-    cur.execute(
-        "CREATE TABLE IF NOT EXISTS TaskInstance(Id INTEGER PRIMARY KEY AUTOINCREMENT, WorkflowId INT REFERENCES Workflow(Id), TaskId INT REFERENCES Task(Id), ScreenX INT, ScreenY INT);")
-    cur.execute(
-        "CREATE TABLE IF NOT EXISTS Edge(Id INTEGER PRIMARY KEY AUTOINCREMENT,  WorkflowId INT REFERENCES Workflow(Id), TaskInstanceId1 INT REFERENCES TaskInstance(Id), DataIndexId1 INT REFERENCES DataIndex(Id), TaskInstanceId2 INT REFERENCES TaskInstance(Id), DataIndexId2 INT REFERENCES DataIndex(Id));")
-    cur.execute(
-        "CREATE TABLE IF NOT EXISTS DataIndex(Id INTEGER PRIMARY KEY AUTOINCREMENT);")
-    cur.execute(
-        "CREATE TABLE IF NOT EXISTS DataIndexValue(Id INTEGER PRIMARY KEY AUTOINCREMENT, DataIndexId INT REFERENCES DataIndex(Id), Value INT);")
-    cur.execute(
-        "CREATE TABLE IF NOT EXISTS Data(Id INTEGER PRIMARY KEY AUTOINCREMENT, Title TEXT, DataTypeId INT, Created TEXT);")
-    cur.execute(
-        "CREATE TABLE IF NOT EXISTS UnitData(Id INTEGER PRIMARY KEY AUTOINCREMENT, DataId INT REFERENCES Data(Id), Value TEXT);")
-    cur.execute(
-        "CREATE TABLE IF NOT EXISTS WorkflowExecution(Id INTEGER PRIMARY KEY AUTOINCREMENT,  WorkflowId INT REFERENCES Workflow(Id), EntryTime TEXT, InputDataId INT REFERENCES Data(Id), ExecutionState INT, StartTime TEXT, OutputDataId INT REFERENCES Data(Id), EndTime TEXT);")
-    cur.execute(
-        "CREATE TABLE IF NOT EXISTS WorkflowExecutionParams(Id INTEGER PRIMARY KEY AUTOINCREMENT, WorkflowExecutionId INT REFERENCES WorkflowExecution(Id), Title TEXT, Value TEXT);")
-    cur.execute(
-        "CREATE TABLE IF NOT EXISTS TaskInstanceExecution(Id INTEGER PRIMARY KEY AUTOINCREMENT, WorkflowExecutionId INT REFERENCES WorkflowExecution(Id), TaskInstanceId INT REFERENCES TaskInstance(Id), EntryTime TEXT, InputDataId INT REFERENCES Data(Id), ExecutionState INT, StartTime TEXT, OutputDataId INT REFERENCES Data(Id), EndTime TEXT);")
-    cur.execute(
-        "CREATE TABLE IF NOT EXISTS TaskInstanceExecutionParams(Id INTEGER PRIMARY KEY AUTOINCREMENT, TaskInstanceExecutionId INT REFERENCES TaskInstanceExecution(Id), Title TEXT, Value TEXT);")
-    db.commit()
+    global pool, read_only_pool, registry
+    db = connect(db_name)
+    migrate(db)
     db.close()
+    for oldPool in [pool, read_only_pool]:
+        if oldPool is not None:
+            oldPool.close()
+    pool = ConnectionPool(db_name)
+    read_only_pool = ConnectionPool(db_name, read_only=True)
+    if registry is not None:
+        registry.stop()
+    registry = DataTypeRegistry(registry_url, cache_path=registry_cache)
+    registry.start()
+    value_layouts.clear()
+
+
+def value_layout(dataTypeId):
+    """The valueLayout() of a data type, None if the registry doesn't know it"""
+    for changed in registry.apply():
+        value_layouts.pop(changed, None)
+    if dataTypeId not in value_layouts:
+        value_layouts[dataTypeId] = valueLayout(registry.get, dataTypeId)
+    return value_layouts[dataTypeId]
+
+
+def get_db(read_only=False):
+    """Returns the connection of the current request, taken from a pool on first use and given back when the request ends
+
+    :param read_only: use a connection that can't write, for handlers that only read
+    """
+    key = 'read_only_db' if read_only else 'db'
+    if key not in g:
+        setattr(g, key, (read_only_pool if read_only else pool).acquire())
+    return g.get(key)
+
+
+def cached_response(build):
+    """Answers a read of definitions from the response cache, building and caching the body on a miss
+
+    :param build: callable returning the JSON body and the tags of the entities it was read from
+    :return: the response, 304 if it matches the request's If-None-Match
+    """
+    key = request.full_path
+    entry = response_cache.get(key)
+    if entry is None:
+        since = response_cache.begin()
+        try:
+            body, tags = build()
+            entry = response_cache.put(key, body, tags, since)
+        finally:
+            response_cache.end(since)
+    response = Response(entry[0])
+    response.set_etag(entry[1])
+    return response.make_conditional(request)
+
+
+@app.teardown_appcontext
+def release_db(exception):
+    db = g.pop('db', None)
+    if db is not None:
+        pool.release(db)
+    db = g.pop('read_only_db', None)
+    if db is not None:
+        read_only_pool.release(db)
+
+
+def bump_workflow_revision(cur, workflowId):
+    """Invalidates the daemon's compiled plan of a workflow"""
+    cur.execute("INSERT INTO WorkflowRevision (WorkflowId,Revision) VALUES (?,1) ON CONFLICT(WorkflowId) DO UPDATE SET Revision=Revision+1;",
+                [workflowId])
+
+
+def bump_task_revision(cur, taskId):
+    """Invalidates the daemon's compiled plans of every workflow using a task, directly or as the sub task of a decision, map, filter or reduce"""
+    cur.execute("INSERT INTO WorkflowRevision (WorkflowId,Revision) SELECT DISTINCT WorkflowId,1 FROM TaskInstance WHERE TaskId=? OR TaskId IN (SELECT TaskId FROM TaskParam WHERE Title='subTaskId' AND CAST(Value AS INT)=?) ON CONFLICT(WorkflowId) DO UPDATE SET Revision=Revision+1;",
+                [taskId, taskId])
 
 
 @app.route("/")
@@ -76,28 +143,26 @@ def hello_world():
 
 @app.route("/workflow")
 def workflow():
-    db = sqlite3.connect(db_name)
-    cur = db.cursor()
-    workflows = [dict(zip(['id', 'title', 'inputDataTypeId', 'outputDataTypeId'], row))
-                 for row in cur.execute("SELECT * FROM Workflow;")]
-    db.commit()
-    db.close()
-    return json.dumps(workflows)
+    def build():
+        db = get_db(read_only=True)
+        cur = db.cursor()
+        workflows = [dict(zip(['id', 'title', 'inputDataTypeId', 'outputDataTypeId'], row))
+                     for row in cur.execute("SELECT * FROM Workflow;")]
+        return json.dumps(workflows), ["Workflow"]
+    return cached_response(build)
 
 
 @app.route("/workflow/<int:id>", methods=["GET", "POST", "PATCH", "DELETE"])
 def workflow_id(id):
     if request.method == "GET":
-        db = sqlite3.connect(db_name)
+        db = get_db(read_only=True)
         cur = db.cursor()
         workflow = [dict(zip(['id', 'title', 'inputDataTypeId', 'outputDataTypeId'], row)) for row in cur.execute(
-            "SELECT * FROM Workflow WHERE Id=(?);", (id))]
-        db.commit()
-        db.close()
+            "SELECT * FROM Workflow WHERE Id=?;", [id])]
         return json.dumps(workflow)
     elif request.method == "POST":
         workflow = request.get_json(force=True)
-        db = sqlite3.connect(db_name)
+        db = get_db()
         cur = db.cursor()
         cur.execute("INSERT INTO Workflow (Title, InputDataTypeId, OutputDataTypeId) VALUES (?,?,?);",
                     [workflow['title'], workflow['inputDataTypeId'], workflow['outputDataTypeId']])
@@ -107,52 +172,57 @@ def workflow_id(id):
         cur.execute("INSERT INTO TaskInstance (WorkflowId, ScreenX, ScreenY, TaskId) VALUES (?,300,650,0);",
                     [workflow['id']])
         db.commit()
-        db.close()
+        response_cache.invalidate("Workflow", "Workflow:"+str(workflow['id']), "TaskInstance:"+str(workflow['id']))
         return json.dumps(workflow)
     elif request.method == "PATCH":
         workflow = request.get_json(force=True)
-        db = sqlite3.connect(db_name)
+        db = get_db()
         cur = db.cursor()
         cur.execute("UPDATE Workflow SET Title=?, InputDataTypeId=?, OutputDataTypeId=? WHERE Id=?;",
                     [workflow['title'], workflow['inputDataTypeId'], workflow['outputDataTypeId'], id])
+        bump_workflow_revision(cur, id)
         workflow['id'] = id
         db.commit()
-        db.close()
+        response_cache.invalidate("Workflow", "Workflow:"+str(id))
         return json.dumps(workflow)
     elif request.method == "DELETE":
-        db = sqlite3.connect(db_name)
+        db = get_db()
         cur = db.cursor()
         cur.execute("DELETE FROM Workflow WHERE Id=?;",
                     [id])
         cur.execute("DELETE FROM TaskInstance WHERE WorkflowId=?;",
                     [id])
+        bump_workflow_revision(cur, id)
         workflow = {"id": id, "deleted": True}
         db.commit()
-        db.close()
+        response_cache.invalidate("Workflow", "Workflow:"+str(id), "TaskInstance:"+str(id))
         return json.dumps(workflow)
     return "{error:'Invalid method'}"
 
 
 @app.route("/node")
 def node():
-    db = sqlite3.connect(db_name)
-    cur = db.cursor()
-    nodes = [{"id": 0, "title": "This Node", "services": [dict(zip(
-        ['id', 'title', 'nodeId', 'workflowId', 'nodeServiceId', 'uniformServiceId'], row2)) for row2 in cur.execute("SELECT * FROM Service Where NodeId=?;", [0])]}]
-    for row in cur.execute("SELECT * FROM Node;"):
-        node = dict(zip(['id', 'title', 'ip'], row))
-        cur2 = db.cursor()
-        node['services'] = [dict(zip(['id', 'title', 'nodeId', 'workflowId', 'nodeServiceId', 'uniformServiceId'], row2))
-                            for row2 in cur2.execute("SELECT * FROM Service Where NodeId=?;", [node['id']])]
-        nodes.append(node)
-    db.close()
-    return json.dumps(nodes)
+    def build():
+        db = get_db(read_only=True)
+        cur = db.cursor()
+        services = {}
+        for row in cur.execute("SELECT * FROM Service ORDER BY NodeId,Id;"):
+            services.setdefault(row[2], []).append(dict(
+                zip(['id', 'title', 'nodeId', 'workflowId', 'nodeServiceId', 'uniformServiceId'], row)))
+        nodes = [{"id": 0, "title": "This Node",
+                  "services": services.get(0, [])}]
+        for row in cur.execute("SELECT * FROM Node;"):
+            node = dict(zip(['id', 'title', 'ip'], row))
+            node['services'] = services.get(node['id'], [])
+            nodes.append(node)
+        return json.dumps(nodes), ["Node", "Service"]
+    return cached_response(build)
 
 
 @app.route("/node/<int:id>", methods=["GET", "POST", "PATCH", "DELETE"])
 def node_id(id):
     if request.method == "GET":
-        db = sqlite3.connect(db_name)
+        db = get_db(read_only=True)
         cur = db.cursor()
         node = {}
         for row in cur.execute("SELECT * FROM Node WHERE Id=?;", [id]):
@@ -160,11 +230,10 @@ def node_id(id):
             cur2 = db.cursor()
             node['services'] = [dict(zip(['id', 'title', 'nodeId', 'workflowId', 'nodeServiceId', 'uniformServiceId'], row2))
                                 for row2 in cur2.execute("SELECT * FROM Service Where NodeId=?;", [node['id']])]
-        db.close()
         return json.dumps(node)
     elif request.method == "POST":
         node = request.get_json(force=True)
-        db = sqlite3.connect(db_name)
+        db = get_db()
         cur = db.cursor()
         node["services"] = requests.get(
             'http://'+node['ipAddress']+"/service").json()
@@ -176,20 +245,20 @@ def node_id(id):
                         [service['title'], node['id'], service['id'], service['uniformServiceId']])
 
         db.commit()
-        db.close()
+        response_cache.invalidate("Node", "Service")
         return json.dumps(node)
     elif request.method == "PATCH":
         node = request.get_json(force=True)
-        db = sqlite3.connect(db_name)
+        db = get_db()
         cur = db.cursor()
         cur.execute("UPDATE Node SET Title=? WHERE Id=?;",
                     [node['title'], id])
         node['id'] = cur.lastrowid
         db.commit()
-        db.close()
+        response_cache.invalidate("Node")
         return json.dumps(node)
     elif request.method == "DELETE":
-        db = sqlite3.connect(db_name)
+        db = get_db()
         cur = db.cursor()
         cur.execute("DELETE FROM Node WHERE Id=?;",
                     [id])
@@ -197,7 +266,7 @@ def node_id(id):
                     [id])
         node = {"id": id, "deleted": True}
         db.commit()
-        db.close()
+        response_cache.invalidate("Node", "Service")
         return json.dumps(node)
     return "{error:'Invalid method'}"
 
@@ -205,63 +274,59 @@ def node_id(id):
 @app.route("/workflow/<int:id>/service", methods=["GET", "POST", "DELETE"])
 def workflow_id_service(id):
     if request.method == "GET":
-        db = sqlite3.connect(db_name)
+        db = get_db(read_only=True)
         cur = db.cursor()
         workflow = [dict(zip(['id', 'title', 'nodeId', 'workflowId', 'nodeServiceId', 'uniformServiceId'], row))
-                    for row in cur.execute("SELECT * FROM Service WHERE WorkflowId=(?);", (id))]
-        db.commit()
-        db.close()
+                    for row in cur.execute("SELECT * FROM Service WHERE WorkflowId=?;", [id])]
         return json.dumps(workflow)
     elif request.method == "POST":
         service = request.get_json(force=True)
-        db = sqlite3.connect(db_name)
+        db = get_db()
         cur = db.cursor()
         cur.execute("INSERT INTO Service (Title,NodeId,WorkflowId,UniformServiceId) VALUES (?,?,?,?);",
                     [service['title'], 0, id, service['uniformServiceId']])
         service['id'] = cur.lastrowid
         service['workflowId'] = id
         db.commit()
-        db.close()
+        response_cache.invalidate("Service")
         return json.dumps(service)
     elif request.method == "DELETE":
-        db = sqlite3.connect(db_name)
+        db = get_db()
         cur = db.cursor()
         cur.execute("DELETE FROM Service WHERE WorkflowId=?;",
                     [id])
         service = {"workflowId": id, "deleted": True}
         db.commit()
-        db.close()
+        response_cache.invalidate("Service")
         return json.dumps(service)
     return "{error:'Invalid method'}"
 
 
 @app.route("/service")
 def service():
-    db = sqlite3.connect(db_name)
-    cur = db.cursor()
-    services = [dict(zip(['id', 'title', 'uniformServiceId'], row2)) for row2 in cur.execute(
-        "SELECT Id,Title,UniformServiceId FROM Service WHERE NodeId=0;")]
-    db.commit()
-    db.close()
-    return json.dumps(services)
+    def build():
+        db = get_db(read_only=True)
+        cur = db.cursor()
+        services = [dict(zip(['id', 'title', 'uniformServiceId'], row2)) for row2 in cur.execute(
+            "SELECT Id,Title,UniformServiceId FROM Service WHERE NodeId=0;")]
+        return json.dumps(services), ["Service"]
+    return cached_response(build)
 
 
 @app.route("/service/queueCount")
 def service_queuecount():
-    db = sqlite3.connect(db_name)
+    db = get_db(read_only=True)
     cur = db.cursor()
     count = 0
     for row2 in cur.execute(
             "SELECT COUNT(Id) FROM WorkflowExecution WHERE ExecutionState>=? AND ExecutionState<=?;", [STATE_QUEUED, STATE_STARTED]):
         count = row2[0]
-    db.commit()
-    db.close()
     return json.dumps({'count': count})
 
 
 @app.route("/service/<int:serviceId>/<int:nodeId>/<int:inputDataId>")
 def service_start(serviceId, nodeId, inputDataId):
-    db = sqlite3.connect(db_name)
+    db = get_db()
     cur = db.cursor()
     nodes = [dict(zip(['id', 'ipAddress', 'title', 'workflowId', 'nodeServiceId'], row)) for row in cur.execute(
         "SELECT Node.id,Node.IpAddress,Service.Title,Service.WorkflowId,Service.NodeServiceId FROM Node JOIN Service ON(Node.Id=Service.NodeId) WHERE Node.Id=? AND Service.Id=?;", [nodeId, serviceId])]
@@ -275,8 +340,7 @@ def service_start(serviceId, nodeId, inputDataId):
             inputData = dict(
                 zip(['id', 'title', 'dataTypeId', 'created'], row))
             cur2 = db.cursor()
-            inputData['values'] = [row2[0] for row2 in cur2.execute(
-                "SELECT Value FROM UnitData Where DataId=?;", [data['id']])]
+            inputData['values'] = loadValues(cur2, inputData['id'])
             cur2.close()
         node = nodes[0]
         res = requests.post(node['ipAddress']+"/service/"+node['nodeServiceId']+"/start", json={
@@ -291,135 +355,309 @@ def service_start(serviceId, nodeId, inputDataId):
         node.update(
             {"remote": res, "taskInstanceExecutionId": taskInstanceExecutionId})
         return json.dumps(node)
-    db.close()
     return json.dumps({"error": "nodeId not found"})
 
 
 @app.route("/service/<int:id>/start", methods=['POST'])
 def service_start_id(id):
-    db = sqlite3.connect(db_name)
-    cur = db.cursor()
+    """Starts a service on the input of the body, {'values': [...]} or {'dataId': id}, its other keys become params
+
+    The Data of the input and its LOADED execution are stored in one transaction, see insert_executions().
+    """
+    db = get_db()
     data = request.get_json(force=True)
+    workflows = [row for row in db.execute(
+        "SELECT WorkflowId,InputDataTypeId,Service.Title FROM Service JOIN Workflow ON Service.WorkflowId=Workflow.Id WHERE Service.Id=?;", [id])]
+    if len(workflows) == 0:
+        return json.dumps({"error": "serviceId not found"})
+    if not isinstance(data, dict) or not (isinstance(data.get('values'), list) or isinstance(data.get('dataId'), int)):
+        return json.dumps({"error": "input has neither values nor a dataId"})
     headers_list = request.headers.getlist("X-Forwarded-For")
-    data['remoteAddr'] = headers_list[0] if headers_list else request.remote_addr
-    workflow = [row2 for row2 in cur.execute(
-        "SELECT WorkflowId,InputDataTypeId,Service.Title FROM Service JOIN Workflow ON Service.WorkflowId=Workflow.Id WHERE Id=?;", [id])][0]
-    cur.execute("INSERT INTO WorkflowExecution (WorkflowId,ExecutionState,EntryTime) VALUES (?,?,?);", [
-                workflow[0], STATE_QUEUED, time()])
-    workflowExecutionId = cur.lastrowid
-    for key in data:
-        if key not in ['values']:
-            cur.execute("INSERT INTO WorkflowExecutionParams (WorkflowExecutionId,Title,Value) VALUES (?,?,?);", [
-                        workflowExecutionId, key, data[key]])
+    remoteAddr = headers_list[0] if headers_list else request.remote_addr
+    execution = {'workflowId': workflows[0][0], 'title': workflows[0][2]+"#"+str(workflows[0][0])+" Input",
+                 'dataTypeId': workflows[0][1], 'params': {'remoteAddr': remoteAddr}, 'id': None}
+    cur = db.cursor()
+    cur.execute("BEGIN IMMEDIATE;")
+    try:
+        workflowExecutionIds = insert_executions(cur, execution, [data])
+    except (ValueError, sqlite3.Error) as error:
+        db.rollback()
+        cur.close()
+        return json.dumps({"error": str(error)})
+    except Exception:
+        db.rollback()
+        cur.close()
+        raise
     db.commit()
+    cur.close()
+    notify()
+    return json.dumps({'workflowExecutionId': workflowExecutionIds[0], "title": workflows[0][2]})
+
+
+def end_service_execution(cur, taskExecutionId, values):
+    """Stores the output of a service execution and ends it, unless it already ended
+
+    :return: True if this call ended the execution
+    """
+    tasks = [row for row in cur.execute(
+        "SELECT Task.OutputDataTypeId, Task.Title FROM TaskInstanceExecution JOIN TaskInstance JOIN Task ON (TaskInstanceExecution.TaskInstanceId=TaskInstance.Id AND TaskInstance.TaskId = Task.Id) WHERE TaskInstanceExecution.Id=?;", [taskExecutionId])]
+    if len(tasks) == 0:
+        return False
+    # ending claims the execution, a repeated callback or the daemon's reconciliation finds it ENDED already
+    cur.execute("UPDATE TaskInstanceExecution SET OutputDataId=?,ExecutionState=?,EndTime=?,LeaseOwner=NULL,LeaseExpiry=NULL WHERE Id=? AND ExecutionState=?;", [
+                0, STATE_ENDED, time(), taskExecutionId, STATE_STARTED])
+    if cur.rowcount == 0:
+        return False
     cur.execute("INSERT INTO Data (Title, DataTypeId, Created) VALUES (?,?,?);",
-                [workflow[2]+"#"+str(workflow[0])+" Input", workflow[1], time()])
-    inputDataId = cur.lastrowid
-    for unitdata in data['values']:
-        cur.execute("INSERT INTO UnitData (DataId,Value) VALUES (?,?);",
-                    [inputDataId, unitdata])
-    cur.execute("UPDATE WorkflowExecution SET InputDataId=?,ExecutionState=? WHERE Id=?;", [
-                inputDataId, STATE_LOADED, workflowExecutionId])
-    db.commit()
-    db.close()
-    return json.dumps({'workflowExecutionId': workflowExecutionId, "title": workflow[2]})
+                [tasks[0][1]+"#"+str(taskExecutionId)+" Result", tasks[0][0], time()])
+    outputDataId = cur.lastrowid
+    storeValues(cur, outputDataId, values, packed=pack_data)
+    cur.execute("UPDATE TaskInstanceExecution SET OutputDataId=? WHERE Id=?;", [
+                outputDataId, taskExecutionId])
+    return True
 
 
 @app.route("/taskInstanceExecution/<int:taskExecutionId>/end", methods=['POST'])
 def service_callback(taskExecutionId):
-    db = sqlite3.connect(db_name)
+    db = get_db()
     cur = db.cursor()
     data = request.get_json(force=True)
-    tasks = [row for row in cur.execute(
-        "SELECT Task.OutputDataTypeId, Task.Title FROM TaskInstanceExecution JOIN TaskInstance JOIN Task ON (TaskInstanceExecution.TaskInstanceId=TaskInstance.Id AND TaskInstance.TaskId = Task.Id) WHERE TaskInstanceExecution.Id=?;"[taskExecutionId])]
-    if len(tasks) > 0:
-        cur.execute("INSERT INTO Data (Title, DataTypeId, Created) VALUES (?,?,?);",
-                    [tasks[1]+"#"+str(taskExecutionId)+" Result", tasks[0], time()])
-        outputDataId = cur.lastrowid
-        for unitdata in data['values']:
-            cur.execute("INSERT INTO UnitData (DataId,Value) VALUES (?,?);",
-                        [outputDataId, unitdata])
-        cur.execute("UPDATE TaskInstanceExecution SET OutputDataId=?,ExecutionState=? WHERE Id=?;", [
-                    outputDataId, STATE_ENDED, taskExecutionId])
-    db.close()
+    end_service_execution(cur, taskExecutionId, data['values'])
+    db.commit()
+    notify()
     return json.dumps({"success": "True"})
 
 
+@app.route("/taskInstanceExecution/end", methods=['POST'])
+def service_callback_batch():
+    """Ends the service executions of a batched callback, {'results': [{'taskInstanceExecutionId', 'values'}]}, in one transaction"""
+    db = get_db()
+    cur = db.cursor()
+    data = request.get_json(force=True)
+    ended = [result['taskInstanceExecutionId'] for result in data['results']
+             if end_service_execution(cur, result['taskInstanceExecutionId'], result['values'])]
+    db.commit()
+    notify()
+    return json.dumps({"success": "True", "ended": ended})
+
+
+# execution tables listed by /service/execution, by type: the workflow executions started on this node
+# and the services this node started on other nodes, which have no task instance
+EXECUTION_SOURCES = {
+    1: ("SELECT Execution.Id,Execution.WorkflowId,Execution.ExecutionState,Execution.EntryTime,Execution.StartTime,Execution.EndTime,Execution.InputDataId,Execution.OutputDataId,1,Workflow.Title FROM WorkflowExecution AS Execution LEFT JOIN Workflow ON Workflow.Id=Execution.WorkflowId",
+        "WorkflowExecution", "SELECT WorkflowExecutionId,Title,Value FROM WorkflowExecutionParams WHERE WorkflowExecutionId IN "),
+    2: ("SELECT Execution.Id,Execution.TaskInstanceId,Execution.ExecutionState,Execution.EntryTime,Execution.StartTime,Execution.EndTime,Execution.InputDataId,Execution.OutputDataId,2,NULL FROM TaskInstanceExecution AS Execution",
+        "TaskInstanceExecution", "SELECT TaskInstanceExecutionId,Title,Value FROM TaskInstanceExecutionParams WHERE TaskInstanceExecutionId IN "),
+}
+# executions of an unlimited /service/execution listing read per batch
+EXECUTION_BATCH_SIZE = 100
+EXECUTION_MAX_LIMIT = 1000
+
+
+def execution_filters(args, executionType):
+    """Builds the conditions on one execution table from the query parameters of a listing
+
+    :return: (conditions, params), None if the filters exclude the table
+    """
+    if args.get('type', type=int) not in [None, executionType]:
+        return None
+    conditions = ["Execution.TaskInstanceId=0"] if executionType == 2 else []
+    params = []
+    if args.get('workflowId', type=int) is not None:
+        if executionType != 1:
+            return None
+        conditions.append("Execution.WorkflowId=?")
+        params.append(args.get('workflowId', type=int))
+    if args.get('batchId', type=int) is not None:
+        if executionType != 1:
+            return None
+        conditions.append("Execution.BatchId=?")
+        params.append(args.get('batchId', type=int))
+    if args.get('executionState'):
+        states = [int(state) for state in args['executionState'].split(",")]
+        conditions.append(
+            "Execution.ExecutionState IN ("+",".join(["?"]*len(states))+")")
+        params.extend(states)
+    if args.get('entryAfter', type=float) is not None:
+        conditions.append("Execution.EntryTime>=?")
+        params.append(args.get('entryAfter', type=float))
+    if args.get('entryBefore', type=float) is not None:
+        conditions.append("Execution.EntryTime<?")
+        params.append(args.get('entryBefore', type=float))
+    return conditions, params
+
+
+def execution_page(cur, args, cursor, count):
+    """Reads the count executions following the cursor, newest first, with their titles and params
+
+    Executions are ordered by (entryTime, type, executionId) descending, each table is read through
+    its EntryTime index from the cursor on and the two are merged.
+
+    :param cursor: (entryTime, type, executionId) of the last execution of the previous page, None to start from the newest
+    """
+    executions = []
+    for executionType, (query, table, paramsQuery) in EXECUTION_SOURCES.items():
+        filters = execution_filters(args, executionType)
+        if filters is None:
+            continue
+        conditions, params = filters
+        if cursor is not None:
+            entryTime, cursorType, executionId = cursor
+            if executionType < cursorType:
+                conditions.append("Execution.EntryTime<=?")
+                params.append(entryTime)
+            elif executionType == cursorType:
+                conditions.append(
+                    "(Execution.EntryTime<? OR (Execution.EntryTime=? AND Execution.Id<?))")
+                params.extend([entryTime, entryTime, executionId])
+            else:
+                conditions.append("Execution.EntryTime<?")
+                params.append(entryTime)
+        executions.extend([dict(zip(['executionId', 'referenceId', 'executionState', 'entryTime', 'startTime', 'endTime', 'inputDataId', 'outputDataId', 'type', 'title'], row))
+                           for row in cur.execute(query+(" WHERE "+" AND ".join(conditions) if len(conditions) > 0 else "") +
+                                                  " ORDER BY Execution.EntryTime DESC, Execution.Id DESC LIMIT ?;", params+[count])])
+    executions.sort(key=lambda execution: (
+        execution['entryTime'], execution['type'], execution['executionId']), reverse=True)
+    executions = executions[:count]
+    for executionType, (query, table, paramsQuery) in EXECUTION_SOURCES.items():
+        byId = dict([(execution['executionId'], execution)
+                    for execution in executions if execution['type'] == executionType])
+        if len(byId) == 0:
+            continue
+        for row in cur.execute(paramsQuery+"("+",".join(["?"]*len(byId))+");", list(byId)):
+            byId[row[0]][row[1]] = row[2]
+    for execution in executions:
+        if execution['title'] is None:
+            del execution['title']
+    return executions
+
+
+def execution_cursor(execution):
+    return repr(execution['entryTime'])+","+str(execution['type'])+","+str(execution['executionId'])
+
+
 @app.route("/service/execution")
 def service_execution():
-    db = sqlite3.connect(db_name)
+    """Lists the executions of this node newest first, with their titles and params
+
+    Query parameters: executionState, a comma separated list, workflowId, batchId, type, 1 for workflow
+    executions or 2 for services started on other nodes, entryAfter, entryBefore, limit and cursor, the
+    X-Next-Cursor header of the previous page. With summary=1 only the count of executions per type and
+    state is returned. Without a limit every execution is streamed.
+    """
+    db = get_db(read_only=True)
     cur = db.cursor()
-    executions = []
-    for row in cur.execute(
-            "SELECT * FROM (SELECT Id,WorkflowId,ExecutionState,EntryTime,StartTime,EndTime,InputDataId,OutputDataId,1 FROM WorkflowExecution UNION SELECT Id,TaskInstanceId,ExecutionState,EntryTime,StartTime,EndTime,InputDataId,OutputDataId,2 FROM TaskInstanceExecution WHERE TaskInstanceId=0) ORDER BY EntryTime DESC;"):
-        execution = dict(zip(['executionId', 'referenceId', 'executionState', 'entryTime',
-                              'startTime', 'endTime', 'inputDataId', 'outputDataId', 'type'], row))
-        cur2 = db.cursor()
-        if execution['type'] == 1:
-            execution['title'] = [row2[0] for row2 in cur2.execute(
-                "SELECT Title FROM Workflow WHERE Id=? ORDER BY Id ASC;", [execution['referenceId']])][0]
-            execution.update(dict([row2 for row2 in cur2.execute(
-                "SELECT Title,Value FROM WorkflowExecutionParams WHERE WorkflowExecutionId=?;", [execution['referenceId']])]))
-        elif execution['type'] == 2:
-            execution.update(dict([row2 for row2 in cur2.execute(
-                "SELECT Title,Value FROM TaskInstanceExecutionParams WHERE TaskInstanceExecutionId=?;", [execution['referenceId']])]))
-        executions.append(execution)
-    db.commit()
-    db.close()
-    return json.dumps(executions)
+    if request.args.get('summary') in ["1", "true"]:
+        counts = []
+        for executionType, (query, table, paramsQuery) in EXECUTION_SOURCES.items():
+            filters = execution_filters(request.args, executionType)
+            if filters is None:
+                continue
+            conditions, params = filters
+            counts.extend([{'type': executionType, 'executionState': row[0], 'count': row[1]} for row in cur.execute(
+                "SELECT Execution.ExecutionState,COUNT(*) FROM "+table+" AS Execution" +
+                (" WHERE "+" AND ".join(conditions) if len(conditions) > 0 else "")+" GROUP BY Execution.ExecutionState;", params)])
+        return json.dumps(counts)
+    cursor = None
+    if request.args.get('cursor'):
+        entryTime, executionType, executionId = request.args['cursor'].split(
+            ",")
+        cursor = (float(entryTime), int(executionType), int(executionId))
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(limit, EXECUTION_MAX_LIMIT))
+        executions = execution_page(cur, request.args, cursor, limit+1)
+        headers = {}
+        if len(executions) > limit:
+            headers['X-Next-Cursor'] = execution_cursor(executions[limit-1])
+        return Response(json.dumps(executions[:limit]), headers=headers, mimetype="application/json")
+    args = request.args
+
+    def generate():
+        nextCursor = cursor
+        yield "["
+        first = True
+        while True:
+            executions = execution_page(
+                cur, args, nextCursor, EXECUTION_BATCH_SIZE)
+            if len(executions) == 0:
+                break
+            yield ("" if first else ",")+json.dumps(executions)[1:-1]
+            first = False
+            nextCursor = (executions[-1]['entryTime'],
+                          executions[-1]['type'], executions[-1]['executionId'])
+        yield "]"
+    return Response(stream_with_context(generate()), mimetype="application/json")
 
 
 @app.route("/service/execution/<int:workflowExecutionId>")
 def service_execution_id(workflowExecutionId):
-    db = sqlite3.connect(db_name)
+    db = get_db(read_only=True)
     cur = db.cursor()
-    execution = [dict(zip(['workflowExecutionId', 'executionState', 'entryTime', 'startTime', 'endTime'], row2)) for row2 in cur.execute(
+    executions = [dict(zip(['workflowExecutionId', 'executionState', 'entryTime', 'startTime', 'endTime'], row2)) for row2 in cur.execute(
         "SELECT Id,ExecutionState,EntryTime,StartTime,EndTime FROM WorkflowExecution WHERE Id=?;", [workflowExecutionId])]
+    if len(executions) == 0:
+        return json.dumps({"error": "workflowExecutionId not found"})
+    execution = executions[0]
     if execution['executionState'] == STATE_ENDED or execution['executionState'] == STATE_MARKED:
         outputDataId = [row2[0] for row2 in cur.execute(
             "SELECT OutputDataId FROM WorkflowExecution WHERE Id=?;", [workflowExecutionId])]
-        execution['outputDataValues'] = [row2[0] for row2 in cur.execute(
-            "SELECT Value FROM UnitData WHERE DataId=? ORDER BY Id ASC;", [outputDataId[0]])]
-    db.commit()
-    db.close()
+        execution['outputDataValues'] = loadValues(cur, outputDataId[0])
     return json.dumps(execution)
 
 
+def fail_waiting_executions(cur, workflowExecutionId):
+    """Fails the map, filter or workflow task waiting for a workflow execution that won't end, with its own workflow execution"""
+    for param in cur.execute("SELECT Value FROM WorkflowExecutionParams WHERE WorkflowExecutionId=? AND Title IN ('taskInstanceExecutionId','mapTaskInstanceExecutionId');", [workflowExecutionId]).fetchall():
+        for row in cur.execute("UPDATE TaskInstanceExecution SET ExecutionState=?,EndTime=? WHERE Id=? AND ExecutionState=? RETURNING WorkflowExecutionId;", [
+                STATE_FAILED, time(), int(param[0]), STATE_STARTED]).fetchall():
+            cur.execute("UPDATE WorkflowExecution SET ExecutionState=?,EndTime=? WHERE Id=?;", [
+                        STATE_FAILED, time(), row[0]])
+            cur.execute("UPDATE TaskInstanceExecution SET ExecutionState=?,EndTime=? WHERE WorkflowExecutionId=?;", [
+                        STATE_FAILED, time(), row[0]])
+            fail_waiting_executions(cur, row[0])
+
+
 @app.route("/service/execution/<int:workflowExecutionId>/kill")
 def service_kill(workflowExecutionId):
-    db = sqlite3.connect(db_name)
+    db = get_db()
     cur = db.cursor()
     cur.execute("UPDATE WorkflowExecution SET ExecutionState=? WHERE Id=?;", [
                 STATE_KILLED, workflowExecutionId])
     cur.execute("UPDATE TaskInstanceExecution SET ExecutionState=? WHERE WorkFlowExecutionId=?;", [
                 STATE_KILLED, workflowExecutionId])
+    fail_waiting_executions(cur, workflowExecutionId)
     db.commit()
-    db.close()
     return json.dumps({'workflowExecutionId': workflowExecutionId, 'executionState': STATE_KILLED})
 
 
-@app.route("/task")
-def task():
-    db = sqlite3.connect(db_name)
-    cur = db.cursor()
+def read_tasks(cur, workflowId=None):
+    """Reads the tasks with their params, of every workflow or of the task instances of one"""
+    instances = "(SELECT TaskId FROM TaskInstance WHERE WorkflowId=?)"
+    args = [workflowId] if workflowId is not None else []
+    params = {}
+    for row in cur.execute("SELECT TaskId,Title,Value FROM TaskParam"+(" WHERE TaskId IN "+instances if workflowId is not None else "")+" ORDER BY TaskId,Title,Value;", args):
+        params.setdefault(row[0], []).append(row[1:])
     tasks = []
-    for row in cur.execute("SELECT * FROM Task;"):
+    for row in cur.execute("SELECT * FROM Task"+(" WHERE Id IN "+instances if workflowId is not None else "")+";", args):
         task = dict(
             zip(['id', 'title', 'type', 'inputDataTypeId', 'outputDataTypeId'], row))
-        cur2 = db.cursor()
-        for row2 in cur2.execute("SELECT Title,Value FROM TaskParam WHERE TaskId=?;", [task['id']]):
-            task[row2[0]] = row2[1]
+        task.update(params.get(task['id'], []))
         tasks.append(task)
-        cur2.close()
-    db.commit()
-    db.close()
-    return json.dumps(tasks)
+    return tasks
+
+
+@app.route("/task")
+def task():
+    def build():
+        return json.dumps(read_tasks(get_db(read_only=True).cursor())), ["Task"]
+    return cached_response(build)
 
 
 @app.route("/task/<int:id>", methods=["GET", "POST", "DELETE"])
 def task_id(id):
     if request.method == "GET":
-        db = sqlite3.connect(db_name)
+        db = get_db(read_only=True)
         cur = db.cursor()
         task = None
         for row in cur.execute("SELECT * FROM Task WHERE Id=?;", [id]):
@@ -429,12 +667,10 @@ def task_id(id):
             for row2 in cur2.execute("SELECT Title,Value FROM TaskParam WHERE TaskId=?;", [task['id']]):
                 task[row2[0]] = row2[1]
             cur2.close()
-        db.commit()
-        db.close()
         return json.dumps(task)
     elif request.method == "POST":
         task = request.get_json(force=True)
-        db = sqlite3.connect(db_name)
+        db = get_db()
         cur = db.cursor()
         if int(id) == 0:
             cur.execute("INSERT INTO Task (Title,Type,InputDataTypeId,OutputDataTypeId) VALUES (?,?,?,?);",
@@ -446,59 +682,69 @@ def task_id(id):
             task['id'] = id
             cur.execute("DELETE FROM TaskParam WHERE TaskId=?;",
                         [id])
+            bump_task_revision(cur, id)
         for title, value in task.items():
             if not title in ['id', 'title', 'type', 'inputDataTypeId', 'outputDataTypeId']:
                 cur.execute("INSERT INTO TaskParam (Title,Value,TaskId) VALUES (?,?,?);", [
                             title, value, task['id']])
         db.commit()
-        db.close()
+        response_cache.invalidate("Task", "Task:"+str(task['id']))
         return json.dumps(task)
     elif request.method == "DELETE":
-        db = sqlite3.connect(db_name)
+        db = get_db()
         cur = db.cursor()
         cur.execute("DELETE FROM Task WHERE Id=?;",
                     [id])
         cur.execute("DELETE FROM TaskParam WHERE TaskId=?;",
                     [id])
+        bump_task_revision(cur, id)
         task = {"id": id, "deleted": True}
         db.commit()
-        db.close()
+        response_cache.invalidate("Task", "Task:"+str(id))
         return json.dumps(task)
     return "{error:'Invalid method'}"
 
 
-@app.route("/workflow/<int:workflowId>/taskInstance")
-def taskInstance(workflowId):
-    db = sqlite3.connect(db_name)
-    cur = db.cursor()
+def read_task_instances(cur, workflowId):
+    """Reads the task instances of a workflow with the definitions of their tasks
+
+    :return: (task instances, ids of their tasks)
+    """
+    workflow = cur.execute("SELECT InputDataTypeId,OutputDataTypeId FROM Workflow WHERE Id=?;", [
+                           workflowId]).fetchone()
+    definitions = dict([(row[0], dict(zip(['taskId', 'title', 'type', 'inputDataTypeId', 'outputDataTypeId'], row))) for row in cur.execute(
+        "SELECT * FROM Task WHERE Id IN (SELECT TaskId FROM TaskInstance WHERE WorkflowId=?);", [workflowId])])
     tasks = []
     start = True
     for row in cur.execute("SELECT * FROM TaskInstance WHERE WorkflowId=?;", [workflowId]):
         task = dict(
             zip(['id', 'workflowId', 'taskId', 'screenX', 'screenY'], row))
-        cur2 = db.cursor()
         if task['taskId'] == 0:
-            for row2 in cur2.execute("SELECT InputDataTypeId,OutputDataTypeId FROM Workflow WHERE Id=?;", [workflowId]):
+            if workflow is not None:
                 task['title'] = "start" if start else "end"
                 task['type'] = TASK_TERMINAL
-                task['outputDataTypeId'] = row2[0] if start else 0
-                task['inputDataTypeId'] = 0 if start else row2[1]
+                task['outputDataTypeId'] = workflow[0] if start else 0
+                task['inputDataTypeId'] = 0 if start else workflow[1]
             start = False
         else:
-            for row2 in cur2.execute("SELECT * FROM Task WHERE Id=?;", [task['taskId']]):
-                task.update(dict(
-                    zip(['taskId', 'title', 'type', 'inputDataTypeId', 'outputDataTypeId'], row2)))
+            task.update(definitions.get(task['taskId'], {}))
         tasks.append(task)
-        cur2.close()
-    db.commit()
-    db.close()
-    return json.dumps(tasks)
+    return tasks, list(definitions)
+
+
+@app.route("/workflow/<int:workflowId>/taskInstance")
+def taskInstance(workflowId):
+    def build():
+        tasks, taskIds = read_task_instances(
+            get_db(read_only=True).cursor(), workflowId)
+        return json.dumps(tasks), ["Workflow:"+str(workflowId), "TaskInstance:"+str(workflowId)] + ["Task:"+str(taskId) for taskId in taskIds]
+    return cached_response(build)
 
 
 @app.route("/taskInstance/<int:id>", methods=["GET", "POST", "DELETE"])
 def taskInstance_id(id):
     if request.method == "GET":
-        db = sqlite3.connect(db_name)
+        db = get_db(read_only=True)
         cur = db.cursor()
         task = None
         for row in cur.execute("SELECT * FROM TaskInstance WHERE Id=?;", [id]):
@@ -519,29 +765,32 @@ def taskInstance_id(id):
                     task.update(dict(
                         zip(['taskId', 'title', 'type', 'inputDataTypeId', 'outputDataTypeId'], row2)))
             cur2.close()
-        db.commit()
-        db.close()
         return json.dumps(task)
     elif request.method == "POST":
         task = request.get_json(force=True)
-        db = sqlite3.connect(db_name)
+        db = get_db()
         cur = db.cursor()
         if int(id) == 0:
             cur.execute("INSERT INTO TaskInstance (WorkflowId,TaskId,ScreenX,ScreenY) VALUES (?,?,?,?);",
                         [task['workflowId'], task['taskId'], task['screenX'], task['screenY']])
             task['id'] = cur.lastrowid
+            bump_workflow_revision(cur, task['workflowId'])
+            workflowIds = [task['workflowId']]
         else:
-            cur.execute("UPDATE TaskInstance SET ScreenX=?, ScreenY=? WHERE Id=?;",
-                        [task['screenX'], task['screenY'], id])
+            workflowIds = [row[0] for row in cur.execute("UPDATE TaskInstance SET ScreenX=?, ScreenY=? WHERE Id=? RETURNING WorkflowId;",
+                                                         [task['screenX'], task['screenY'], id]).fetchall()]
             task['id'] = id
         db.commit()
-        db.close()
+        response_cache.invalidate(
+            *["TaskInstance:"+str(workflowId) for workflowId in workflowIds])
         return json.dumps(task)
     elif request.method == "DELETE":
-        db = sqlite3.connect(db_name)
+        db = get_db()
         cur = db.cursor()
-        cur.execute("DELETE FROM TaskInstance WHERE Id=?;",
-                    [id])
+        workflowIds = [row[0] for row in cur.execute("DELETE FROM TaskInstance WHERE Id=? RETURNING WorkflowId;",
+                                                     [id]).fetchall()]
+        for workflowId in workflowIds:
+            bump_workflow_revision(cur, workflowId)
         for row in cur.execute("DELETE FROM Edge WHERE TaskInstanceId1=? OR TaskInstanceId2=? RETURNING DataIndexId1,DataIndexId2;",
                                [id, id]):
             cur.execute("DELETE FROM DataIndex WHERE Id=? OR Id=?;", row)
@@ -549,35 +798,38 @@ def taskInstance_id(id):
                 "DELETE FROM DataIndexValue WHERE DataIndexId=? OR DataIndexId=?;", row)
         task = {"id": id, "deleted": True}
         db.commit()
-        db.close()
+        response_cache.invalidate(*[tag for workflowId in workflowIds
+                                    for tag in ["TaskInstance:"+str(workflowId), "Edge:"+str(workflowId)]])
         return json.dumps(task)
     return "{error:'Invalid method'}"
 
 
-@app.route("/workflow/<int:workflowId>/edge")
-def edge(workflowId):
-    db = sqlite3.connect(db_name)
-    cur = db.cursor()
+def read_edges(cur, workflowId):
+    """Reads the edges of a workflow with their data indices"""
+    indexes = {}
+    for row in cur.execute("SELECT DataIndexId,Value FROM DataIndexValue WHERE DataIndexId IN (SELECT DataIndexId1 FROM Edge WHERE WorkflowId=? UNION SELECT DataIndexId2 FROM Edge WHERE WorkflowId=?) ORDER BY DataIndexId,Value;", [workflowId, workflowId]):
+        indexes.setdefault(row[0], []).append(row[1])
     edges = []
     for row in cur.execute("SELECT * FROM Edge WHERE WorkflowId=?;", [workflowId]):
         edge = dict(
             zip(['id', 'workflowId', 'taskInstanceId1', 'dataIndexId1', 'taskInstanceId2', 'dataIndexId2'], row))
-        cur2 = db.cursor()
-        edge['dataIndex1'] = [row2[0] for row2 in cur2.execute(
-            "SELECT Value FROM DataIndexValue WHERE DataIndexId=?;", [edge['dataIndexId1']])]
-        edge['dataIndex2'] = [row2[0] for row2 in cur2.execute(
-            "SELECT Value FROM DataIndexValue WHERE DataIndexId=?;", [edge['dataIndexId2']])]
-        cur2.close()
+        edge['dataIndex1'] = indexes.get(edge['dataIndexId1'], [])
+        edge['dataIndex2'] = indexes.get(edge['dataIndexId2'], [])
         edges.append(edge)
-    db.commit()
-    db.close()
-    return json.dumps(edges)
+    return edges
+
+
+@app.route("/workflow/<int:workflowId>/edge")
+def edge(workflowId):
+    def build():
+        return json.dumps(read_edges(get_db(read_only=True).cursor(), workflowId)), ["Edge:"+str(workflowId)]
+    return cached_response(build)
 
 
 @app.route("/edge/<int:id>", methods=["GET", "POST", "DELETE"])
 def edge_id(id):
     if request.method == "GET":
-        db = sqlite3.connect(db_name)
+        db = get_db(read_only=True)
         cur = db.cursor()
         edge = None
         for row in cur.execute("SELECT * FROM Edge WHERE Id=?;", [id]):
@@ -589,12 +841,10 @@ def edge_id(id):
             edge['dataIndex2'] = [row2[0] for row2 in cur2.execute(
                 "SELECT Value FROM DataIndexValue WHERE DataIndexId=?;", [edge['dataIndexId2']])]
             cur2.close()
-        db.commit()
-        db.close()
         return json.dumps(edge)
     elif request.method == "POST":
         edge = request.get_json(force=True)
-        db = sqlite3.connect(db_name)
+        db = get_db()
         cur = db.cursor()
         if int(id) == 0:
             cur.execute("INSERT INTO DataIndex (Id) VALUES (null);")
@@ -605,6 +855,8 @@ def edge_id(id):
                         [edge['workflowId'], edge['taskInstanceId1'], edge['dataIndexId1'], edge['taskInstanceId2'], edge['dataIndexId2']])
             edge['id'] = cur.lastrowid
         else:
+            for row in cur.execute("SELECT WorkflowId FROM Edge WHERE Id=?;", [id]).fetchall():
+                edge['workflowId'] = row[0]
             cur.execute("DELETE FROM DataIndexValue WHERE DataIndexId=?;",
                         [edge['dataIndexId1']])
             cur.execute("DELETE FROM DataIndexValue WHERE DataIndexId=?;",
@@ -615,12 +867,16 @@ def edge_id(id):
         for index in edge['dataIndex2']:
             cur.execute("INSERT INTO DataIndexValue (DataIndexId,Value) VALUES (?,?);", [
                         edge['dataIndexId2'], index])
+        if 'workflowId' in edge:
+            bump_workflow_revision(cur, edge['workflowId'])
         db.commit()
-        db.close()
+        if 'workflowId' in edge:
+            response_cache.invalidate("Edge:"+str(edge['workflowId']))
         return json.dumps(edge)
     elif request.method == "DELETE":
-        db = sqlite3.connect(db_name)
+        db = get_db()
         cur = db.cursor()
+        workflowIds = []
         for row in cur.execute("SELECT * FROM Edge WHERE Id=?;", [id]):
             edge = dict(
                 zip(['id', 'workflowId', 'taskInstanceId1', 'dataIndexId1', 'taskInstanceId2', 'dataIndexId2'], row))
@@ -630,98 +886,522 @@ def edge_id(id):
                         edge['dataIndexId1'], edge['dataIndexId2']])
             cur.execute("DELETE FROM DataIndexValue WHERE DataIndexId=? OR DataIndexId=?;", [
                         edge['dataIndexId1'], edge['dataIndexId2']])
+            bump_workflow_revision(cur, edge['workflowId'])
+            workflowIds.append(edge['workflowId'])
         edge = {"id": id, "deleted": True}
         db.commit()
-        db.close()
+        response_cache.invalidate(
+            *["Edge:"+str(workflowId) for workflowId in workflowIds])
         return json.dumps(edge)
     return "{error:'Invalid method'}"
 
 
+def allocate_ids(cur, table, count):
+    """Reserves the next ids of an AUTOINCREMENT table, the transaction must hold the write lock"""
+    last = cur.execute("SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name=?),0);", [
+                       table]).fetchone()[0]
+    return list(range(last+1, last+1+count))
+
+
+@app.route("/workflow/<int:workflowId>/graph", methods=["GET", "POST"])
+def workflow_graph(workflowId):
+    """The whole graph of a workflow in one call
+
+    GET gives the workflow, its task instances, the tasks they instantiate with their params and its edges
+    with their data indices.
+
+    POST saves {'taskInstances', 'edges', 'deletedTaskInstances', 'deletedEdges', 'replace'} in one
+    transaction. Task instances and edges without an id or with a negative one are created, edges can
+    refer to the task instances created with them by their negative ids. The others are updated the way
+    POST /taskInstance/<id> and POST /edge/<id> update them. With replace, the task instances and edges
+    left out of the graph are deleted, except the start and end terminals, the edges of a deleted task
+    instance always are. Gives the ids the
+    created task instances and edges got by their negative ids.
+    """
+    if request.method == "GET":
+        def build():
+            cur = get_db(read_only=True).cursor()
+            workflow = None
+            for row in cur.execute("SELECT * FROM Workflow WHERE Id=?;", [workflowId]):
+                workflow = dict(
+                    zip(['id', 'title', 'inputDataTypeId', 'outputDataTypeId'], row))
+            taskInstances, taskIds = read_task_instances(cur, workflowId)
+            graph = {'workflow': workflow, 'taskInstances': taskInstances,
+                     'tasks': read_tasks(cur, workflowId), 'edges': read_edges(cur, workflowId)}
+            return json.dumps(graph), ["Workflow:"+str(workflowId), "TaskInstance:"+str(workflowId), "Edge:"+str(workflowId)] + ["Task:"+str(taskId) for taskId in taskIds]
+        return cached_response(build)
+    graph = request.get_json(force=True)
+    db = get_db()
+    cur = db.cursor()
+    cur.execute("BEGIN IMMEDIATE;")
+    existingTaskInstances = set()
+    terminals = set()
+    for row in cur.execute("SELECT Id,TaskId FROM TaskInstance WHERE WorkflowId=?;", [workflowId]):
+        existingTaskInstances.add(row[0])
+        if row[1] == 0:
+            terminals.add(row[0])
+    existingEdges = dict([(row[0], row[1:]) for row in cur.execute(
+        "SELECT Id,DataIndexId1,DataIndexId2,TaskInstanceId1,TaskInstanceId2 FROM Edge WHERE WorkflowId=?;", [workflowId])])
+    taskInstances = graph.get('taskInstances', [])
+    edges = graph.get('edges', [])
+
+    createdTaskInstances = [task for task in taskInstances
+                            if task.get('id') is None or task['id'] < 0]
+    updatedTaskInstances = [task for task in taskInstances
+                            if task.get('id') is not None and task['id'] >= 0]
+    for task in updatedTaskInstances:
+        if task['id'] not in existingTaskInstances:
+            return json.dumps({"error": "taskInstance "+str(task['id'])+" not in workflow"})
+    deletedTaskInstances = set(graph.get('deletedTaskInstances', [])) & existingTaskInstances
+    if graph.get('replace'):
+        deletedTaskInstances |= existingTaskInstances - terminals - \
+            set([task['id'] for task in updatedTaskInstances])
+    deletedTaskInstances -= set([task['id'] for task in updatedTaskInstances])
+
+    taskInstanceIds = {}
+    for task, taskInstanceId in zip(createdTaskInstances, allocate_ids(cur, "TaskInstance", len(createdTaskInstances))):
+        if task.get('id') is not None:
+            taskInstanceIds[task['id']] = taskInstanceId
+        task['id'] = taskInstanceId
+    remaining = (existingTaskInstances - deletedTaskInstances) | set(
+        taskInstanceIds.values())
+
+    createdEdges = [edge for edge in edges
+                    if edge.get('id') is None or edge['id'] < 0]
+    updatedEdges = [edge for edge in edges
+                    if edge.get('id') is not None and edge['id'] >= 0]
+    for edge in updatedEdges:
+        if edge['id'] not in existingEdges:
+            return json.dumps({"error": "edge "+str(edge['id'])+" not in workflow"})
+    for edge in createdEdges:
+        for end in ['taskInstanceId1', 'taskInstanceId2']:
+            edge[end] = taskInstanceIds.get(edge[end], edge[end])
+            if edge[end] not in remaining:
+                return json.dumps({"error": "taskInstance "+str(edge[end])+" not in workflow"})
+    deletedEdges = set(graph.get('deletedEdges', [])) & set(existingEdges)
+    if graph.get('replace'):
+        deletedEdges |= set(existingEdges) - \
+            set([edge['id'] for edge in updatedEdges])
+    deletedEdges |= set([edgeId for edgeId, (dataIndexId1, dataIndexId2, taskInstanceId1, taskInstanceId2) in existingEdges.items()
+                         if taskInstanceId1 in deletedTaskInstances or taskInstanceId2 in deletedTaskInstances])
+    for edge in updatedEdges:
+        if edge['id'] in deletedEdges:
+            return json.dumps({"error": "edge "+str(edge['id'])+" is deleted with its taskInstance"})
+
+    edgeIds = {}
+    dataIndexIds = allocate_ids(cur, "DataIndex", 2*len(createdEdges))
+    for edge, edgeId, dataIndexId1, dataIndexId2 in zip(createdEdges, allocate_ids(cur, "Edge", len(createdEdges)), dataIndexIds[0::2], dataIndexIds[1::2]):
+        if edge.get('id') is not None:
+            edgeIds[edge['id']] = edgeId
+        edge.update({'id': edgeId, 'dataIndexId1': dataIndexId1,
+                    'dataIndexId2': dataIndexId2})
+    for edge in updatedEdges:
+        edge['dataIndexId1'], edge['dataIndexId2'] = existingEdges[edge['id']][0:2]
+
+    deletedDataIndices = [(dataIndexId,) for edgeId in deletedEdges
+                          for dataIndexId in existingEdges[edgeId][0:2]]
+    cur.executemany("DELETE FROM Edge WHERE Id=?;", [
+                    (edgeId,) for edgeId in deletedEdges])
+    cur.executemany("DELETE FROM DataIndex WHERE Id=?;", deletedDataIndices)
+    cur.executemany(
+        "DELETE FROM DataIndexValue WHERE DataIndexId=?;", deletedDataIndices)
+    cur.executemany("DELETE FROM TaskInstance WHERE Id=?;", [
+                    (taskInstanceId,) for taskInstanceId in deletedTaskInstances])
+    cur.executemany("INSERT INTO TaskInstance (Id,WorkflowId,TaskId,ScreenX,ScreenY) VALUES (?,?,?,?,?);", [
+                    (task['id'], workflowId, task['taskId'], task['screenX'], task['screenY']) for task in createdTaskInstances])
+    cur.executemany("UPDATE TaskInstance SET ScreenX=?, ScreenY=? WHERE Id=?;", [
+                    (task['screenX'], task['screenY'], task['id']) for task in updatedTaskInstances])
+    cur.executemany("INSERT INTO DataIndex (Id) VALUES (?);", [(dataIndexId,)
+                    for dataIndexId in dataIndexIds])
+    cur.executemany("INSERT INTO Edge (Id,WorkflowId,TaskInstanceId1,DataIndexId1,TaskInstanceId2,DataIndexId2) VALUES (?,?,?,?,?,?);", [
+                    (edge['id'], workflowId, edge['taskInstanceId1'], edge['dataIndexId1'], edge['taskInstanceId2'], edge['dataIndexId2']) for edge in createdEdges])
+    cur.executemany("DELETE FROM DataIndexValue WHERE DataIndexId=?;", [(dataIndexId,) for edge in updatedEdges
+                                                                       for dataIndexId in [edge['dataIndexId1'], edge['dataIndexId2']]])
+    cur.executemany("INSERT INTO DataIndexValue (DataIndexId,Value) VALUES (?,?);", [(edge[dataIndexId], index) for edge in createdEdges+updatedEdges
+                                                                                    for dataIndexId, dataIndex in [('dataIndexId1', 'dataIndex1'), ('dataIndexId2', 'dataIndex2')]
+                                                                                    for index in edge.get(dataIndex, [])])
+    bump_workflow_revision(cur, workflowId)
+    db.commit()
+    response_cache.invalidate(
+        "TaskInstance:"+str(workflowId), "Edge:"+str(workflowId))
+    return json.dumps({'workflowId': workflowId, 'taskInstances': taskInstanceIds, 'edges': edgeIds})
+
+
+def data_filters(args):
+    """Builds the WHERE clause of a Data listing from its query parameters"""
+    conditions = []
+    params = []
+    if args.get('cursor', type=int) is not None:
+        conditions.append("Id<?")
+        params.append(args.get('cursor', type=int))
+    if args.get('dataTypeId', type=int) is not None:
+        conditions.append("DataTypeId=?")
+        params.append(args.get('dataTypeId', type=int))
+    if args.get('titlePrefix'):
+        conditions.append("substr(Title,1,?)=?")
+        params.extend([len(args['titlePrefix']), args['titlePrefix']])
+    if args.get('createdAfter', type=float) is not None:
+        conditions.append("Created>=?")
+        params.append(args.get('createdAfter', type=float))
+    if args.get('createdBefore', type=float) is not None:
+        conditions.append("Created<?")
+        params.append(args.get('createdBefore', type=float))
+    return (" WHERE "+" AND ".join(conditions) if len(conditions) > 0 else ""), params
+
+
 @app.route("/data")
 def data():
-    db = sqlite3.connect(db_name)
-    cur = db.cursor()
-    data = []
-    for row in cur.execute("SELECT * FROM Data ORDER BY Id DESC;"):
-        eachdata = dict(zip(['id', 'title', 'dataTypeId', 'created'], row))
+    """Lists Data newest first, streamed as a JSON array, or one object per line with format=ndjson
+
+    Query parameters: cursor, the Id to continue below, limit, dataTypeId, titlePrefix, createdAfter,
+    createdBefore, and values=0 to leave the values out. The rows of a page are sent in batches, each
+    with one query for its values. A limited listing with more rows gives the cursor of the next page in
+    the X-Next-Cursor header.
+    """
+    db = get_db(read_only=True)
+    where, params = data_filters(request.args)
+    limit = request.args.get('limit', type=int)
+    withValues = request.args.get('values', "1") not in ["0", "false"]
+    ndjson = request.args.get('format') == "ndjson"
+    headers = {}
+    if limit is not None:
+        limit = max(1, min(limit, DATA_MAX_LIMIT))
+        # the last Id of this page is the next cursor if another row follows it
+        last = db.execute("SELECT Id FROM Data"+where+" ORDER BY Id DESC LIMIT 2 OFFSET ?;",
+                          params+[limit-1]).fetchall()
+        if len(last) == 2:
+            headers['X-Next-Cursor'] = str(last[0][0])
+
+    def generate():
+        cur = db.cursor()
+        cur.execute("SELECT Id,Title,DataTypeId,Created FROM Data"+where+" ORDER BY Id DESC" +
+                    (" LIMIT ?;" if limit is not None else ";"), params+([limit] if limit is not None else []))
         cur2 = db.cursor()
-        eachdata['values'] = [row2[0] for row2 in cur2.execute(
-            "SELECT Value FROM UnitData Where DataId=?;", [eachdata['id']])]
-        data.append(eachdata)
+        first = True
+        if not ndjson:
+            yield "["
+        while True:
+            rows = cur.fetchmany(DATA_BATCH_SIZE)
+            if len(rows) == 0:
+                break
+            values = loadValuesBatch(
+                cur2, [row[0] for row in rows]) if withValues else None
+            chunk = []
+            for row in rows:
+                eachdata = dict(
+                    zip(['id', 'title', 'dataTypeId', 'created'], row))
+                if withValues:
+                    eachdata['values'] = values[row[0]]
+                chunk.append(eachdata)
+            if ndjson:
+                yield "".join([json.dumps(eachdata)+"\n" for eachdata in chunk])
+            else:
+                yield ("" if first else ",")+json.dumps(chunk)[1:-1]
+            first = False
+        if not ndjson:
+            yield "]"
         cur2.close()
-    db.commit()
-    db.close()
-    return json.dumps(data)
+        cur.close()
+    return Response(stream_with_context(generate()), headers=headers,
+                    mimetype="application/x-ndjson" if ndjson else "application/json")
 
 
 @app.route("/data/<int:id>", methods=["GET", "POST", "PATCH", "DELETE"])
 def data_id(id):
     if request.method == "GET":
-        db = sqlite3.connect(db_name)
+        db = get_db(read_only=True)
         cur = db.cursor()
         data = None
         for row in cur.execute("SELECT * FROM Data Where Id=?;", [id]):
-            eachdata = dict(zip(['id', 'title', 'dataTypeId', 'created'], row))
+            data = dict(zip(['id', 'title', 'dataTypeId', 'created'], row))
             cur2 = db.cursor()
-            eachdata['values'] = [row2[0] for row2 in cur2.execute(
-                "SELECT Value FROM UnitData Where DataId=?;", [eachdata['id']])]
-            data.append(eachdata)
+            data['values'] = loadValues(cur2, data['id'])
             cur2.close()
-        db.commit()
-        db.close()
         return json.dumps(data)
     elif request.method == "POST":
         data = request.get_json(force=True)
-        db = sqlite3.connect(db_name)
+        db = get_db()
         cur = db.cursor()
         _data = None
         for row in cur.execute("INSERT INTO Data (Title, DataTypeId, Created) VALUES (?,?,?) RETURNING *;",
                                [data['title'], data['dataTypeId'], time()]):
             _data = dict(zip(['id', 'title', 'dataTypeId', 'created'], row))
-        for unitdata in data['values']:
-            cur.execute("INSERT INTO UnitData (DataId,Value) VALUES (?,?);",
-                        [_data['id'], unitdata])
+        storeValues(cur, _data['id'], data['values'], packed=pack_data)
         _data['values'] = data['values']
         db.commit()
-        db.close()
         return json.dumps(_data)
     elif request.method == "PATCH":
         data = request.get_json(force=True)
-        db = sqlite3.connect(db_name)
+        db = get_db()
         cur = db.cursor()
         cur.execute("UPDATE Data SET Title=?, DataTypeId=? WHERE Id=?;",
                     [data['title'], data['dataTypeId'], id])
+        cur.execute("DELETE FROM TaskResultCache WHERE OutputDataId=?;", [id])
         data['id'] = id
         db.commit()
-        db.close()
         return json.dumps(data)
     elif request.method == "DELETE":
-        db = sqlite3.connect(db_name)
+        db = get_db()
         cur = db.cursor()
         cur.execute("DELETE FROM Data WHERE Id=?;",
                     [id])
         cur.execute("DELETE FROM UnitData WHERE DataId=?;",
                     [id])
+        cur.execute("DELETE FROM PackedData WHERE DataId=?;",
+                    [id])
+        cur.execute("DELETE FROM TaskResultCache WHERE OutputDataId=?;", [id])
         workflow = {"id": id, "deleted": True}
         db.commit()
-        db.close()
         return json.dumps(workflow)
     return "{error:'Invalid method'}"
 
 
+@app.route("/data/<int:id>/values", methods=["GET", "PUT"])
+def data_id_values(id):
+    """Streams the values of a Data row, GET sends them and PUT replaces them
+
+    Formats: ndjson, a line per element with its value, or a JSON array of its leaf values for elements of
+    several leaves; csv, a row per element; binary, the leaf values as little endian int64 or float64, for
+    data types whose leaves are all INT or all FLOAT. GET takes ?format=, ndjson by default, PUT the
+    Content-Type application/x-ndjson, text/csv or application/octet-stream, and reads ndjson lines of any
+    number of values and csv rows of any length.
+
+    PUT checks every value against the leaf layout of the data type as it arrives and stops at the first
+    that doesn't fit, the values of a data type the registry doesn't know are only checked to be leaves.
+    The checked body is spooled to a temporary file and written in one transaction once it was read
+    whole, a slow upload doesn't hold the write lock.
+    """
+    if request.method == "GET":
+        db = get_db(read_only=True)
+        format = request.args.get('format', FORMAT_NDJSON)
+        mimetypes = dict([(value, key) for key, value in VALUE_FORMATS.items()])
+        if format not in mimetypes:
+            return json.dumps({"error": "format is ndjson, csv or binary"})
+        rows = db.execute("SELECT DataTypeId FROM Data WHERE Id=?;", [
+                          id]).fetchall()
+        if len(rows) == 0:
+            return json.dumps({"error": "dataId not found"})
+        layout = value_layout(rows[0][0])
+        if format == FORMAT_BINARY and binaryTypecode(layout) is None:
+            return json.dumps({"error": "binary values need a data type whose leaves are all INT or all FLOAT"})
+
+        def generate():
+            values = loadStream(db, id)
+            if layout is not None:
+                values = castValues(values, layout)
+            yield from formatValues(values, format, layout)
+        return Response(stream_with_context(generate()), mimetype=mimetypes[format])
+    format = VALUE_FORMATS.get(request.mimetype)
+    if format is None:
+        return json.dumps({"error": "Content-Type is application/x-ndjson, text/csv or application/octet-stream"})
+    db = get_db()
+    cur = db.cursor()
+    rows = cur.execute("SELECT DataTypeId FROM Data WHERE Id=?;", [
+                       id]).fetchall()
+    if len(rows) == 0:
+        return json.dumps({"error": "dataId not found"})
+    layout = value_layout(rows[0][0])
+    typecode = binaryTypecode(layout)
+    if format == FORMAT_BINARY and typecode is None:
+        return json.dumps({"error": "binary values need a data type whose leaves are all INT or all FLOAT"})
+    with tempfile.TemporaryFile() as spool:
+        count = 0
+        try:
+            for batch in parseValues(spoolBlocks(readBlocks(request.stream), spool), format, layout):
+                count = count+len(batch)
+        except ValueError as error:
+            return json.dumps({"error": str(error), "id": id})
+        spool.seek(0)
+        cur.execute("BEGIN IMMEDIATE;")
+        cur.execute("DELETE FROM UnitData WHERE DataId=?;", [id])
+        cur.execute("DELETE FROM PackedData WHERE DataId=?;", [id])
+        cur.execute("DELETE FROM TaskResultCache WHERE OutputDataId=?;", [id])
+        storeStream(db, id, parseValues(readBlocks(spool), format, layout),
+                    count, typecode, packed=pack_data)
+        db.commit()
+    return json.dumps({'id': id, 'count': count})
+
+
 @app.route("/workflow/<int:workflowId>/<int:dataId>/execute")
 def workflow_execute(workflowId, dataId):
     workflowExecution = dict()
-    db = sqlite3.connect(db_name)
+    db = get_db()
     cur = db.cursor()
     cur.execute("INSERT INTO WorkflowExecution (WorkflowId, InputDataId, EntryTime, ExecutionState) VALUES (?,?,?,?);",
                 [workflowId, dataId, time(), STATE_LOADED])
     workflowExecution['id'] = cur.lastrowid
     db.commit()
-    db.close()
+    notify()
     return json.dumps(workflowExecution)
 
 
+def batch_inputs():
+    """Reads the inputs of a batch submission, a JSON array, or one input per line read as it arrives with an NDJSON content type"""
+    if request.mimetype in ["application/x-ndjson", "application/jsonl"]:
+        return (json.loads(line) for line in splitLines(readBlocks(request.stream)) if line.strip())
+    inputs = request.get_json(force=True)
+    if not isinstance(inputs, list):
+        raise ValueError("expected an array of inputs")
+    return inputs
+
+
+def batch_param(value):
+    """The stored value of an execution param, objects and arrays are kept as their JSON"""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def store_batch_chunk(db, batch, inputs):
+    """Stores the Data, UnitData, WorkflowExecution and WorkflowExecutionParams rows of some inputs of a batch in one transaction
+
+    Nothing of the chunk is stored if one of its inputs can't be.
+    """
+    cur = db.cursor()
+    cur.execute("BEGIN IMMEDIATE;")
+    try:
+        insert_batch_chunk(cur, batch, inputs)
+    except Exception:
+        db.rollback()
+        cur.close()
+        raise
+    db.commit()
+    cur.close()
+    notify()
+
+
+def insert_batch_chunk(cur, batch, inputs):
+    """Inserts the rows of store_batch_chunk() in the open transaction"""
+    insert_executions(cur, batch, inputs)
+    cur.execute("UPDATE Batch SET Submitted=Submitted+? WHERE Id=?;", [
+                len(inputs), batch['id']])
+
+
+def insert_executions(cur, batch, inputs):
+    """Inserts the Data, UnitData, LOADED WorkflowExecution and WorkflowExecutionParams rows of inputs in the open transaction
+
+    :param batch: workflowId, title and dataTypeId of the created Data, params of every execution, id of the batch or None
+    :return: the ids of the executions, in the order of the inputs
+    """
+    entryTime = time()
+    created = [input for input in inputs if 'values' in input]
+    for input, dataId in zip(created, allocate_ids(cur, "Data", len(created))):
+        input['dataId'] = dataId
+    cur.executemany("INSERT INTO Data (Id,Title,DataTypeId,Created) VALUES (?,?,?,?);", [
+                    (input['dataId'], batch['title'], batch['dataTypeId'], entryTime) for input in created])
+    storeValuesBatch(cur, [(input['dataId'], input['values'])
+                     for input in created], packed=pack_data)
+    workflowExecutionIds = allocate_ids(cur, "WorkflowExecution", len(inputs))
+    cur.executemany("INSERT INTO WorkflowExecution (Id,WorkflowId,InputDataId,EntryTime,ExecutionState,BatchId) VALUES (?,?,?,?,?,?);", [
+                    (workflowExecutionId, batch['workflowId'], input['dataId'], entryTime, STATE_LOADED, batch['id']) for workflowExecutionId, input in zip(workflowExecutionIds, inputs)])
+    cur.executemany("INSERT INTO WorkflowExecutionParams (WorkflowExecutionId,Title,Value) VALUES (?,?,?);", [
+                    (workflowExecutionId, key, batch_param(value)) for workflowExecutionId, input in zip(workflowExecutionIds, inputs)
+                    for key, value in dict(input, **batch['params']).items() if key not in ['values', 'dataId']])
+    return workflowExecutionIds
+
+
+def submit_batch(batch):
+    """Submits the inputs of the request as executions of one workflow, BATCH_CHUNK_SIZE inputs per transaction
+
+    Each input is {'values': [...]} to store as a new Data row, or {'dataId': id} to run on a stored one,
+    its other keys become params of its execution, objects and arrays as their JSON. The executions of a
+    chunk are LOADED as it commits, the daemon starts on them while the rest of the request is read. An
+    invalid input ends the submission, the chunks before its own stay submitted.
+
+    :param batch: workflowId, serviceId, title and dataTypeId of the created Data, params of every execution
+    """
+    db = get_db()
+    cur = db.cursor()
+    cur.execute("INSERT INTO Batch (WorkflowId,ServiceId,EntryTime) VALUES (?,?,?);", [
+                batch['workflowId'], batch['serviceId'], time()])
+    batch['id'] = cur.lastrowid
+    db.commit()
+    submitted = 0
+    chunk = []
+    try:
+        for input in batch_inputs():
+            if not isinstance(input, dict) or not (isinstance(input.get('values'), list) or isinstance(input.get('dataId'), int)):
+                raise ValueError("input "+str(submitted+len(chunk)) +
+                                 " has neither values nor a dataId")
+            chunk.append(input)
+            if len(chunk) == BATCH_CHUNK_SIZE:
+                store_batch_chunk(db, batch, chunk)
+                submitted = submitted+len(chunk)
+                chunk = []
+        if len(chunk) > 0:
+            store_batch_chunk(db, batch, chunk)
+            submitted = submitted+len(chunk)
+    except (ValueError, sqlite3.Error) as error:
+        return json.dumps({"error": str(error), "batchId": batch['id'], "submitted": submitted})
+    cur.execute("UPDATE Batch SET SubmitTime=? WHERE Id=?;",
+                [time(), batch['id']])
+    db.commit()
+    return json.dumps({'batchId': batch['id'], 'workflowId': batch['workflowId'], 'submitted': submitted})
+
+
+@app.route("/workflow/<int:workflowId>/batch", methods=['POST'])
+def workflow_batch(workflowId):
+    """Executes a workflow on every input of a JSON array or NDJSON stream, see submit_batch()"""
+    workflows = [row for row in get_db().execute(
+        "SELECT Title,InputDataTypeId FROM Workflow WHERE Id=?;", [workflowId])]
+    if len(workflows) == 0:
+        return json.dumps({"error": "workflowId not found"})
+    return submit_batch({'workflowId': workflowId, 'serviceId': None, 'title': workflows[0][0]+"#"+str(workflowId)+" Input",
+                         'dataTypeId': workflows[0][1], 'params': {}})
+
+
+@app.route("/service/<int:id>/batch", methods=['POST'])
+def service_batch(id):
+    """Starts a service on every input of a JSON array or NDJSON stream, each input is the body /service/<id>/start takes"""
+    workflows = [row for row in get_db().execute(
+        "SELECT WorkflowId,InputDataTypeId,Service.Title FROM Service JOIN Workflow ON Service.WorkflowId=Workflow.Id WHERE Service.Id=?;", [id])]
+    if len(workflows) == 0:
+        return json.dumps({"error": "serviceId not found"})
+    headers_list = request.headers.getlist("X-Forwarded-For")
+    remoteAddr = headers_list[0] if headers_list else request.remote_addr
+    return submit_batch({'workflowId': workflows[0][0], 'serviceId': id, 'title': workflows[0][2]+"#"+str(workflows[0][0])+" Input",
+                         'dataTypeId': workflows[0][1], 'params': {'remoteAddr': remoteAddr}})
+
+
+@app.route("/batch/<int:batchId>")
+def batch_id(batchId):
+    """Progress of a batch, the count of its executions in each state
+
+    pending counts the QUEUED, LOADED and STARTED executions, ended the ENDED and MARKED ones. A batch is
+    complete once all its inputs were submitted and none of its executions is pending, its endTime is then
+    that of its last execution. The executions themselves are listed by /service/execution?batchId=.
+    """
+    cur = get_db(read_only=True).cursor()
+    batch = None
+    for row in cur.execute("SELECT Id,WorkflowId,ServiceId,Submitted,EntryTime,SubmitTime FROM Batch WHERE Id=?;", [batchId]):
+        batch = dict(zip(['batchId', 'workflowId', 'serviceId',
+                     'submitted', 'entryTime', 'submitTime'], row))
+    if batch is None:
+        return json.dumps({"error": "batchId not found"})
+    batch.update({'executionStates': [], 'pending': 0, 'ended': 0,
+                 'failed': 0, 'killed': 0, 'startTime': None, 'endTime': None})
+    for state, count, startTime, endTime in cur.execute(
+            "SELECT ExecutionState,COUNT(*),MIN(StartTime),MAX(EndTime) FROM WorkflowExecution WHERE BatchId=? GROUP BY ExecutionState;", [batchId]):
+        batch['executionStates'].append(
+            {'executionState': state, 'count': count})
+        if state in [STATE_QUEUED, STATE_LOADED, STATE_STARTED]:
+            batch['pending'] = batch['pending']+count
+        elif state in [STATE_ENDED, STATE_MARKED]:
+            batch['ended'] = batch['ended']+count
+        elif state == STATE_FAILED:
+            batch['failed'] = batch['failed']+count
+        elif state == STATE_KILLED:
+            batch['killed'] = batch['killed']+count
+        if startTime is not None and (batch['startTime'] is None or startTime < batch['startTime']):
+            batch['startTime'] = startTime
+        if endTime is not None and (batch['endTime'] is None or endTime > batch['endTime']):
+            batch['endTime'] = endTime
+    batch['complete'] = batch['submitTime'] is not None and batch['pending'] == 0
+    if not batch['complete']:
+        batch['endTime'] = None
+    return json.dumps(batch)
+
+
 @app.route("/sitemap")
 def sitemap():
     routes = []